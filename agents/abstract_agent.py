@@ -5,15 +5,24 @@ import time
 import os, errno
 import yaml
 import logging, logging.config
-from collections import deque
 import socket
-from threading import Thread, Event
-from messaging.messaging import Message
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Event, Lock
+from messaging.buffers import BoundedBuffer, Marker
+from messaging.messaging import Message, StreamDecoder, PROTOCOL_YAML, PROTOCOL_BINARY, PROTOCOL_VERSION
+from messaging.trace import TraceRecorder, IN, OUT, SIDE_AGENT
+from messaging.transport import DataRing, TRANSPORT_TCP, TRANSPORTS, listen_socket
 from agents.constants import HWStates, AgentStatus
+from agents.durability import Durability, SegmentFile
+from agents.records import FORMAT_CSV, FORMAT_BINARY, OUTPUT_FORMATS, binary_file_name
 
 TCP_IP = '127.0.0.1'
 MGR_COMM_BUFFER = 1024
 DEFAULT_CONFIG_FILE = 'config.yaml'
+BUFFER_STATS_PERIOD = 10  # segundos entre envíos al manager de los contadores del buffer de datos
+DEFAULT_WRITE_BUFFER = 1024 * 1024  # bytes. Buffer del archivo de salida
+WRITER_WAIT = 0.5  # segundos máximos que el escritor espera datos antes de revisar el estado del agente
+RECORD_BATCH_INTERVAL = 0.1  # segundos mínimos entre lotes de registros: el formateo vectorizado rinde con lotes grandes
 
 
 class Flags:
@@ -34,30 +43,78 @@ class AbstractHWAgent(ABC):
         self.output_file_name = ''
         self.output_folder = ''
         self.flags = Flags()
-        self.state = AgentStatus.STARTING
-        self.hw_state = HWStates.NOT_CONNECTED
+        self.connection = None
+        self.__send_lock = Lock()  # Varios threads envían mensajes al manager
+        self.__state = AgentStatus.STARTING
+        self.__hw_state = HWStates.NOT_CONNECTED
         self.manager_ip_address = ("0.0.0.0", 0)  # (IP, port) del manager que envia los comandos
         self.listen_port = 0  # Puerto TCP donde escuchará los comandos
         self.config_file = config_file
         self.config_section = config_section
         self.config = dict()
         self.flag_quit = Event()    # Bandera para avisar que hay que terminar el programa
-        self.dq_formatted_data = deque()  # Deque que contiene la data formateada lista para escribir a disco
-        self.__sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.dq_formatted_data = BoundedBuffer()  # Data formateada lista para escribir a disco (ver buffers.py)
+        self.__sock = None
+        self.transport = TRANSPORT_TCP  # Transporte de la conexión con el manager (ver messaging/transport.py)
+        self.data_ring = None  # Anillo en memoria compartida para los mensajes DATA, si está habilitado
+        self.__data_ring_active = False  # El manager conectado ya está leyendo el anillo
+        self.trace_dir = None  # Si se configura, los mensajes con el manager se registran en una traza (ver trace.py)
+        self.trace = None
         self.local_tcp_port = ''
         self.manager_tcp_port = ''
-        self.connection = None
+        self.protocol = PROTOCOL_YAML  # Versión de protocolo negociada con el manager (ver messaging.py)
         self.current_folder = ''
         self.output_file_header = ''  # Debe ser redefinido por las clases que implementen la AbstractHWAgent
         self.output_file_is_binary = None
         self.output_file = None
+        # RecordFormat de los agentes que encolan en dq_formatted_data los valores de cada muestra (tupla, o registro
+        # ya empaquetado) en vez del texto. El escritor los formatea por lote según output_format (ver records.py)
+        self.record_format = None
+        self.output_format = FORMAT_CSV
+        self.write_buffer = DEFAULT_WRITE_BUFFER
+        self.durability = Durability()  # Sincronización a disco de los archivos de salida (ver durability.py)
+        # Contadores acumulados del escritor a disco: bytes, registros, lotes (escrituras), registros del lote más
+        # grande, tiempo total y máximo de escritura de un lote (s), tiempo total de formateo de registros (s) y
+        # registros perdidos por cierre del archivo o error de formato
+        self.writer_stats = dict(bytes=0, records=0, batches=0, max_batch=0, write_time=0.0, max_write_time=0.0,
+                                 format_time=0.0, lost=0)
+        self.__file_stats = dict(self.writer_stats)  # Contadores al abrir el archivo actual
+        self.__file_open_time = 0
+        # Apertura y cierre de archivos de segmento en segundo plano, en orden. Ver __update_capture_file
+        self.__segment_files = ThreadPoolExecutor(max_workers=1, thread_name_prefix="segment_files")
+        self.__next_files = dict()  # Ruta -> Future del archivo que se está abriendo para el segmento siguiente
+
+    @property
+    def state(self):
+        return self.__state
+
+    @state.setter
+    def state(self, value):
+        """
+        Cada cambio de estado se informa inmediatamente al manager
+        """
+        if value != self.__state:
+            self.__state = value
+            self.logger.debug(f"Cambiando estado a {value}")
+            self._send_msg_to_mgr(Message.agent_state(value))
+
+    @property
+    def hw_state(self):
+        return self.__hw_state
+
+    @hw_state.setter
+    def hw_state(self, value):
+        if value != self.__hw_state:
+            self.__hw_state = value
+            self.logger.debug(f"Cambiando estado de hardware a {value}")
+            self._send_msg_to_mgr(Message.agent_hw_state(value))
 
     def set_up(self):
         try:
             self.__configure()  # Los parámetros de comunicación los lee de la config también
             self.logger.info("Aplicación configurada e iniciando")
             try:
-                self.__sock.bind((TCP_IP, self.local_tcp_port))
+                self.__sock = listen_socket(self.transport, TCP_IP, self.local_tcp_port)
             except OSError as e:
                 if e.errno == errno.EADDRINUSE:
                     self.logger.error(f"Dirección ya está en uso: {TCP_IP}:{self.local_tcp_port}. Termina programa. \nFIN\n")
@@ -66,6 +123,15 @@ class AbstractHWAgent(ABC):
                 sys.exit(1)
             self.__sock.listen(0)
             self.__sock.setblocking(True)
+            if self.config.get("data_ring", False):
+                self.data_ring = DataRing()
+                self.logger.info(f"Mensajes de datos por memoria compartida ({self.data_ring.name})")
+            if self.trace_dir:
+                os.makedirs(self.trace_dir, exist_ok=True)
+                trace_file = f"{self.config_section}_{time.strftime('%Y.%m.%d_%H.%M.%S')}.trc"
+                trace_file = path.join(self.trace_dir, trace_file)
+                self.trace = TraceRecorder(trace_file, self.config_section[len("agent_"):], SIDE_AGENT)
+                self.logger.info(f"Registrando mensajes con el manager en {trace_file}")
         except KeyboardInterrupt:
             sys.exit(0)
 
@@ -85,13 +151,55 @@ class AbstractHWAgent(ABC):
         self.config = full_config[self.config_section]
         self.manager_tcp_port = self.config["manager_port"]
         self.local_tcp_port = self.config["local_port"]
+        self.transport = full_config.get("transport", TRANSPORT_TCP)
+        self.trace_dir = full_config.get("trace_dir")
+        self.write_buffer = int(self.config.get("write_buffer", full_config.get("write_buffer", DEFAULT_WRITE_BUFFER)))
+        if self.transport not in TRANSPORTS:
+            self.logger.error(f"Transporte desconocido: {self.transport}. Se usará {TRANSPORT_TCP}")
+            self.transport = TRANSPORT_TCP
+        # Config general de buffers, que cada agente puede redefinir en su sección
+        buffer_cfg = dict(full_config.get("buffers") or {})
+        buffer_cfg.update(self.config.get("buffer") or {})
+        try:
+            self.dq_formatted_data = BoundedBuffer.from_config(buffer_cfg, self.logger)
+        except ValueError:
+            self.logger.exception(f"Configuración de buffer inválida: {buffer_cfg}. Se usará un buffer sin límite")
+        durability_cfg = dict(full_config.get("durability") or {})
+        durability_cfg.update(self.config.get("durability") or {})
+        try:
+            self.durability = Durability.from_config(durability_cfg)
+        except ValueError:
+            self.logger.exception(f"Configuración de durabilidad inválida: {durability_cfg}. No se sincronizará")
         try:
             self.output_file_name = self.config["output_file_name"]
         except KeyError:
             pass
         self._agent_config()
+        if self.record_format is not None:
+            self.__configure_records()
+
+    def __configure_records(self):
+        """
+        Formato de salida de los agentes con record_format: csv, o registros binarios que se convierten al mismo CSV
+        """
+        self.output_format = self.config.get("output_format", FORMAT_CSV)
+        if self.output_format not in OUTPUT_FORMATS:
+            self.logger.error(f"Formato de salida '{self.output_format}' no válido. Debe ser uno de {OUTPUT_FORMATS}. "
+                              f"Se usará '{FORMAT_CSV}'")
+            self.output_format = FORMAT_CSV
+        self.output_file_is_binary = True  # El escritor entrega bytes en ambos formatos
+        if self.output_format == FORMAT_BINARY:
+            self.output_file_header = self.record_format.header()
+            self.output_file_name = binary_file_name(self.output_file_name)
+        else:
+            self.output_file_header = (self.record_format.csv_header + os.linesep).encode("utf-8")
 
     def __update_capture_file(self, new_file_path):
+        """
+        Cambio de segmento. Corre en el thread que recibe los mensajes del manager, y solo agenda la apertura del
+        archivo nuevo en segundo plano e intercala una marca en dq_formatted_data. Los registros encolados antes de la
+        marca van al archivo anterior, y los siguientes al nuevo. El escritor cambia de archivo al llegar a la marca
+        """
         self.logger.info(f"Cambio de directorio a {new_file_path}")
         self.output_folder = new_file_path
         if not self.output_file_name:   # Si no está definido el nombre de arrchivo (presumiblemente porque no se genera)
@@ -100,34 +208,120 @@ class AbstractHWAgent(ABC):
             self.logger.error("Error. Atributo self.output_file_is_binary debe ser True o False")
             print("Error. Atributo self.output_file_is_binary debe ser True o False")
             return
-        if self.output_file is not None:
-            self.output_file.flush()
-            self.output_file.close()
-            self._pre_capture_file_update()
-        write_mode = 'wb' if self.output_file_is_binary else 'w'
-        self.output_file = open(path.join(new_file_path, self.output_file_name), write_mode)
+        file_path = path.join(new_file_path, self.output_file_name)
+        self.__next_files[file_path] = self.__segment_files.submit(self.__open_segment_file, file_path)
+        self.dq_formatted_data.append(Marker(file_path))
+
+    def __open_segment_file(self, file_path):
+        output_file = self._agent_open_output_file(file_path)
         if self.output_file_header:
-            self.output_file.write(self.output_file_header + os.linesep)
+            if self.output_file_is_binary:  # En archivos binarios el encabezado debe venir ya en bytes
+                output_file.write(self.output_file_header)
+            else:
+                output_file.write(self.output_file_header + os.linesep)
+        return output_file
+
+    def __swap_file(self, file_path):
+        """
+        Pasa a escribir en el archivo (ya abierto) del segmento siguiente, y cierra el anterior en segundo plano
+        """
+        old_file = self.output_file
+        try:
+            self.output_file = self.__next_files.pop(file_path).result()
+        except Exception:
+            self.logger.exception(f"No se pudo abrir el archivo {file_path}")
+            self.output_file = None
+        if old_file is not None:
+            stats = {key: value - self.__file_stats[key] for key, value in self.writer_stats.items()}
+            elapsed = time.time() - self.__file_open_time
+            snapshot = self._segment_snapshot()  # En este thread, justo en el cambio de segmento
+            self.__segment_files.submit(self.__close_segment_file, old_file, stats, elapsed, snapshot)
+        self.__file_stats = dict(self.writer_stats)
+        self.__file_open_time = time.time()
+
+    def __close_segment_file(self, output_file, stats, elapsed, snapshot):
+        try:
+            output_file.flush()
+            output_file.close()
+            self.__log_file_stats(stats, elapsed)
+            self._pre_capture_file_update(output_file, snapshot)
+        except Exception:
+            self.logger.exception("Error al cerrar archivo de salida")
 
     def __file_writer(self):
+        """
+        Escribe por lotes: retira todo lo acumulado en dq_formatted_data y lo escribe en una sola llamada por archivo.
+        Es el único thread que escribe en los archivos de salida
+        """
         while not self.flags.quit.is_set():
-            if self.state == AgentStatus.CAPTURING \
-                    and self.output_file is not None \
-                    and len(self.dq_formatted_data) \
-                    and not self.output_file.closed:
-                try:
-                    if self.output_file_is_binary:
-                        self.output_file.write(self.dq_formatted_data.popleft())
-                    else:
-                        self.output_file.write(self.dq_formatted_data.popleft() + os.linesep)
-                except ValueError:  # Archivo se cerró entremedio
-                    pass
-            else:
-                time.sleep(0.1)
+            batch = self.dq_formatted_data.drain(WRITER_WAIT)  # Despierta apenas llegan datos
+            start = 0
+            for i, item in enumerate(batch):
+                if isinstance(item, Marker):
+                    self.__write_batch(batch[start:i])
+                    self.__swap_file(item.value)
+                    start = i + 1
+            self.__write_batch(batch[start:])
+            if self.record_format is not None and batch:
+                self.flags.quit.wait(RECORD_BATCH_INTERVAL)
+        if self.output_file is not None:
+            stats = {key: value - self.__file_stats[key] for key, value in self.writer_stats.items()}
+            self.__close_segment_file(self.output_file, stats, time.time() - self.__file_open_time,
+                                      self._segment_snapshot())
+        self.__segment_files.shutdown()
+
+    def __write_batch(self, batch):
+        if not batch:
+            return
+        if self.output_file is None:  # No hay segmento en curso
+            self.writer_stats["lost"] += len(batch)
+            return
+        if self.record_format is not None:
+            t0 = time.perf_counter()
+            try:
+                records = self.record_format.to_array(batch)
+                data = records.tobytes() if self.output_format == FORMAT_BINARY else self.record_format.to_text(records)
+            except (ValueError, TypeError):
+                self.logger.exception("Error al formatear registros")
+                self.writer_stats["lost"] += len(batch)
+                return
+            self.writer_stats["format_time"] += time.perf_counter() - t0
+        elif self.output_file_is_binary:
+            data = b"".join(batch)
+        else:
+            data = os.linesep.join(batch) + os.linesep
+        t0 = time.perf_counter()
         try:
-            self.output_file.close()
-        except:
-            pass
+            self.output_file.write(data)
+        except (OSError, ValueError):
+            self.logger.exception("Error al escribir en archivo de salida")
+            self.writer_stats["lost"] += len(batch)
+            return
+        write_time = time.perf_counter() - t0
+        stats = self.writer_stats
+        stats["bytes"] += len(data)
+        stats["records"] += len(batch)
+        stats["batches"] += 1
+        stats["max_batch"] = max(stats["max_batch"], len(batch))
+        stats["write_time"] += write_time
+        stats["max_write_time"] = max(stats["max_write_time"], write_time)
+
+    def __log_file_stats(self, stats, elapsed):
+        """
+        Registra los contadores del escritor para un archivo que se acaba de cerrar
+        :param stats: diferencia de writer_stats entre la apertura y el cierre del archivo
+        """
+        if stats["lost"]:
+            self.logger.warning(f"Registros perdidos sin archivo de salida o por error de formato: {stats['lost']}")
+        if not stats["batches"]:
+            return
+        elapsed = max(elapsed, 1e-3)
+        self.logger.info(f"Archivo {self.output_file_name}: {stats['bytes']} bytes "
+                         f"({stats['bytes'] / elapsed / 1e3:.1f} kB/s), {stats['records']} registros en "
+                         f"{stats['batches']} escrituras "
+                         f"(media {stats['records'] / stats['batches']:.1f} registros, "
+                         f"{1000 * stats['write_time'] / stats['batches']:.2f} ms)"
+                         + (f", formateo {stats['format_time']:.2f} s" if self.record_format is not None else ""))
 
     def __manager_connect(self):
         connected = False
@@ -135,6 +329,8 @@ class AbstractHWAgent(ABC):
             try:
                 self.logger.info("Esperando conexión de manager")
                 self.connection, client_address = self.__sock.accept()
+                self.__data_ring_active = False
+                self.protocol = PROTOCOL_YAML
                 connected = True
                 self.logger.info("Manager conectado")
             except socket.timeout:
@@ -144,22 +340,17 @@ class AbstractHWAgent(ABC):
                 raise
 
     def __manager_recv(self):
-        cmd = b''
+        decoder = StreamDecoder()
         while not self.flags.quit.is_set():
             try:
-                bt = self.connection.recv(1)
-                if not bt:
-                    self.logger.warning(f"Conexión cerrada por manager")
-                    self.flag_quit.wait(0.5)
-                    raise ConnectionResetError
-                elif bt == Message.EOT:
-                    self.__process_incoming_message(Message.deserialize(cmd))
-                    cmd = b''
-                else:
-                    cmd += bt
+                for msg in decoder.read(self.connection):
+                    self.__process_incoming_message(msg)
             except TimeoutError:
                 pass
             except ConnectionResetError:
+                self.logger.warning(f"Conexión cerrada por manager")
+                self.flag_quit.wait(0.5)
+                decoder.reset()
                 self.__manager_connect()
 
         # Espera que manager termine la conexión, de lo contrario queda tomado el puerto local por 1.5 minutos
@@ -174,8 +365,11 @@ class AbstractHWAgent(ABC):
             self.__sock.close()
 
     def __manager_send(self, msg):
+        if self.connection is None:  # Manager aún no se conecta. Consultará el estado al conectarse
+            return
         try:
-            self.connection.sendall(msg)
+            with self.__send_lock:
+                self.connection.sendall(msg)
         except BrokenPipeError:
             pass
         except OSError as e:
@@ -186,10 +380,25 @@ class AbstractHWAgent(ABC):
                 self.logger.exception("")
 
     def __process_incoming_message(self, msg: Message):
+        if self.trace is not None:
+            self.trace.record(IN, msg)
+        # Si el mensaje es una solicitud (trae msg_id), la respuesta lleva el mismo identificador
         if msg.typ == Message.QUERY_AGENT_STATE:
-            self.__manager_send(Message.agent_state(self.state).serialize())
+            self._send_msg_to_mgr(msg.reply(Message.AGENT_STATE, self.state))
         elif msg.typ == Message.QUERY_HW_STATE:
-            self.__manager_send(Message.agent_hw_state(self.hw_state).serialize())
+            self._send_msg_to_mgr(msg.reply(Message.HW_STATE, self.hw_state))
+        elif msg.typ == Message.HELLO:
+            # Responde en YAML, que el manager entiende aunque no soporte la versión solicitada
+            self.protocol = min(int(msg.arg), PROTOCOL_VERSION)
+            hello = Message.hello(self.protocol)
+            if self.trace is not None:
+                self.trace.record(OUT, hello)
+            self.__manager_send(hello.serialize())
+            self.logger.info(f"Protocolo con manager: versión {self.protocol}")
+            if self.data_ring is not None and self.protocol >= PROTOCOL_BINARY:
+                self.data_ring.reset()
+                self._send_msg_to_mgr(Message.data_ring(self.data_ring.name))
+                self.__data_ring_active = True
         elif msg.typ == Message.QUIT:
             self.logger.info(f"Comando {msg.arg} recibido desde manager. Seteando bandera self.flags.quit")
             self.flags.quit.set()
@@ -197,25 +406,50 @@ class AbstractHWAgent(ABC):
             self.__update_capture_file(msg.arg)
             self.flags.end_capture.clear()
             self.flags.start_capture.set()
+            self.__reply(msg)
         elif msg.typ == Message.END_CAPTURE:
             self.flags.start_capture.clear()
             self.flags.end_capture.set()
+            self.__reply(msg)
         else:  # Todos los demás mensajes deben ser procesados por el agente particular
-            self._agent_process_manager_message(msg)
+            self.__reply(msg, self._agent_process_manager_message(msg))
+
+    def __reply(self, msg: Message, result=None):
+        if msg.msg_id is not None:
+            self._send_msg_to_mgr(msg.reply(arg=result))
 
     def __hw_check(self):
+        last_stats = None
+        stats_countdown = 0
         while not self.flags.quit.is_set():
             if not self._agent_check_hw_connected():
                 self.hw_state = HWStates.NOT_CONNECTED
 
+            stats_countdown -= 1
+            if stats_countdown <= 0:
+                stats_countdown = BUFFER_STATS_PERIOD
+                stats = self.dq_formatted_data.stats()
+                stats.update(self.writer_stats)
+                if stats != last_stats:
+                    self._send_msg_to_mgr(Message.buffer_stats(stats))
+                    last_stats = stats
+
             self.flags.quit.wait(1)
 
     def _send_data_to_mgr(self, data):
-        msg = Message(_type=Message.DATA, arg=data).serialize()
-        self.__manager_send(msg)
+        msg = Message(_type=Message.DATA, arg=data)
+        if self.__data_ring_active:
+            if self.trace is not None:
+                self.trace.record(OUT, msg)
+            if self.data_ring.put(msg):  # El manager estaba al día: hay que avisarle
+                self._send_msg_to_mgr(Message.data_ready())
+        else:
+            self._send_msg_to_mgr(msg)
 
     def _send_msg_to_mgr(self, msg: Message):
-        self.__manager_send(msg.serialize())
+        if self.trace is not None:
+            self.trace.record(OUT, msg)
+        self.__manager_send(msg.serialize(self.protocol))
 
     def run(self):
         wrt = Thread(target=self.__file_writer)
@@ -254,13 +488,11 @@ class AbstractHWAgent(ABC):
                 if self.hw_state == HWStates.NOT_CONNECTED or self.hw_state == HWStates.ERROR:
                     self.logger.error(f"Hardware en estado {self.hw_state}. Se intentará reconexion.")
                     self.state = AgentStatus.STARTING
-                    self.logger.debug(f"Cambiando estado a {self.state}")
                     self._agent_hw_stop()
                     self.logger.debug("Reconectando al hardware")
                     self.__hw_connect_insist()
                     self.logger.debug("Hardware reconectado")
                     self.state = AgentStatus.STAND_BY
-                    self.logger.debug(f"Cambiando estado a {self.state}")
         except KeyboardInterrupt:
             self.logger.info("Señal INT recibida")
         except Exception:
@@ -275,22 +507,56 @@ class AbstractHWAgent(ABC):
             if hw_check.is_alive():
                 hw_check.join(0.1)
             self._agent_finalize()
+            stats = self.dq_formatted_data.stats()
+            if stats["drops"] or stats["spill_bytes"]:
+                self.logger.warning(f"Buffer de datos a disco: {stats}")
+            else:
+                self.logger.info(f"Buffer de datos a disco: {stats}")
+            self.dq_formatted_data.close()
+            if self.trace is not None:
+                self.trace.close()
+            if self.data_ring is not None:
+                if self.data_ring.dropped:
+                    self.logger.warning(f"Mensajes de datos descartados por anillo lleno: {self.data_ring.dropped}")
+                self.data_ring.close()
             self.logger.info("Aplicación terminada\nFIN\n")
 
+    def _agent_open_output_file(self, file_path):
+        """
+        Abre el archivo de salida de datos, con la política de sincronización a disco configurada. Los agentes pueden
+        redefinirlo para entregar otro objeto tipo archivo (con write, flush, close y closed), por ejemplo uno que
+        comprima los datos
+        :return: objeto tipo archivo
+        """
+        write_mode = 'wb' if self.output_file_is_binary else 'w'
+        return SegmentFile(open(file_path, write_mode, buffering=self.write_buffer), self.durability, self.logger)
+
     @abstractmethod
     def _agent_process_manager_message(self, msg: Message):
         """
         Procesa los mensajes del manager que son más especificos del agente
-        :return:
+        :return: resultado, que se envía al manager en un REPLY si el mensaje era una solicitud (con msg_id)
         """
         pass
 
+    def _segment_snapshot(self):
+        """
+        Se llama en el thread escritor al llegar al cambio de segmento, antes de pasar al archivo siguiente. Los agentes
+        pueden redefinirlo para tomar (y reiniciar) las estadísticas del segmento que termina, y el estado en que
+        termina, en ese momento: _pre_capture_file_update corre después y de forma asíncrona
+        :return: valor que se entrega a _pre_capture_file_update
+        """
+        return None
+
     @abstractmethod
-    def _pre_capture_file_update(self):
+    def _pre_capture_file_update(self, closed_file, snapshot):
         """
-        Poner aquí codigo que se ejecute justo antes de que se abra el nuevo archivo de salida de datos.
-        Por ejemplo, calcular alguna estadistica del archivo de captura anterior o resetear alguna variable que se escriba a archivo
-        :return:
+        Poner aquí codigo que se ejecute al terminar un archivo de salida de datos, por ejemplo para calcular alguna
+        estadistica del segmento. Corre de forma asíncrona en un thread en segundo plano, ya cerrado el archivo,
+        mientras los demás threads siguen recibiendo datos del segmento siguiente: el estado del agente y sus contadores
+        ya no corresponden al segmento cerrado, y se deben tomar en _segment_snapshot
+        :param closed_file: el archivo que se cerró (objeto retornado por _agent_open_output_file)
+        :param snapshot: lo que retornó _segment_snapshot para este segmento
         """
         pass
 
@@ -225,7 +225,7 @@ class AtmegaAgent(AbstractHWAgent):
     def _agent_stop_capture(self):
         pass
 
-    def _pre_capture_file_update(self):
+    def _pre_capture_file_update(self, closed_file, snapshot):
         pass
 
     def _agent_check_hw_connected(self):
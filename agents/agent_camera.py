@@ -55,7 +55,7 @@ class CameraAgent(AbstractHWAgent):
         self.flags.hw_stopped.set()
         self.__thread_image_cap.join(1.1)
 
-    def _pre_capture_file_update(self):
+    def _pre_capture_file_update(self, closed_file, snapshot):
         pass
 
     def __capture_image(self):
@@ -4,11 +4,12 @@ import shutil
 import sys
 import time
 from threading import Thread
-from os import walk, path, sync
+from os import walk, path
 
 import init_agent
 from abstract_agent import AbstractHWAgent, DEFAULT_CONFIG_FILE
 from constants import AgentStatus
+from durability import sync_tree
 from messaging.messaging import Message
 from bdd import DBInterface
 
@@ -81,7 +82,7 @@ class DataCopy(AbstractHWAgent):
         #No aplica para este agente, ya que no hay un sensor que envie datos
         pass
     
-    def _pre_capture_file_update(self):
+    def _pre_capture_file_update(self, closed_file, snapshot):
         pass
 
     def _agent_check_hw_connected(self):
@@ -113,7 +114,7 @@ class DataCopy(AbstractHWAgent):
                     try:
                         self.logger.debug(f"Copiando {row[0]}")
                         shutil.copytree(row[0], dest)
-                        sync()
+                        sync_tree(dest)  # Solo lo copiado, sin bloquear la escritura de los demás agentes
                         self.dbi.copy_done(folio)
                         self.logger.debug(f"Archivos copiados a {dest}")
                     except OSError as e:
@@ -14,11 +14,19 @@ import init_agent
 from constants import HWStates, AgentStatus
 from abstract_agent import AbstractHWAgent, DEFAULT_CONFIG_FILE
 from helpers import check_dev
+from messaging.gps_board import GPSBoard
+from records import RecordFormat, FORMAT_CSV, FORMAT_BINARY, OUTPUT_FORMATS
 
 APP_FIELDS = ["sys_timestamp", "distance_delta"]
 RMC_FIELDS = ["latitude", "longitude", "timestamp", "spd_over_grnd", "true_course"]
 GGA_FIELDS = ["gps_qual", "num_sats", "horizontal_dil"]
 READ_TIMEOUT = 1.5
+# Registro del formato binario, equivalente a una línea del CSV. Los campos GGA y la hora UTC del GPS se guardan como
+# texto, tal como los entrega pynmea2. Como los tipos varían, se empaquetan con pack_values en vez de encolar una tupla
+RECORD = RecordFormat([("sys_timestamp", "d", ""), ("distance_delta", "d", ""), ("latitude", "d", ""),
+                       ("longitude", "d", ""), ("timestamp", "24s", ""), ("spd_over_grnd", "d", ""),
+                       ("true_course", "d", ""), ("gps_qual", "4s", ""), ("num_sats", "4s", ""),
+                       ("horizontal_dil", "8s", "")], ";".join(APP_FIELDS + RMC_FIELDS + GGA_FIELDS))
 
 
 class GPSAgent(AbstractHWAgent):
@@ -27,14 +35,18 @@ class GPSAgent(AbstractHWAgent):
         AbstractHWAgent.__init__(self, config_section=self.agent_name, config_file=config_file)
         self.logger = logging.getLogger(self.agent_name)
         self.output_file_is_binary = False
+        self.output_file_header = ";".join(APP_FIELDS + RMC_FIELDS + GGA_FIELDS)
         self.com_port = ""
         self.baudrate = ""
         self.ser = serial.Serial()
         self.last_coords = None
         self.datapoint = dict.fromkeys(APP_FIELDS + RMC_FIELDS + GGA_FIELDS)
-        self.output_file_header = ";".join([k for k in self.datapoint.keys()])
         self.sim_acceleration_sign = 1  # Usado para simular aceleración y frenado
         self.geod = Geod(ellps='WGS84')
+        self.board = None  # GPSBoard. Último estado en memoria compartida, para el manager y otros agentes
+        self.distance_total = 0.0  # Distancia acumulada desde que partió el agente (m)
+        self.record_format = None  # RECORD en formato binario (ver _agent_config)
+        self.fixes = 0  # Coordenadas publicadas en el board
 
     def _agent_process_manager_message(self, msg):
         pass
@@ -43,6 +55,15 @@ class GPSAgent(AbstractHWAgent):
         self.com_port = self.config["com_port"]
         self.baudrate = self.config["baudrate"]
         self.simulate = bool(self.config["simulate"])
+        if self.config.get("gps_board", False):
+            self.board = GPSBoard.create()
+        # En CSV cada coordenada se escribe con str() de cada valor, como siempre: los tipos de los valores varían
+        # (e.g. rumbo entero en el simulador) y RECORD los convertiría. El formato binario usa RECORD
+        output_format = self.config.get("output_format", FORMAT_CSV)
+        if output_format not in OUTPUT_FORMATS:
+            self.logger.error(f"Formato de salida '{output_format}' no válido. Debe ser uno de {OUTPUT_FORMATS}. "
+                              f"Se usará '{FORMAT_CSV}'")
+        self.record_format = RECORD if output_format == FORMAT_BINARY else None
 
     def _agent_run_non_hw_threads(self):
         pass
@@ -51,6 +72,8 @@ class GPSAgent(AbstractHWAgent):
         self.flag_quit.set()
         self.__thread_data_rcv.join(1.1)
         self.ser.close()
+        if self.board is not None:
+            self.board.close()
 
     def _agent_hw_start(self):
         try:
@@ -76,9 +99,14 @@ class GPSAgent(AbstractHWAgent):
             else:
                 r = self.__read_from_gps()
             if r and self.__update_data():
+                if self.board is not None:
+                    self.__update_board()
                 self._send_data_to_mgr(self.datapoint)
                 if self.state == AgentStatus.CAPTURING:
-                    self.dq_formatted_data.append(";".join(str(val) for val in self.datapoint.values()))
+                    if self.record_format is not None:
+                        self.dq_formatted_data.append(RECORD.pack_values(self.datapoint.values(), self.logger))
+                    else:
+                        self.dq_formatted_data.append(";".join(str(val) for val in self.datapoint.values()))
 
     def __read_from_simulator(self):
         while not self.flags.quit.is_set():
@@ -168,6 +196,7 @@ class GPSAgent(AbstractHWAgent):
                 az12, az21, dist = self.geod.inv(current_coords[0], current_coords[1], self.last_coords[0],
                                                  self.last_coords[1])
                 self.last_coords = current_coords
+                self.distance_total += dist
                 self.datapoint["distance_delta"] = round(dist, 1)  # 1 decimal basta
                 self.datapoint["latitude"] = round(self.datapoint["latitude"], 5)
                 self.datapoint["longitude"] = round(self.datapoint["longitude"], 5)
@@ -179,10 +208,22 @@ class GPSAgent(AbstractHWAgent):
             self.logger.exception("")
             return False
 
+    def __update_board(self):
+        def to_float(value):
+            try:
+                return float(value)
+            except (TypeError, ValueError):  # e.g. rumbo vacío cuando el vehículo está detenido
+                return float("nan")
+
+        self.fixes += 1
+        self.board.update(self.datapoint["sys_timestamp"], to_float(self.datapoint["latitude"]),
+                          to_float(self.datapoint["longitude"]), to_float(self.datapoint["spd_over_grnd"]),
+                          to_float(self.datapoint["true_course"]), self.distance_total, self.fixes)
+
     def _agent_check_hw_connected(self):
         return check_dev(self.com_port)
 
-    def _pre_capture_file_update(self):
+    def _pre_capture_file_update(self, closed_file, snapshot):
         pass
 
 
@@ -14,8 +14,14 @@ from constants import AgentStatus, HWStates
 from abstract_agent import AbstractHWAgent, DEFAULT_CONFIG_FILE
 from helpers import check_dev
 from yost3space.api import Yost3SpaceAPI, READ_TIMEOUT, BAUD_RATE, unpack
+from records import RecordFormat
 
 HEADER = "system_time (s);accel_x (g);accel_y (g);accel_z (g);gyro_x (rad/s);gyro_y (rad/s);gyro_z (rad/s);q1;q2;q3;q4"
+# Valores de cada muestra y su formato en el CSV
+RECORD = RecordFormat([("system_time", "d", ".3f"), ("accel_x", "f", "2.3f", "; "), ("accel_y", "f", "2.3f"),
+                       ("accel_z", "f", "2.3f"), ("gyro_x", "f", "2.3f"), ("gyro_y", "f", "2.3f"),
+                       ("gyro_z", "f", "2.3f"), ("q1", "f", "2.3f"), ("q2", "f", "2.3f"), ("q3", "f", "2.3f"),
+                       ("q4", "f", "2.3f")], HEADER)
 
 
 class IMUAgent(AbstractHWAgent):
@@ -26,7 +32,7 @@ class IMUAgent(AbstractHWAgent):
         self.output_file_is_binary = False
         self.com_port = ""
         self.ser = None
-        self.output_file_header = HEADER
+        self.record_format = RECORD  # Se encolan los valores de cada muestra; el escritor los formatea por lote
 
     def _agent_process_manager_message(self, msg):
         pass
@@ -72,9 +78,8 @@ class IMUAgent(AbstractHWAgent):
             try:
                 data = self.yost_api.read_datapoint()
                 if data:
-                    data_line = f"{time.time():.3f}; {';'.join([format(v, '2.3f') for v in data])}"
                     if self.state == AgentStatus.CAPTURING:
-                        self.dq_formatted_data.append(data_line)
+                        self.dq_formatted_data.append((time.time(),) + data)
                 else:
                     if self.hw_state == HWStates.NOMINAL:
                         self.logger.error("Error al leer del acelerómetro vía puerto serial")
@@ -91,7 +96,7 @@ class IMUAgent(AbstractHWAgent):
     def _agent_check_hw_connected(self):
         return check_dev(self.com_port)
 
-    def _pre_capture_file_update(self):
+    def _pre_capture_file_update(self, closed_file, snapshot):
         pass
 
 
@@ -52,7 +52,7 @@ class InetAgent(AbstractHWAgent):
         # TODO hacer un "sudo ifdown"
         pass
 
-    def _pre_capture_file_update(self):
+    def _pre_capture_file_update(self, closed_file, snapshot):
         pass
 
     def _agent_check_hw_connected(self):
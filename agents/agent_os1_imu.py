@@ -11,8 +11,17 @@ from constants import AgentStatus
 from abstract_agent import AbstractHWAgent, DEFAULT_CONFIG_FILE
 from helpers import check_ping
 from os1.imu_packet import PACKET_SIZE, unpack as unpack_imu
+from os1.receiver import PacketReceiver
+from records import RecordFormat
 
 IMU_UDP_PORT = 7503
+IMU_RCVBUF = 256 * 1024
+HEADER = "timestamp_system_(s);timestamp_accel_(us);timestamp_gyro_(us);accel_x_(g);accel_y_(g);accel_z_(g);" \
+         "gyro_x_(deg/sec);gyro_y_(deg/sec);gyro_z_(deg/sec)"
+# Valores de cada muestra y su formato en el CSV
+RECORD = RecordFormat([("timestamp_system", "d", ".3f"), ("timestamp_accel", "q", "d"), ("timestamp_gyro", "q", "d"),
+                       ("accel_x", "f", ".3f"), ("accel_y", "f", ".3f"), ("accel_z", "f", ".3f"),
+                       ("gyro_x", "f", ".3f"), ("gyro_y", "f", ".3f"), ("gyro_z", "f", ".3f")], HEADER)
 
 
 class OS1IMUAgent(AbstractHWAgent):
@@ -21,10 +30,11 @@ class OS1IMUAgent(AbstractHWAgent):
         AbstractHWAgent.__init__(self, config_section=self.agent_name, config_file=config_file)
         self.logger = logging.getLogger(self.agent_name)
         self.output_file_is_binary = False
-        self.output_file_header = "timestamp_system_(s);timestamp_accel_(us);timestamp_gyro_(us);accel_x_(g);" \
-                                  "accel_y_(g);accel_z_(g);gyro_x_(deg/sec);gyro_y_(deg/sec);gyro_z_(deg/sec)"
+        self.record_format = RECORD  # Se encolan los valores de cada muestra; el escritor los formatea por lote
         self.sensor_ip = ""
         self.host_ip = ""
+        self.sock = None
+        self.receiver = None
 
     def _agent_process_manager_message(self, msg):
         pass
@@ -39,14 +49,15 @@ class OS1IMUAgent(AbstractHWAgent):
     def _agent_finalize(self):
         self.flags.quit.set()
         self.__thread_data_receiver.join(0.5)
-        self.sock.close()
+        self.__close_socket()
 
     def _agent_hw_start(self):
         # Socket para recibir datos desde LiDAR
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sock.settimeout(0.1)
         try:
             self.sock.bind((self.host_ip, IMU_UDP_PORT))
+            self.receiver = PacketReceiver(self.sock, PACKET_SIZE, rcvbuf=IMU_RCVBUF)
+            self.logger.info(f"Buffer de recepción UDP: {self.receiver.rcvbuf} bytes (solicitado: {IMU_RCVBUF})")
             self.flags.hw_stopped.clear()
             self.__thread_data_receiver = Thread(target=self.__read_from_imu)
             self.__thread_data_receiver.start()
@@ -55,6 +66,7 @@ class OS1IMUAgent(AbstractHWAgent):
                 self.logger.error(f"Dirección ya está en uso: {self.host_ip}:{IMU_UDP_PORT}")
             else:
                 self.logger.exception("")
+            self.__close_socket()
             return False
         return True
 
@@ -63,26 +75,33 @@ class OS1IMUAgent(AbstractHWAgent):
             self.flags.hw_stopped.set()
             self.__thread_data_receiver.join(0.2)
             self.__thread_data_receiver = None
-            self.sock.close()
-            self.sock = None
+            self.__close_socket()
         except:
             pass
 
+    def __close_socket(self):
+        """
+        Cierra el socket de datos, para que un nuevo intento de _agent_hw_start pueda volver a usar el puerto
+        """
+        if self.sock is not None:
+            self.sock.close()
+        self.sock = self.receiver = None
+
     def __read_from_imu(self):
         while not self.flags.quit.is_set() and not self.flags.hw_stopped.is_set():
             try:
-                packet, address = self.sock.recvfrom(PACKET_SIZE)
+                batch = self.receiver.receive(0.1)
                 if not self.state == AgentStatus.CAPTURING:
                     continue
-                if address[0] == self.sensor_ip and len(packet) == PACKET_SIZE:
-                    ti, ta, tg, ax, ay, az, gx, gy, gz = unpack_imu(packet)
-                    f_data = f"{time.time():.3f};{int(ta / 1000)};{int(tg / 1000)};" \
-                             f"{ax:.3f};{ay:.3f};{az:.3f};{gx:.3f};{gy:.3f};{gz:.3f}"
-                    self.dq_formatted_data.append(f_data)
+                for packet, address in batch:
+                    if address[0] == self.sensor_ip:
+                        ti, ta, tg, ax, ay, az, gx, gy, gz = unpack_imu(packet)
+                        self.dq_formatted_data.append((time.time(), int(ta / 1000), int(tg / 1000),
+                                                       ax, ay, az, gx, gy, gz))
             except:
                 pass
 
-    def _pre_capture_file_update(self):
+    def _pre_capture_file_update(self, closed_file, snapshot):
         pass
 
     def _agent_check_hw_connected(self):
@@ -6,17 +6,27 @@ import os
 import errno
 import numpy as np
 import sys
+import time
 
 import init_agent
 from constants import HWStates, AgentStatus
-from os1.core import OS1
-from os1.lidar_packet import PACKET_SIZE, MAX_FRAME_ID, unpack as unpack_lidar
-from os1.utils import build_trig_table, xyz_points_pack
+from os1.core import OS1, OS1ConfigurationError
+from os1.lidar_packet import PACKET_SIZE, as_array
+from os1.frames import FrameAssembler
+from os1.compressed import CompressedXYZFile, CODEC_NAMES, FILE_EXTENSION as COMPRESSED_EXTENSION
+from os1.health import HealthMonitor, PACKETS, EXPECTED, BLOCKS_VALID, BLOCKS_INVALID, KERNEL_DROPS, CONVERTED, \
+    CONVERSION_TIME
+from os1.raw_file import raw_file_header, pack_raw_record, FILE_EXTENSION as RAW_EXTENSION
+from os1.receiver import PacketReceiver
+from os1.pipeline import ConversionPipeline, ConversionWorkerError
+from os1.utils import build_projection_table, xyz_points_pack_np
 from abstract_agent import AbstractHWAgent, DEFAULT_CONFIG_FILE
+from messaging.messaging import Message
 from helpers import check_ping
 
 CONFIG_FILE = "config.yaml"
 LIDAR_UDP_PORT = 7502
+LIDAR_RCVBUF = 16 * 1024 * 1024  # Buffer de recepción solicitado para el socket UDP. Alcanza ~1 s de datos en 2048x10
 AZIMUTH_DIVS = 511
 ANGLE_SPAN = 140  # Abanico de captura, en grados
 ADMIT_MEAS_ID_MORE_THAN = 16 * round(AZIMUTH_DIVS * (
@@ -24,6 +34,16 @@ ADMIT_MEAS_ID_MORE_THAN = 16 * round(AZIMUTH_DIVS * (
 ADMIT_MEAS_ID_LESS_THAN = 16 * round(AZIMUTH_DIVS * (180 + ANGLE_SPAN / 2) / 360 / 16)
 LOST_PACKETS_ERROR_THRESHOLD = 5  # Sobre este porcentaje de paquetes perdidos, se pasa a estado de error o warning
 INVALID_BLOCKS_ERROR_THRESHOLD = 5  # Sobre este porcentaje de bloques inválidos, se pasa a estado de error o warning
+FORMAT_XYZ = "xyz"  # Archivo de salida con coordenadas cartesianas, convertidas en el agente
+FORMAT_RAW = "raw"  # Archivo de salida con los paquetes UDP crudos. Se convierten después con os1/raw_file.py
+FORMAT_COMPRESSED = "compressed"  # Coordenadas cartesianas comprimidas. Se descomprimen con os1/compressed.py
+OUTPUT_FORMATS = (FORMAT_XYZ, FORMAT_RAW, FORMAT_COMPRESSED)
+# Extensión del archivo de salida de cada formato distinto de xyz, para que no se confundan en disco
+FORMAT_EXTENSIONS = {FORMAT_RAW: RAW_EXTENSION, FORMAT_COMPRESSED: COMPRESSED_EXTENSION}
+HEALTH_PERIOD = 2  # Segundos entre envíos de métricas de salud al manager
+HEALTH_WINDOW = 5  # Muestras que abarca la ventana móvil de métricas (HEALTH_WINDOW * HEALTH_PERIOD segundos)
+LIDAR_START_TIMEOUT = 40  # Máximo tiempo de espera (s) a que el LiDAR informe estado RUNNING luego de reinicializarlo
+INTRINSICS_CACHE_DIR = "os1_cache"  # Directorio con los beam intrinsics guardados, por número de serie del sensor
 
 
 class OS1LiDARAgent(AbstractHWAgent):
@@ -37,15 +57,31 @@ class OS1LiDARAgent(AbstractHWAgent):
         self.os1 = None
         self.receive_data = Event()
         self.receive_data.clear()
-        self.packets_per_frame = dict()
-        self.blocks_valid = 0
-        self.blocks_invalid = 0
+        self.frames = FrameAssembler(ADMIT_MEAS_ID_MORE_THAN, ADMIT_MEAS_ID_LESS_THAN)
+        self.health = HealthMonitor(HEALTH_WINDOW)
+        self.counters = self.health.counters  # Contadores acumulados (ver os1/health.py)
+        self.segment_counters = self.counters.copy()  # Valor de los contadores al inicio del segmento
         self.active_channels = ()
+        self.projection_table = None
+        self.output_format = FORMAT_XYZ
+        self.workers = 0  # Procesos convertidores a XYZ. 0: la conversión se hace en el hilo receptor
+        self.pipeline = None
         self.stats_are_valid = False
+        self.sock = None
+        self.receiver = None
+        self.kernel_drops = 0  # Último valor leído del contador de descartes del kernel del socket actual
 
     def _agent_config(self):
         self.sensor_ip = self.config["sensor_ip"]
         self.host_ip = self.config["host_ip"]
+        self.output_format = self.config.get("output_format", FORMAT_XYZ)
+        if self.output_format not in OUTPUT_FORMATS:
+            self.logger.error(f"Formato de salida '{self.output_format}' no válido. Debe ser uno de {OUTPUT_FORMATS}. "
+                              f"Usando '{FORMAT_XYZ}'")
+            self.output_format = FORMAT_XYZ
+        if self.output_format in FORMAT_EXTENSIONS and self.output_file_name:
+            self.output_file_name = os.path.splitext(self.output_file_name)[0] + FORMAT_EXTENSIONS[self.output_format]
+        self.workers = int(self.config.get("workers", 0))
         self.os1 = OS1(self.sensor_ip, self.host_ip, mode="512x10")
 
     def _agent_check_hw_connected(self):
@@ -62,12 +98,12 @@ class OS1LiDARAgent(AbstractHWAgent):
         except AssertionError:
             self.logger.error("Se llamó a hw_finalize() sin estar seteado 'self.flags.quit'")
         self.__thread_data_receiver.join(0.5)
-        self.sock.close()
+        self.__close_pipeline()
+        self.__close_socket()
 
     def _agent_hw_start(self):
         # Socket para recibir datos desde LiDAR
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sock.settimeout(0.1)
         try:
             self.sock.bind((self.host_ip, LIDAR_UDP_PORT))
         except OSError as e:
@@ -75,30 +111,53 @@ class OS1LiDARAgent(AbstractHWAgent):
                 self.logger.error(f"Dirección ya está en uso: {self.host_ip}:{LIDAR_UDP_PORT}")
             else:
                 self.logger.exception("")
+            self.__close_socket()
             return False
+        self.receiver = PacketReceiver(self.sock, PACKET_SIZE, rcvbuf=LIDAR_RCVBUF)
+        self.kernel_drops = 0
+        self.logger.info(f"Buffer de recepción UDP: {self.receiver.rcvbuf} bytes (solicitado: {LIDAR_RCVBUF}). "
+                         f"Contador de descartes del kernel {'' if self.receiver.drops_supported else 'no '}disponible")
 
         self.logger.info("Cargando parmámetros desde LiDAR ('beam intrinsics')")
         try:
-            beam_intrinsics = json.loads(self.os1.get_beam_intrinsics())
+            beam_intrinsics = self.os1.load_beam_intrinsics(INTRINSICS_CACHE_DIR)
         except OSError as e:
             if e.errno == errno.EHOSTUNREACH:
                 self.logger.error(f"No se puede acceder a la IP del LiDAR: 'No route to host'")
             else:
                 self.logger.exception(f"Error al intentar obtener beam_intrinsics. Posible desconexion")
+            self.__close_socket()
             return False
-        except json.decoder.JSONDecodeError:
+        except (json.decoder.JSONDecodeError, KeyError):
             self.logger.error(f"Error al intentar obtener beam_intrinsics. Posible desconexion")
+            self.__close_socket()
             return False
         beam_alt_angles = beam_intrinsics['beam_altitude_angles']
         beam_az_angles = beam_intrinsics['beam_azimuth_angles']
-        self.logger.info("Construyendo tabla trigonométrica")
-        build_trig_table(beam_alt_angles, beam_az_angles)
+        self.logger.info("Construyendo tabla de proyección")
+        self.projection_table = build_projection_table(beam_alt_angles, beam_az_angles, self.os1.columns_per_frame)
         self.active_channels = tuple(idx for idx, val in enumerate(beam_alt_angles) if val != 0)
-        self.logger.info("Inicializando LiDAR. Esto tarda unos 20 segundos.")
-        self.os1.start()
-        self.flags.quit.wait(20)  # TODO: consultar estado hasta que sea "running"
+        if self.output_format == FORMAT_RAW:
+            self.output_file_header = raw_file_header(beam_intrinsics, self.os1.mode, self.active_channels)
+        self.logger.info("Inicializando LiDAR")
+        try:
+            self.os1.start()
+        except (OSError, OS1ConfigurationError):
+            self.logger.exception("Error al configurar LiDAR")
+            self.__close_socket()
+            return False
+        t0 = time.time()
+        if self.os1.wait_until_running(LIDAR_START_TIMEOUT, stop_event=self.flags.quit):
+            self.logger.info(f"LiDAR operativo luego de {time.time() - t0:.1f} s")
+        elif not self.flags.quit.is_set():
+            self.logger.warning(f"LiDAR no informó estado RUNNING luego de {LIDAR_START_TIMEOUT} s. Se continúa de "
+                                f"todas formas")
 
         if not self.flags.quit.is_set():
+            if self.workers and self.output_format != FORMAT_RAW:
+                self.logger.info(f"Iniciando {self.workers} procesos de conversión a XYZ")
+                self.pipeline = ConversionPipeline(self.workers, self.active_channels, self.projection_table,
+                                                   on_result=self.__store_converted)
             self.flags.hw_stopped.clear()
             self.__thread_data_receiver = Thread(target=self.__read_from_lidar)
             self.__thread_data_receiver.start()
@@ -110,87 +169,147 @@ class OS1LiDARAgent(AbstractHWAgent):
             self.flags.hw_stopped.set()
             self.__thread_data_receiver.join(0.5)
             self.__thread_data_receiver = None
-            self.sock.close()
-            self.sock = None
+            self.__close_pipeline()
+            self.os1.close()
+            self.__close_socket()
         except:
             pass
 
+    def __close_socket(self):
+        """
+        Cierra el socket de datos, para que un nuevo intento de _agent_hw_start pueda volver a usar el puerto
+        """
+        if self.sock is not None:
+            self.sock.close()
+        self.sock = self.receiver = None
+
+    def __close_pipeline(self):
+        if self.pipeline is not None:
+            if self.pipeline.dropped:
+                self.logger.warning(f"Paquetes descartados por falta de capacidad de conversión: {self.pipeline.dropped}")
+            self.pipeline.close()
+            self.pipeline = None
+
+    def __store_converted(self, packed, blocks, latency):
+        """
+        Recibe (en orden) los paquetes convertidos por los procesos de conversión
+        """
+        self.dq_formatted_data.append(packed)
+        self.counters[BLOCKS_VALID] += blocks[0]
+        self.counters[BLOCKS_INVALID] += blocks[1]
+        self.counters[CONVERTED] += 1
+        self.counters[CONVERSION_TIME] += latency
+
     def __read_from_lidar(self):
         self.logger.debug("Iniciando __read_from_lidar")
         self.stats_are_valid = False
-        os_buffer_size = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
 
         # Al iniciar, se salta el primer lote de paquetes que son los que están en el buffer y son "viejos"
-        bytes_recvd = 0
-        while bytes_recvd < os_buffer_size and not self.flags.quit.is_set() and not self.flags.hw_stopped.is_set():
-            try:
-                pkt = self.sock.recv(PACKET_SIZE)
-                bytes_recvd += len(pkt)
-            except:
-                pass
+        self.receiver.flush()
         while not self.flags.quit.is_set() and not self.flags.hw_stopped.is_set():
             try:
-                packet, address = self.sock.recvfrom(PACKET_SIZE)
+                batch = self.receiver.receive(0.1)
+                if self.receiver.kernel_drops != self.kernel_drops:
+                    self.counters[KERNEL_DROPS] += self.receiver.kernel_drops - self.kernel_drops
+                    self.kernel_drops = self.receiver.kernel_drops
                 if not self.state == AgentStatus.CAPTURING:
+                    self.frames.reset()
                     continue
-                if address[0] == self.sensor_ip and len(packet) == PACKET_SIZE:
+                admitted = []  # Paquetes a convertir en los procesos de conversión
+                for packet, address in batch:
+                    if address[0] != self.sensor_ip:
+                        continue
                     first_measurement_id = int.from_bytes(packet[8:10], byteorder="little")
                     # Si los datos corresponden al azimuth donde está el conector, preocesa los paquetes
                     if ADMIT_MEAS_ID_MORE_THAN <= first_measurement_id <= ADMIT_MEAS_ID_LESS_THAN:
-                        # parsea y pone el paquete parseado en un buffer para su posterior escritura a disco
-                        packed, blocks = xyz_points_pack(unpack_lidar(packet), self.active_channels)
-                        self.dq_formatted_data.append(packed)
+                        if self.output_format == FORMAT_RAW:
+                            # Guarda el paquete crudo. La conversión a XYZ se hace después, fuera del agente
+                            self.dq_formatted_data.append(pack_raw_record(time.time(), packet))
+                            status = as_array(packet)["status"]
+                            valid = int(np.count_nonzero(status))
+                            self.counters[BLOCKS_VALID] += valid
+                            self.counters[BLOCKS_INVALID] += len(status) - valid
+                        elif self.pipeline is not None:
+                            admitted.append(packet)  # Bloques válidos e inválidos se cuentan al recibir el resultado
+                        else:
+                            self.__convert(packet)
 
                         # Recopilación de datos para estadística de paquetes
                         self.stats_are_valid = True  # estadísticas solo son válidas mientras se están recopilando
-                        frame_id = int.from_bytes(packet[10:12], byteorder="little")
-                        try:
-                            self.packets_per_frame[frame_id] += 1
-                        except KeyError:
-                            self.packets_per_frame[frame_id] = 1
-                        self.blocks_valid += blocks[0]
-                        self.blocks_invalid += blocks[1]
-            except socket.timeout:
-                pass
+                        self.frames.add(packet)
+                if admitted:
+                    try:
+                        self.pipeline.submit(admitted)
+                    except ConversionWorkerError:
+                        self.logger.exception("Falló la conversión en procesos separados. Se continúa convirtiendo "
+                                              "en este proceso")
+                        self.__close_pipeline()
+                        for packet in admitted:
+                            self.__convert(packet)
             except Exception:
                 self.logger.exception("")
         self.stats_are_valid = False
 
-    def _pre_capture_file_update(self):
+    def __convert(self, packet):
+        """
+        Parsea el paquete en este hilo y lo pone en un buffer para su posterior escritura a disco
+        """
+        t0 = time.perf_counter()
+        packed, blocks = xyz_points_pack_np(packet, self.active_channels, self.projection_table)
+        self.counters[CONVERSION_TIME] += time.perf_counter() - t0
+        self.counters[CONVERTED] += 1
+        self.dq_formatted_data.append(packed)
+        self.counters[BLOCKS_VALID] += blocks[0]
+        self.counters[BLOCKS_INVALID] += blocks[1]
+
+    def _agent_open_output_file(self, file_path):
+        output_file = AbstractHWAgent._agent_open_output_file(self, file_path)
+        if self.output_format == FORMAT_COMPRESSED:
+            output_file = CompressedXYZFile(output_file)
+        return output_file
+
+    def _segment_snapshot(self):
+        """
+        Estadísticas de paquetes del segmento que termina, tomadas en el cambio de segmento
+        :return: (stats de frames, diferencia de contadores), o None si no se estaban recopilando
+        """
         if self.state != AgentStatus.CAPTURING or not self.stats_are_valid:
+            return None
+        counters = self.counters.copy()
+        segment = counters - self.segment_counters
+        self.segment_counters = counters
+        return self.frames.take_stats(), segment
+
+    def _pre_capture_file_update(self, closed_file, snapshot):
+        if isinstance(closed_file, CompressedXYZFile) and closed_file.raw_bytes:
+            self.logger.info(f"Compresión ({CODEC_NAMES[closed_file.codec]}): "
+                             f"{closed_file.raw_bytes} -> {closed_file.compressed_bytes} bytes, "
+                             f"razón {closed_file.ratio:.2f}. "
+                             f"CPU: {closed_file.cpu_time:.2f} s")
+        if snapshot is None:
             return
 
-        frames = np.array(list(self.packets_per_frame.keys()))
-        num_packets = np.array(list(self.packets_per_frame.values()))
-        self.packets_per_frame = dict()  # resetea datos
-        if len(num_packets) == 0:
+        (frames, incomplete_frames, expected_packets, received_packets), segment = snapshot
+        if received_packets == 0:
             self.logger.warning("No se recibieron paquetes desde el LiDAR")
             self.hw_state = HWStates.ERROR
             return
 
-        if frames[-1] < frames[0]:  # Ultimo frame recibido es menor que el primero => Ocurrió overflow del frame ID
-            num_frames = MAX_FRAME_ID - frames[0] + frames[-1]
-        else:
-            num_frames = frames[-1] - frames[0]
-
-        expected_packets = num_frames * (1 + round(AZIMUTH_DIVS * ANGLE_SPAN / 360 / 16))
-        received_packets = num_packets.sum()
         lost_packets_pc = 100 * (expected_packets - received_packets) / expected_packets if expected_packets > 0 else 0
         lost_packets_pc = max(0, lost_packets_pc)
-        self.logger.info(f"Paquetes: recibidos: {received_packets}, perdidos: {lost_packets_pc:.1f} %")
+        kernel_drops = int(segment[KERNEL_DROPS])
+        blocks_valid = int(segment[BLOCKS_VALID])
+        blocks_invalid = int(segment[BLOCKS_INVALID])
+        self.logger.info(f"Paquetes: recibidos: {received_packets}, perdidos: {lost_packets_pc:.1f} %, "
+                         f"descartados por el kernel: {kernel_drops}. "
+                         f"Frames: {frames}, incompletos: {incomplete_frames}")
 
-        blocks_total = self.blocks_valid + self.blocks_invalid
-        blocks_invalid_pc = self.blocks_invalid / blocks_total * 100
+        blocks_total = blocks_valid + blocks_invalid
+        blocks_invalid_pc = blocks_invalid / blocks_total * 100 if blocks_total > 0 else 0
         if blocks_total > 0:
             self.logger.info(f"Bloques de azimuth. "
-                             f"Validos: {self.blocks_valid} ({100 - blocks_invalid_pc:.1f} %). "
-                             f"Invalidos: {self.blocks_invalid} ({blocks_invalid_pc:.1f} %)")
-
-        # TODO: Considerar enviar al manager las estadísticas:
-        #  (received_packets, lost_packets_pc, blocks_total, blocks_valid))
-        #  Aunque igual se pueden ver en el log...
-
-        self.blocks_valid, self.blocks_invalid = 0, 0
+                             f"Validos: {blocks_valid} ({100 - blocks_invalid_pc:.1f} %). "
+                             f"Invalidos: {blocks_invalid} ({blocks_invalid_pc:.1f} %)")
 
         if lost_packets_pc > LOST_PACKETS_ERROR_THRESHOLD or blocks_invalid_pc > INVALID_BLOCKS_ERROR_THRESHOLD:
             self.hw_state = HWStates.ERROR
@@ -201,7 +320,18 @@ class OS1LiDARAgent(AbstractHWAgent):
         pass
 
     def _agent_run_non_hw_threads(self):
-        pass
+        Thread(target=self.__report_health, name="__report_health", daemon=True).start()
+
+    def __report_health(self):
+        """
+        Envía periódicamente al manager las métricas de salud del LiDAR en ventana móvil
+        """
+        while not self.flags.quit.wait(HEALTH_PERIOD):
+            self.counters[PACKETS] = self.frames.total_received
+            self.counters[EXPECTED] = self.frames.total_expected
+            metrics = self.health.sample()
+            if self.state == AgentStatus.CAPTURING:
+                self._send_msg_to_mgr(Message.health(metrics))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,167 @@
+"""
+Sincronización a disco de los archivos de salida de los agentes, para acotar los datos que se pierden si el equipo se
+apaga abruptamente (e.g. corte de energía del vehículo).
+
+Modos:
+    none:     no se sincroniza; el kernel escribe los datos a su ritmo (ver /proc/sys/vm/dirty_expire_centisecs)
+    periodic: fdatasync cada sync_bytes escritos o cada sync_interval segundos (lo que ocurra primero), y al cerrar.
+              El tiempo se revisa en cada escritura, así que el intervalo se cumple mientras lleguen datos
+    close:    fdatasync solo al cerrar el archivo (fin del segmento)
+
+Opcionalmente el archivo se reserva en disco por bloques de preallocate bytes con posix_fallocate, lo que reduce la
+fragmentación en tarjetas SD y evita actualizar el tamaño del archivo en cada fdatasync. Al cerrar se trunca al
+tamaño escrito; si el equipo se apaga antes, el archivo puede terminar con bytes nulos hasta el fin del bloque
+reservado.
+"""
+import os
+import time
+
+DURABILITY_NONE = "none"
+DURABILITY_PERIODIC = "periodic"
+DURABILITY_CLOSE = "close"
+DURABILITY_MODES = (DURABILITY_NONE, DURABILITY_PERIODIC, DURABILITY_CLOSE)
+DEFAULT_SYNC_BYTES = 4 * 1024 * 1024
+DEFAULT_SYNC_INTERVAL = 5.0  # segundos
+
+_fdatasync = getattr(os, "fdatasync", os.fsync)  # fdatasync no existe en todas las plataformas
+
+
+class Durability:
+    def __init__(self, mode=DURABILITY_NONE, sync_bytes=DEFAULT_SYNC_BYTES, sync_interval=DEFAULT_SYNC_INTERVAL,
+                 preallocate=0):
+        """
+        :param mode: uno de DURABILITY_MODES
+        :param sync_bytes: con periodic, bytes escritos entre sincronizaciones. 0: sin límite por bytes
+        :param sync_interval: con periodic, segundos entre sincronizaciones. 0: sin límite por tiempo
+        :param preallocate: bytes que se reservan en disco cada vez. 0: no se reserva
+        """
+        if mode not in DURABILITY_MODES:
+            raise ValueError(f"Modo de sincronización desconocido: {mode}")
+        self.mode = mode
+        self.sync_bytes = sync_bytes
+        self.sync_interval = sync_interval
+        self.preallocate = preallocate
+
+    @classmethod
+    def from_config(cls, cfg):
+        """
+        :param cfg: dict con claves opcionales mode, sync_bytes, sync_interval y preallocate
+        """
+        return cls(mode=cfg.get("mode", DURABILITY_NONE),
+                   sync_bytes=int(cfg.get("sync_bytes", DEFAULT_SYNC_BYTES)),
+                   sync_interval=float(cfg.get("sync_interval", DEFAULT_SYNC_INTERVAL)),
+                   preallocate=int(cfg.get("preallocate", 0)))
+
+
+class SegmentFile:
+    """
+    Envuelve un archivo abierto con open() y lo sincroniza a disco según la política de durabilidad.
+    Tiene la interfaz de archivo que usa el escritor de AbstractHWAgent (write, flush, close y closed)
+    """
+    def __init__(self, file, durability: Durability, logger=None):
+        self.file = file
+        self.durability = durability
+        self.logger = logger
+        self.__fd = file.fileno()
+        self.__allocated = 0
+        self.__last_sync = time.monotonic()
+        self.written = 0  # Bytes escritos (caracteres en modo texto)
+        self.synced = 0  # Bytes escritos hasta la última sincronización
+        self.max_unsynced = 0  # Máximo de bytes escritos y aún no sincronizados (pérdida en el peor caso)
+        self.max_unsynced_time = 0.0  # Máximo de segundos entre sincronizaciones con datos pendientes
+        self.syncs = 0
+        self.sync_time = 0.0
+        self.max_sync_time = 0.0
+        self.__preallocate()
+
+    @property
+    def name(self):
+        return self.file.name
+
+    @property
+    def closed(self):
+        return self.file.closed
+
+    def fileno(self):
+        return self.__fd
+
+    def write(self, data):
+        n = self.file.write(data)
+        self.written += len(data)
+        if self.__allocated and self.written >= self.__allocated:
+            self.__preallocate()
+        if self.durability.mode == DURABILITY_PERIODIC:
+            unsynced = self.written - self.synced
+            if (self.durability.sync_bytes and unsynced >= self.durability.sync_bytes) or \
+                    (self.durability.sync_interval and
+                     time.monotonic() - self.__last_sync >= self.durability.sync_interval):
+                self.sync()
+        return n
+
+    def flush(self):
+        self.file.flush()
+
+    def sync(self):
+        """
+        Escribe a disco todo lo escrito hasta ahora
+        """
+        now = time.monotonic()
+        self.max_unsynced = max(self.max_unsynced, self.written - self.synced)
+        if self.written > self.synced:
+            self.max_unsynced_time = max(self.max_unsynced_time, now - self.__last_sync)
+        self.file.flush()
+        _fdatasync(self.__fd)
+        sync_time = time.monotonic() - now
+        self.syncs += 1
+        self.sync_time += sync_time
+        self.max_sync_time = max(self.max_sync_time, sync_time)
+        self.synced = self.written
+        self.__last_sync = time.monotonic()
+
+    def close(self):
+        if self.file.closed:
+            return
+        try:
+            self.file.flush()
+            if self.__allocated:  # Descarta lo reservado y no usado
+                os.ftruncate(self.__fd, os.lseek(self.__fd, 0, os.SEEK_CUR))
+            if self.durability.mode != DURABILITY_NONE:
+                self.sync()
+                if self.logger is not None:
+                    self.logger.info(f"Archivo {os.path.basename(self.name)}: {self.syncs} sincronizaciones a disco "
+                                     f"(media {1000 * self.sync_time / self.syncs:.1f} ms, "
+                                     f"máx {1000 * self.max_sync_time:.1f} ms), "
+                                     f"máx {self.max_unsynced} bytes sin sincronizar")
+        finally:
+            self.file.close()
+
+    def __preallocate(self):
+        if not self.durability.preallocate:
+            return
+        try:
+            os.posix_fallocate(self.__fd, self.__allocated, self.durability.preallocate)
+            self.__allocated += self.durability.preallocate
+        except (OSError, AttributeError) as e:  # Sistema de archivos o plataforma sin soporte
+            self.__allocated = 0
+            self.durability.preallocate = 0
+            if self.logger is not None:
+                self.logger.warning(f"No se pudo reservar espacio para {self.name}: {e}")
+
+
+def sync_tree(root):
+    """
+    Sincroniza a disco los archivos y directorios bajo root (incluido), sin sincronizar todo el sistema como os.sync
+    """
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in filenames:
+            fd = os.open(os.path.join(dirpath, name), os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+    for dirpath, dirnames, filenames in os.walk(root, topdown=False):  # Las entradas de directorio, al final
+        fd = os.open(dirpath, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
@@ -0,0 +1,229 @@
+"""
+Formato comprimido para los archivos XYZ del LiDAR.
+
+Los bloques XYZ (formato XYZ_BLOCK) se agrupan en chunks que se comprimen de forma independiente, de modo que un
+archivo que quedó a medio escribir (e.g. por un corte de energía) se puede leer hasta el último chunk completo.
+Dentro de cada chunk los campos se reordenan por columna y el timestamp y las coordenadas x, y, z de cada canal se
+codifican como diferencias respecto al bloque anterior, lo que las hace mucho más compresibles.
+
+Estructura del archivo:
+    Encabezado: MAGIC, versión (H), códec (B)
+    Chunks:     largo sin comprimir (I), largo comprimido (I), cantidad de bloques (I), CRC32 de los datos
+                comprimidos (I), y los datos comprimidos
+
+Códecs: zstd (paquete zstandard) o lz4 (paquete lz4) si están instalados. Si no, zlib (biblioteca estándar).
+
+Descompresión a formato XYZ_BLOCK:
+    python -m agents.os1.compressed lidar.xyzc [lidar_xyz.bin]
+"""
+import os
+import struct
+import sys
+import time
+import zlib
+
+import numpy as np
+
+from agents.os1.lidar_packet import XYZ_AZIMUTH_DTYPE
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+MAGIC = b"OS1XYZC"
+FILE_EXTENSION = ".xyzc"  # Reemplaza la extensión del nombre de archivo configurado (e.g. lidar.bin -> lidar.xyzc)
+VERSION = 1
+CODEC_ZLIB = 0
+CODEC_ZSTD = 1
+CODEC_LZ4 = 2
+CODEC_NAMES = {CODEC_ZLIB: "zlib", CODEC_ZSTD: "zstd", CODEC_LZ4: "lz4"}
+FILE_HEADER = "<7sHB"
+CHUNK_HEADER = "<IIII"
+FILE_HEADER_SIZE = struct.calcsize(FILE_HEADER)
+CHUNK_HEADER_SIZE = struct.calcsize(CHUNK_HEADER)
+DEFAULT_CHUNK_BLOCKS = 1024  # Bloques XYZ por chunk. En 512x10 equivale a ~0.5 s de datos
+
+_chunk_header_pack = struct.Struct(CHUNK_HEADER).pack
+_chunk_header_unpack = struct.Struct(CHUNK_HEADER).unpack
+# Campos en el orden en que se guardan por columna, y si se codifican como diferencias
+_COLUMNS = (
+    (("timestamp",), True),
+    (("measurement_id",), False),
+    (("frame_id",), False),
+    (("channels", "channel"), False),
+    (("channels", "x"), True),
+    (("channels", "y"), True),
+    (("channels", "z"), True),
+    (("channels", "reflectivity"), False),
+)
+
+
+class CompressedFileError(Exception):
+    pass
+
+
+def best_codec():
+    if zstandard is not None:
+        return CODEC_ZSTD
+    if lz4 is not None:
+        return CODEC_LZ4
+    return CODEC_ZLIB
+
+
+def _compress(codec, data):
+    if codec == CODEC_ZSTD:
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    if codec == CODEC_LZ4:
+        return lz4.frame.compress(data)
+    return zlib.compress(data, 1)
+
+
+def _decompress(codec, data):
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise CompressedFileError("El archivo usa zstd, pero el paquete 'zstandard' no está instalado")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == CODEC_LZ4:
+        if lz4 is None:
+            raise CompressedFileError("El archivo usa lz4, pero el paquete 'lz4' no está instalado")
+        return lz4.frame.decompress(data)
+    return zlib.decompress(data)
+
+
+def _field(blocks, path):
+    for name in path:
+        blocks = blocks[name]
+    return blocks
+
+
+def encode_blocks(blocks):
+    """
+    Reordena por columna y codifica como diferencias un arreglo de bloques XYZ (XYZ_AZIMUTH_DTYPE)
+    Las diferencias se calculan con la aritmética modular del mismo tipo de dato, por lo que son exactamente reversibles
+    """
+    columns = []
+    for path, delta in _COLUMNS:
+        column = np.ascontiguousarray(_field(blocks, path))
+        if delta and len(column):
+            column = column.copy()
+            column[1:] = column[1:] - column[:-1]
+        columns.append(column.tobytes())
+    return b"".join(columns)
+
+
+def decode_blocks(data, num_blocks):
+    blocks = np.empty(num_blocks, dtype=XYZ_AZIMUTH_DTYPE)
+    offset = 0
+    for path, delta in _COLUMNS:
+        target = _field(blocks, path)
+        size = target.dtype.itemsize * target.size
+        column = np.frombuffer(data, dtype=target.dtype, count=target.size, offset=offset).reshape(target.shape)
+        if delta:
+            column = np.cumsum(column, axis=0, dtype=target.dtype)
+        target[...] = column
+        offset += size
+    return blocks
+
+
+class CompressedXYZFile:
+    """
+    Objeto tipo archivo (write/flush/close) que recibe bytes en formato XYZ_BLOCK y escribe el formato comprimido.
+    Lleva la cuenta de bytes de entrada y salida, y del tiempo de CPU usado para comprimir
+    """
+    def __init__(self, file, codec=None, chunk_blocks=DEFAULT_CHUNK_BLOCKS):
+        self.file = file
+        self.codec = best_codec() if codec is None else codec
+        self.chunk_size = chunk_blocks * XYZ_AZIMUTH_DTYPE.itemsize
+        self.buffer = bytearray()
+        self.raw_bytes = 0
+        self.compressed_bytes = FILE_HEADER_SIZE
+        self.cpu_time = 0.0
+        self.file.write(struct.pack(FILE_HEADER, MAGIC, VERSION, self.codec))
+
+    @property
+    def closed(self):
+        return self.file.closed
+
+    @property
+    def ratio(self):
+        return self.raw_bytes / self.compressed_bytes if self.compressed_bytes else 0.0
+
+    def write(self, data):
+        self.buffer += data
+        self.raw_bytes += len(data)
+        if len(self.buffer) >= self.chunk_size:
+            self.__write_chunk(self.chunk_size * (len(self.buffer) // self.chunk_size))
+        return len(data)
+
+    def __write_chunk(self, size):
+        num_blocks = size // XYZ_AZIMUTH_DTYPE.itemsize
+        size = num_blocks * XYZ_AZIMUTH_DTYPE.itemsize
+        if not num_blocks:
+            return
+        t0 = time.thread_time()
+        blocks = np.frombuffer(bytes(self.buffer[:size]), dtype=XYZ_AZIMUTH_DTYPE)
+        del self.buffer[:size]
+        payload = _compress(self.codec, encode_blocks(blocks))
+        chunk = _chunk_header_pack(size, len(payload), num_blocks, zlib.crc32(payload)) + payload
+        self.cpu_time += time.thread_time() - t0
+        self.file.write(chunk)
+        self.compressed_bytes += len(chunk)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.__write_chunk(len(self.buffer))
+        self.file.close()
+
+
+def read_chunks(file):
+    """
+    Lee un archivo comprimido. Se detiene sin error en el primer chunk incompleto o corrupto
+    :param file: archivo abierto en modo binario
+    :return: generador de arreglos de bloques XYZ (XYZ_AZIMUTH_DTYPE), uno por chunk
+    """
+    magic, version, codec = struct.unpack(FILE_HEADER, file.read(FILE_HEADER_SIZE))
+    if magic != MAGIC:
+        raise CompressedFileError("El archivo no es un archivo XYZ comprimido")
+    if version != VERSION:
+        raise CompressedFileError(f"Versión de archivo no soportada: {version}")
+    while True:
+        header = file.read(CHUNK_HEADER_SIZE)
+        if len(header) < CHUNK_HEADER_SIZE:
+            return
+        raw_size, size, num_blocks, crc = _chunk_header_unpack(header)
+        payload = file.read(size)
+        if len(payload) < size or zlib.crc32(payload) != crc:
+            return
+        yield decode_blocks(_decompress(codec, payload), num_blocks)
+
+
+def decompress_file(src_path, dst_path):
+    """
+    Descomprime un archivo al formato XYZ_BLOCK
+    :return: cantidad de bloques escritos
+    """
+    num_blocks = 0
+    with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+        for blocks in read_chunks(src):
+            dst.write(blocks.tobytes())
+            num_blocks += len(blocks)
+    return num_blocks
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    src = sys.argv[1]
+    dst = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(src)[0] + "_xyz.bin"
+    n = decompress_file(src, dst)
+    print(f"{n} bloques descomprimidos a {dst}")
@@ -1,6 +1,7 @@
 from __future__ import unicode_literals
 
 import json
+import os
 import socket
 import time
 
@@ -11,6 +12,8 @@ class OS1ConfigurationError(Exception):
     pass
 
 IMU_FREQUENCY = 100 #Hz. Frecuencia de salida de datos de IMU
+STATUS_RUNNING = "RUNNING"
+COMMAND_TIMEOUT = 5  # Segundos de espera por la respuesta a un comando
 
 class OS1(object):
     MODES = ("512x10", "512x20", "1024x10", "1024x20", "2048x10")
@@ -20,30 +23,69 @@ class OS1(object):
         self.dest_host = dest_ip
         self.udp_port = udp_port
         self.mode = mode
+        self.columns_per_frame = int(mode.split("x")[0])
         self.api = OS1API(sensor_ip, tcp_port)
         self._beam_intrinsics = None
         self._server = None
 
     def start(self):
-        self.set_config_param("lidar_mode", self.mode)
-        self.raise_for_error()
-        # If we don't have a brief wait between calls the device will close the
-        # TCP connection.
-        time.sleep(0.1)
-
-        self.set_config_param("udp_ip", self.dest_host)
-        self.raise_for_error()
-        time.sleep(0.1)
-
-        self._beam_intrinsics = json.loads(self.get_beam_intrinsics())
+        """
+        Configura modo y destino de los datos y reinicia el sensor, en una sola conexión TCP.
+        No espera a que el sensor esté operativo (ver wait_until_running)
+        """
+        if self._beam_intrinsics is None:
+            self.load_beam_intrinsics()
         build_trig_table(
             self._beam_intrinsics["beam_altitude_angles"],
             self._beam_intrinsics["beam_azimuth_angles"],
         )
-        time.sleep(0.1)
+        self.send_commands(
+            "set_config_param lidar_mode {}".format(self.mode),
+            "set_config_param udp_ip {}".format(self.dest_host),
+            "reinitialize",
+        )
 
-        self.reinitialize()
-        self.raise_for_error()
+    def load_beam_intrinsics(self, cache_dir=None):
+        """
+        Obtiene los beam intrinsics. Si se indica cache_dir, los guarda en disco asociados al número de serie del
+        sensor y en los siguientes llamados los lee desde ahí en vez de pedirlos al sensor
+        :return: dict con los beam intrinsics
+        """
+        cache_file = None
+        if cache_dir:
+            serial = json.loads(self.get_sensor_info())["prod_sn"]
+            cache_file = os.path.join(cache_dir, "beam_intrinsics_{}.json".format(serial))
+            if os.path.exists(cache_file):
+                with open(cache_file) as f:
+                    self._beam_intrinsics = json.load(f)
+                return self._beam_intrinsics
+        self._beam_intrinsics = json.loads(self.get_beam_intrinsics())
+        if cache_file:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(cache_file, "w") as f:
+                json.dump(self._beam_intrinsics, f)
+        return self._beam_intrinsics
+
+    def wait_until_running(self, timeout, poll_interval=0.5, stop_event=None):
+        """
+        Consulta el estado del sensor hasta que informe RUNNING
+        :param timeout: máximo tiempo de espera (s)
+        :param stop_event: threading.Event opcional para abortar la espera
+        :return: True si el sensor está operativo, False si se cumplió el timeout o se abortó la espera
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                if json.loads(self.get_sensor_info()).get("status") == STATUS_RUNNING:
+                    return True
+            except (OSError, ValueError):  # Sensor reiniciándose: rechaza la conexión o responde incompleto
+                pass
+            if stop_event is not None:
+                if stop_event.wait(poll_interval):
+                    return False
+            else:
+                time.sleep(poll_interval)
+        return False
 
     def __getattr__(self, name):
         return getattr(self.api, name)
@@ -53,6 +95,8 @@ class OS1API(object):
     def __init__(self, host, port=7501):
         self.address = (host, port)
         self._error = None
+        self._sock = None  # Conexión TCP persistente, se abre en el primer comando
+        self._buffer = b""
 
     def get_alerts(self):
         return self._send("get_alerts")
@@ -93,18 +137,63 @@ class OS1API(object):
             return True
         return False
 
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+        self._buffer = b""
+
+    def send_commands(self, *commands):
+        """
+        Envía varios comandos seguidos por la misma conexión y luego lee las respuestas, en orden.
+        Si alguno responde con error, lanza OS1ConfigurationError
+        :return: lista de respuestas
+        """
+        payload = b"".join(command.encode("utf-8") + b"\n" for command in commands)
+        responses = self._transact(payload, len(commands))
+        for response in responses:
+            self._error_check(response)
+            self.raise_for_error()
+        return [r.decode("utf-8") for r in responses]
+
     def _send(self, command, *args):
         self._error = None
         payload = " ".join([command] + list(args)).encode("utf-8") + b"\n"
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-            sock.connect(self.address)
-            sock.sendall(payload)
-            response = b""
-            while not response.endswith(b"\n"):
-                response += sock.recv(1024)
+        response = self._transact(payload, 1)[0]
         self._error_check(response)
         return response.decode("utf-8")
 
+    def _transact(self, payload, num_responses):
+        """
+        Envía payload por la conexión persistente y lee num_responses líneas. Si falla el envío (e.g. el sensor cerró
+        la conexión al reinicializarse), reconecta y reintenta una vez. Un error al leer las respuestas no se reintenta,
+        porque los comandos ya pudieron haberse ejecutado: cierra la conexión y se propaga
+        """
+        for attempt in range(2):
+            try:
+                if self._sock is None:
+                    self._sock = socket.create_connection(self.address, timeout=COMMAND_TIMEOUT)
+                self._sock.sendall(payload)
+                break
+            except OSError:
+                self.close()
+                if attempt:
+                    raise
+        try:
+            return [self._read_line() for _ in range(num_responses)]
+        except OSError:
+            self.close()
+            raise
+
+    def _read_line(self):
+        while b"\n" not in self._buffer:
+            chunk = self._sock.recv(4096)
+            if not chunk:
+                raise ConnectionResetError("Conexión cerrada por el sensor")
+            self._buffer += chunk
+        line, self._buffer = self._buffer.split(b"\n", 1)
+        return line + b"\n"
+
     def _error_check(self, response):
         response = response.decode("utf-8")
         if response.startswith("error"):
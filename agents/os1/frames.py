@@ -0,0 +1,133 @@
+"""
+Agrupación de los paquetes del LiDAR en frames (revoluciones completas).
+
+Cada frame reúne en un único arreglo contiguo los bloques de azimuth de los paquetes admitidos de una revolución,
+junto con su completitud (paquetes esperados, recibidos y measurement IDs faltantes). Las estadísticas de pérdida se
+actualizan en O(1) por paquete.
+"""
+from threading import Lock
+
+import numpy as np
+
+from agents.os1.lidar_packet import AZIMUTH_BLOCK_COUNT, AZIMUTH_DTYPE, MAX_FRAME_ID, as_array
+
+# Saltos de frame_id mayores que este (hacia adelante) se consideran un reinicio del stream (e.g. reinicialización del
+# sensor) y no frames perdidos. Un paquete con frame_id hasta este valor anterior al del frame en curso es un paquete
+# atrasado o desordenado y se descarta
+MAX_FRAME_GAP = 16
+
+
+class Frame:
+    def __init__(self, frame_id, first_measurement_id, expected_packets, partial_start=False):
+        self.frame_id = frame_id
+        self.first_measurement_id = first_measurement_id
+        self.expected_packets = expected_packets
+        self.partial_start = partial_start  # Primer frame luego de iniciar o reanudar: pudo comenzar a mitad de revolución
+        self.received_packets = 0
+        self.blocks = np.zeros((expected_packets, AZIMUTH_BLOCK_COUNT), dtype=AZIMUTH_DTYPE)
+        self.received = np.zeros(expected_packets, dtype=bool)  # Paquetes recibidos, por posición en el frame
+
+    @property
+    def complete(self):
+        return self.received_packets == self.expected_packets
+
+    @property
+    def missing_measurement_ids(self):
+        missing = np.flatnonzero(~self.received)
+        return (self.first_measurement_id + missing[:, np.newaxis] * AZIMUTH_BLOCK_COUNT
+                + np.arange(AZIMUTH_BLOCK_COUNT)).ravel()
+
+
+class FrameAssembler:
+    def __init__(self, first_measurement_id, last_measurement_id, on_frame=None):
+        """
+        :param first_measurement_id: primer measurement ID admitido (primer bloque del primer paquete del frame)
+        :param last_measurement_id: último measurement ID admitido como inicio de paquete
+        :param on_frame: función llamada con cada Frame terminado (al llegar un paquete del frame siguiente)
+        """
+        self.first_packet = first_measurement_id // AZIMUTH_BLOCK_COUNT
+        self.packets_per_frame = last_measurement_id // AZIMUTH_BLOCK_COUNT - self.first_packet + 1
+        self.on_frame = on_frame
+        self.frame = None
+        self.__resumed = True
+        self.__lock = Lock()  # take_stats() se llama desde otro thread que add()
+        self.expected_packets = 0  # Acumulados de frames terminados desde el último take_stats()
+        self.received_packets = 0
+        self.frames = 0
+        self.incomplete_frames = 0
+        self.total_expected = 0  # Acumulados desde la creación, no se reinician con take_stats()
+        self.total_received = 0
+        self.late_packets = 0  # Paquetes descartados por pertenecer a un frame ya terminado
+        self.stream_resets = 0  # Saltos de frame_id tratados como reinicio del stream
+
+    def add(self, packet):
+        """
+        Agrega un paquete (bytes o memoryview) admitido al frame que corresponda
+        :return: False si el paquete está fuera del rango de measurement IDs admitidos o es de un frame ya terminado
+        """
+        blocks = as_array(packet)
+        position = int(blocks[0]["measurement_id"]) // AZIMUTH_BLOCK_COUNT - self.first_packet
+        if not 0 <= position < self.packets_per_frame:
+            return False
+        frame_id = int(blocks[0]["frame_id"])
+        with self.__lock:
+            return self.__add(blocks, position, frame_id)
+
+    def __add(self, blocks, position, frame_id):
+        if self.frame is None:
+            self.__start_frame(frame_id)
+        elif frame_id != self.frame.frame_id:
+            forward = (frame_id - self.frame.frame_id) % (MAX_FRAME_ID + 1)
+            if forward <= MAX_FRAME_GAP:
+                self.__finish_frame(forward - 1)  # Frames que no llegaron en absoluto entre el anterior y el nuevo
+            elif (self.frame.frame_id - frame_id) % (MAX_FRAME_ID + 1) <= MAX_FRAME_GAP:
+                self.late_packets += 1
+                return False
+            else:  # Reinicio del stream: no se cuentan frames perdidos y el nuevo frame puede comenzar a mitad
+                self.stream_resets += 1
+                self.__finish_frame()
+                self.__resumed = True
+            self.__start_frame(frame_id)
+        if not self.frame.received[position]:
+            self.frame.received[position] = True
+            self.frame.received_packets += 1
+        self.frame.blocks[position] = blocks
+        return True
+
+    def __start_frame(self, frame_id):
+        self.frame = Frame(frame_id, self.first_packet * AZIMUTH_BLOCK_COUNT, self.packets_per_frame, self.__resumed)
+        self.__resumed = False
+
+    def __finish_frame(self, skipped=0):
+        frame = self.frame
+        expected = (1 + skipped) * frame.expected_packets
+        if frame.partial_start:  # No cuenta como perdidos los paquetes anteriores al primero recibido
+            expected -= int(np.argmax(frame.received))
+        self.frames += 1 + skipped
+        self.expected_packets += expected
+        self.received_packets += frame.received_packets
+        self.total_expected += expected
+        self.total_received += frame.received_packets
+        self.incomplete_frames += skipped + (0 if frame.complete else 1)
+        if self.on_frame is not None:
+            self.on_frame(frame)
+
+    def reset(self):
+        """
+        Descarta el frame en curso sin contarlo. Debe llamarse desde el mismo hilo que add() cuando se dejan de
+        recibir paquetes (e.g. captura en pausa), para que los frames no recibidos en ese lapso no cuenten como pérdida
+        """
+        with self.__lock:
+            self.frame = None
+            self.__resumed = True
+
+    def take_stats(self):
+        """
+        Entrega las estadísticas de los frames terminados y las reinicia. El frame en curso se contará en la
+        siguiente llamada
+        :return: (frames, frames incompletos, paquetes esperados, paquetes recibidos)
+        """
+        with self.__lock:
+            stats = (self.frames, self.incomplete_frames, self.expected_packets, self.received_packets)
+            self.frames, self.incomplete_frames, self.expected_packets, self.received_packets = 0, 0, 0, 0
+        return stats
@@ -0,0 +1,54 @@
+"""
+Métricas de salud del LiDAR en ventana móvil.
+
+Los hilos de recepción y conversión solo incrementan contadores acumulados en un arreglo de tamaño fijo. Cada cierto
+tiempo se toma una muestra de esos contadores y las métricas se calculan como la diferencia entre la muestra más
+reciente y la más antigua de la ventana, sin estructuras que crezcan con el tiempo.
+"""
+import time
+
+import numpy as np
+
+# Índices de los contadores acumulados
+PACKETS = 0  # Paquetes recibidos de frames terminados
+EXPECTED = 1  # Paquetes esperados de frames terminados
+BLOCKS_VALID = 2
+BLOCKS_INVALID = 3
+KERNEL_DROPS = 4  # Paquetes descartados por el kernel
+CONVERTED = 5  # Paquetes convertidos a XYZ
+CONVERSION_TIME = 6  # Tiempo total de conversión (s)
+NUM_COUNTERS = 7
+
+
+class HealthMonitor:
+    def __init__(self, window=10):
+        """
+        :param window: cantidad de muestras que abarca la ventana móvil
+        """
+        self.counters = np.zeros(NUM_COUNTERS)
+        self.__samples = np.zeros((window + 1, NUM_COUNTERS))
+        self.__times = np.zeros(window + 1)
+        self.__count = 0
+
+    def sample(self, now=None):
+        """
+        Toma una muestra de los contadores y calcula las métricas de la ventana
+        :return: dict con paquetes/s (pps), pérdida de paquetes % (loss), bloques inválidos % (inv), paquetes
+                 descartados por el kernel (kdrop) y latencia media de conversión en ms (conv_ms)
+        """
+        size = len(self.__times)
+        newest = self.__count % size
+        self.__samples[newest] = self.counters
+        self.__times[newest] = time.time() if now is None else now
+        self.__count += 1
+        oldest = self.__count % size if self.__count >= size else 0
+        delta = self.__samples[newest] - self.__samples[oldest]
+        elapsed = self.__times[newest] - self.__times[oldest]
+        blocks = delta[BLOCKS_VALID] + delta[BLOCKS_INVALID]
+        return {
+            "pps": round(delta[PACKETS] / elapsed, 1) if elapsed > 0 else 0.0,
+            "loss": round(max(0.0, 100 * (1 - delta[PACKETS] / delta[EXPECTED])), 2) if delta[EXPECTED] > 0 else 0.0,
+            "inv": round(100 * delta[BLOCKS_INVALID] / blocks, 2) if blocks > 0 else 0.0,
+            "kdrop": int(delta[KERNEL_DROPS]),
+            "conv_ms": round(1000 * delta[CONVERSION_TIME] / delta[CONVERTED], 3) if delta[CONVERTED] > 0 else 0.0,
+        }
@@ -2,6 +2,8 @@ import math
 import struct
 from functools import lru_cache
 
+import numpy as np
+
 NUM_USED_CHANNELS = 16 #USamos el OS1-16, que solo posee 16 canales
 PACKET_SIZE = 12608
 MAX_FRAME_ID = 0xFFFF
@@ -44,6 +46,37 @@ XYZ_AZIMUTH_BLOCK = (
 ).format(XYZ_CHANNEL_BLOCK * NUM_USED_CHANNELS)
 XYZ_BLOCK = "<" + XYZ_AZIMUTH_BLOCK
 
+# Vistas NumPy equivalentes a los formatos struct anteriores (mismo layout, sin padding)
+CHANNEL_DTYPE = np.dtype([
+    ("range", "<u4"),
+    ("reflectivity", "<u2"),
+    ("signal_photons", "<u2"),
+    ("noise_photons", "<u2"),
+    ("unused", "<u2"),
+])
+AZIMUTH_DTYPE = np.dtype([
+    ("timestamp", "<u8"),
+    ("measurement_id", "<u2"),
+    ("frame_id", "<u2"),
+    ("encoder_count", "<u4"),
+    ("channels", CHANNEL_DTYPE, (CHANNEL_BLOCK_COUNT,)),
+    ("status", "<u4"),
+])
+
+XYZ_CHANNEL_DTYPE = np.dtype([
+    ("channel", "u1"),
+    ("x", "<i4"),
+    ("y", "<i4"),
+    ("z", "<i4"),
+    ("reflectivity", "<u2"),
+])
+XYZ_AZIMUTH_DTYPE = np.dtype([
+    ("timestamp", "<u8"),
+    ("measurement_id", "<u2"),
+    ("frame_id", "<u2"),
+    ("channels", XYZ_CHANNEL_DTYPE, (NUM_USED_CHANNELS,)),
+])
+
 
 RADIANS_360 = 2 * math.pi
 
@@ -58,6 +91,13 @@ def unpack(raw_packet):
     return _unpack(raw_packet)
 
 
+def as_array(raw_packet):
+    """
+    Vista (sin copia) del paquete crudo como arreglo estructurado de AZIMUTH_BLOCK_COUNT bloques de azimuth
+    """
+    return np.frombuffer(raw_packet, dtype=AZIMUTH_DTYPE, count=AZIMUTH_BLOCK_COUNT)
+
+
 def azimuth_block(n, packet):
     offset = n * AZIMUTH_BLOCK_SIZE
     return packet[offset : offset + AZIMUTH_BLOCK_SIZE]
@@ -0,0 +1,188 @@
+"""
+Conversión a XYZ en procesos separados, para sacar el cálculo del proceso que recibe los paquetes (y del GIL).
+
+El hilo receptor copia cada paquete a un anillo de memoria compartida (multiprocessing.shared_memory) y le asigna un
+número de secuencia. Los lotes de paquetes se reparten entre N procesos convertidores, que escriben el resultado en
+un segundo anillo compartido, en el slot correspondiente a la misma secuencia. Un hilo recolector ordena los lotes
+terminados por número de secuencia, entrega los resultados en el mismo orden en que llegaron los paquetes y libera
+los slots.
+"""
+import struct
+import threading
+import time
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import wait
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from agents.os1.lidar_packet import AZIMUTH_BLOCK_COUNT, PACKET_SIZE, XYZ_AZIMUTH_DTYPE
+from agents.os1.utils import xyz_points_pack_np
+
+DEFAULT_SLOTS = 2048
+XYZ_SLOT_SIZE = AZIMUTH_BLOCK_COUNT * XYZ_AZIMUTH_DTYPE.itemsize  # Máximo tamaño del resultado de un paquete
+SLOT_META_DTYPE = np.dtype([
+    ("seq", "<u8"),  # Número de secuencia del paquete que ocupa el slot
+    ("length", "<u4"),  # Largo del resultado (bytes)
+    ("valid", "<u2"),  # Bloques de azimuth válidos
+    ("invalid", "<u2"),  # Bloques de azimuth inválidos
+])
+_range_pack = struct.Struct("<QI").pack  # Lote: (primera secuencia, cantidad de paquetes)
+_range_unpack = struct.Struct("<QI").unpack
+
+
+class ConversionWorkerError(Exception):
+    pass
+
+
+def _slot_views(packets_shm, xyz_shm, meta_shm, slots):
+    packets = np.ndarray((slots, PACKET_SIZE), dtype=np.uint8, buffer=packets_shm.buf)
+    xyz = np.ndarray((slots, XYZ_SLOT_SIZE), dtype=np.uint8, buffer=xyz_shm.buf)
+    meta = np.ndarray(slots, dtype=SLOT_META_DTYPE, buffer=meta_shm.buf)
+    return packets, xyz, meta
+
+
+def _convert_worker(packets_shm, xyz_shm, meta_shm, slots, channels, projection_table, tasks, done):
+    """
+    Proceso convertidor. Recibe lotes (primera secuencia, cantidad), convierte los paquetes de esos slots y avisa al
+    recolector. Un mensaje vacío indica que debe terminar
+    """
+    packets, xyz, meta = _slot_views(packets_shm, xyz_shm, meta_shm, slots)
+    try:
+        while True:
+            task = tasks.recv_bytes()
+            if not task:
+                break
+            first, count = _range_unpack(task)
+            for seq in range(first, first + count):
+                i = seq % slots
+                packed, blocks = xyz_points_pack_np(packets[i], channels, projection_table)
+                xyz[i, :len(packed)] = np.frombuffer(packed, dtype=np.uint8)
+                meta[i] = (seq, len(packed), blocks[0], blocks[1])
+            done.send_bytes(task)
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        del packets, xyz, meta  # Libera las vistas antes de que se cierre la memoria compartida
+        for shm in (packets_shm, xyz_shm, meta_shm):
+            shm.close()
+
+
+class ConversionPipeline:
+    def __init__(self, workers, channels, projection_table, on_result, slots=DEFAULT_SLOTS):
+        """
+        :param workers: cantidad de procesos convertidores
+        :param channels: canales activos
+        :param projection_table: tabla de proyección (ver utils.build_projection_table)
+        :param on_result: función llamada desde el hilo recolector por cada paquete convertido, en orden de llegada,
+                          con los argumentos (bytes XYZ, [bloques válidos, bloques inválidos], latencia en segundos
+                          desde que se encoló el paquete)
+        :param slots: capacidad del anillo (paquetes en vuelo)
+        """
+        self.slots = slots
+        self.on_result = on_result
+        self.dropped = 0  # Paquetes descartados por anillo lleno
+        self.__shms = (SharedMemory(create=True, size=slots * PACKET_SIZE),
+                       SharedMemory(create=True, size=slots * XYZ_SLOT_SIZE),
+                       SharedMemory(create=True, size=slots * SLOT_META_DTYPE.itemsize))
+        self.__packets, self.__xyz, self.__meta = _slot_views(*self.__shms, slots)
+        self.__submit_time = np.zeros(slots)  # Momento en que se encoló cada slot (solo en este proceso)
+        self.__next_seq = 0  # Siguiente secuencia a asignar (hilo receptor)
+        self.__released_seq = 0  # Secuencias menores a esta ya fueron entregadas y sus slots están libres (recolector)
+        self.__next_worker = 0
+        self.__tasks = []
+        self.__done = []
+        self.__processes = []
+        self.__worker_of = dict()  # Conexión de resultados -> proceso convertidor
+        self.__closing = False
+        self.__dead_worker = None  # Proceso convertidor que terminó sin que se cerrara el pipeline
+        for _ in range(workers):
+            task_recv, task_send = Pipe(duplex=False)
+            done_recv, done_send = Pipe(duplex=False)
+            p = Process(target=_convert_worker,
+                        args=(*self.__shms, slots, tuple(channels), projection_table, task_recv, done_send),
+                        daemon=True)
+            p.start()
+            task_recv.close()
+            done_send.close()
+            self.__tasks.append(task_send)
+            self.__done.append(done_recv)
+            self.__processes.append(p)
+            self.__worker_of[done_recv] = p
+        self.__stop = threading.Event()
+        self.__collector = threading.Thread(target=self.__collect, name="ConversionPipeline.__collect", daemon=True)
+        self.__collector.start()
+
+    def submit(self, packets):
+        """
+        Encola un lote de paquetes para su conversión. Debe llamarse siempre desde el mismo hilo.
+        Si el anillo no tiene espacio, los paquetes que no caben se descartan (y se cuentan en self.dropped).
+        Si un proceso convertidor terminó, sus lotes no se entregarán nunca y el anillo no se libera más: lanza
+        ConversionWorkerError, y el pipeline solo puede cerrarse
+        """
+        if self.__dead_worker is not None:
+            p = self.__dead_worker
+            raise ConversionWorkerError(f"Proceso convertidor {p.pid} terminó inesperadamente (código {p.exitcode})")
+        first = self.__next_seq
+        free = self.slots - (first - self.__released_seq)
+        count = min(len(packets), free)
+        self.dropped += len(packets) - count
+        if not count:
+            return
+        now = time.perf_counter()
+        for n in range(count):
+            i = (first + n) % self.slots
+            self.__packets[i] = np.frombuffer(packets[n], dtype=np.uint8)
+            self.__submit_time[i] = now
+        self.__next_seq = first + count
+        try:
+            self.__tasks[self.__next_worker].send_bytes(_range_pack(first, count))
+        except OSError as e:
+            raise ConversionWorkerError(f"Proceso convertidor no disponible: {e}")
+        self.__next_worker = (self.__next_worker + 1) % len(self.__tasks)
+
+    def __collect(self):
+        finished = dict()  # Lotes terminados, pendientes de entregar: primera secuencia -> cantidad
+        while not self.__stop.is_set():
+            for conn in wait(self.__done, timeout=0.1):
+                try:
+                    first, count = _range_unpack(conn.recv_bytes())
+                except EOFError:  # Proceso convertidor terminó
+                    self.__done.remove(conn)
+                    if not self.__closing:
+                        self.__worker_of[conn].join(1)  # Para que quede disponible exitcode
+                        self.__dead_worker = self.__worker_of[conn]
+                    continue
+                finished[first] = count
+            # Entrega en orden los lotes contiguos a lo ya entregado
+            while self.__released_seq in finished:
+                first = self.__released_seq
+                for seq in range(first, first + finished.pop(first)):
+                    i = seq % self.slots
+                    meta = self.__meta[i]
+                    self.on_result(self.__xyz[i, :meta["length"]].tobytes(),
+                                   [int(meta["valid"]), int(meta["invalid"])],
+                                   time.perf_counter() - self.__submit_time[i])
+                    self.__released_seq = seq + 1
+            if not self.__done:
+                break
+
+    def close(self):
+        self.__closing = True
+        for conn in self.__tasks:
+            try:
+                conn.send_bytes(b"")
+            except OSError:
+                pass
+        for p in self.__processes:
+            p.join(1)
+            if p.is_alive():
+                p.terminate()
+        self.__stop.set()
+        self.__collector.join(0.5)
+        for conn in self.__tasks + self.__done:
+            conn.close()
+        del self.__packets, self.__xyz, self.__meta
+        for shm in self.__shms:
+            shm.close()
+            shm.unlink()
@@ -0,0 +1,108 @@
+"""
+Contenedor para captura cruda de paquetes UDP del LiDAR, con conversión diferida a XYZ.
+
+Estructura del archivo:
+    Encabezado: MAGIC, versión (H), largo del JSON (I) y JSON con beam intrinsics, modo y canales activos
+    Registros:  timestamp de recepción (d), largo del paquete (I) y el paquete tal como se recibió
+
+Conversión offline a formato XYZ (el mismo que genera el agente en modo "xyz"):
+    python -m agents.os1.raw_file lidar.raw [lidar_xyz.bin]
+"""
+import json
+import os
+import struct
+import sys
+
+from agents.os1.utils import build_projection_table, xyz_points_pack_np
+
+MAGIC = b"OS1RAW"
+FILE_EXTENSION = ".raw"  # Reemplaza la extensión del nombre de archivo configurado (e.g. lidar.bin -> lidar.raw)
+VERSION = 1
+FILE_HEADER = "<6sHI"  # magic, versión, largo del JSON con metadatos
+RECORD_HEADER = "<dI"  # timestamp de recepción (s), largo del paquete (bytes)
+FILE_HEADER_SIZE = struct.calcsize(FILE_HEADER)
+RECORD_HEADER_SIZE = struct.calcsize(RECORD_HEADER)
+
+_file_header_pack = struct.Struct(FILE_HEADER).pack
+_file_header_unpack = struct.Struct(FILE_HEADER).unpack
+_record_header_pack = struct.Struct(RECORD_HEADER).pack
+_record_header_unpack = struct.Struct(RECORD_HEADER).unpack
+
+
+class RawFileError(Exception):
+    pass
+
+
+def raw_file_header(beam_intrinsics, mode, active_channels):
+    """
+    :param beam_intrinsics: dict con 'beam_altitude_angles' y 'beam_azimuth_angles', tal como lo entrega el lidar
+    :param mode: modo del lidar, e.g. "512x10"
+    :param active_channels: canales activos
+    :return: encabezado del archivo, en bytes
+    """
+    meta = json.dumps({
+        "beam_altitude_angles": beam_intrinsics["beam_altitude_angles"],
+        "beam_azimuth_angles": beam_intrinsics["beam_azimuth_angles"],
+        "mode": mode,
+        "active_channels": list(active_channels),
+    }).encode("utf-8")
+    return _file_header_pack(MAGIC, VERSION, len(meta)) + meta
+
+
+def pack_raw_record(timestamp, packet):
+    return _record_header_pack(timestamp, len(packet)) + packet
+
+
+def read_raw_file(file):
+    """
+    Lee un archivo crudo
+    :param file: archivo abierto en modo binario
+    :return: metadatos del encabezado (dict) y un generador de tuplas (timestamp, paquete)
+    """
+    magic, version, meta_len = _file_header_unpack(file.read(FILE_HEADER_SIZE))
+    if magic != MAGIC:
+        raise RawFileError("El archivo no es una captura cruda del LiDAR")
+    if version != VERSION:
+        raise RawFileError(f"Versión de archivo no soportada: {version}")
+    meta = json.loads(file.read(meta_len).decode("utf-8"))
+
+    def records():
+        while True:
+            header = file.read(RECORD_HEADER_SIZE)
+            if len(header) < RECORD_HEADER_SIZE:
+                return
+            timestamp, length = _record_header_unpack(header)
+            packet = file.read(length)
+            if len(packet) < length:  # Registro truncado, e.g. por corte de energía
+                return
+            yield timestamp, packet
+
+    return meta, records()
+
+
+def convert_raw_file(raw_path, xyz_path):
+    """
+    Convierte una captura cruda al formato XYZ que genera el agente del LiDAR
+    :return: cantidad de paquetes convertidos
+    """
+    packets = 0
+    with open(raw_path, "rb") as raw, open(xyz_path, "wb") as xyz:
+        meta, records = read_raw_file(raw)
+        columns = int(meta["mode"].split("x")[0])
+        table = build_projection_table(meta["beam_altitude_angles"], meta["beam_azimuth_angles"], columns)
+        channels = tuple(meta["active_channels"])
+        for timestamp, packet in records:
+            packed, blocks = xyz_points_pack_np(packet, channels, table)
+            xyz.write(packed)
+            packets += 1
+    return packets
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    src = sys.argv[1]
+    dst = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(src)[0] + "_xyz.bin"
+    n = convert_raw_file(src, dst)
+    print(f"{n} paquetes convertidos a {dst}")
@@ -0,0 +1,96 @@
+"""
+Recepción UDP por lotes para los agentes del OS1.
+
+Recibe todos los datagramas disponibles en cada llamada sobre un anillo preasignado de slots (sin crear un objeto
+bytes por paquete), configura SO_RCVBUF y, donde el sistema lo soporta (Linux), lleva la cuenta de paquetes
+descartados por el kernel por falta de espacio en el buffer del socket (SO_RXQ_OVFL). Esto permite distinguir las
+pérdidas del kernel de las pérdidas en el sensor o en la red.
+"""
+import select
+import socket
+import struct
+import sys
+
+# Constante de Linux, no siempre expuesta por el módulo socket. En otros sistemas no se cuentan los descartes
+SO_RXQ_OVFL = getattr(socket, "SO_RXQ_OVFL", 40 if sys.platform.startswith("linux") else None)
+DEFAULT_SLOTS = 256
+_ovfl_unpack = struct.Struct("=I").unpack
+_ancbufsize = socket.CMSG_SPACE(4) if hasattr(socket, "CMSG_SPACE") else 0
+
+
+class PacketReceiver:
+    def __init__(self, sock, packet_size, slots=DEFAULT_SLOTS, rcvbuf=0):
+        """
+        :param sock: socket UDP ya creado (puede estar o no asociado a un puerto)
+        :param packet_size: tamaño esperado de los paquetes. Paquetes de otro tamaño se descartan
+        :param slots: cantidad de slots del anillo. Es también el máximo de paquetes entregados por llamada
+        :param rcvbuf: tamaño solicitado para el buffer de recepción del socket (bytes). 0 para no modificarlo
+        """
+        self.sock = sock
+        self.packet_size = packet_size
+        if rcvbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        self.rcvbuf = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)  # Linux reporta el doble de lo usable
+        self.drops_supported = False
+        if SO_RXQ_OVFL is not None and hasattr(sock, "recvmsg_into") and _ancbufsize:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+                self.drops_supported = True
+            except OSError:
+                pass
+        sock.setblocking(False)
+        # Un slot extra de un byte permite detectar paquetes más grandes que lo esperado
+        self.__slot_size = packet_size + 1
+        self.__ring = bytearray(slots * self.__slot_size)
+        ring_view = memoryview(self.__ring)
+        self.__slots = [ring_view[i * self.__slot_size:(i + 1) * self.__slot_size] for i in range(slots)]
+        self.__next = 0
+        self.packets = 0  # Paquetes válidos entregados
+        self.discarded = 0  # Paquetes descartados por tamaño
+        self.kernel_drops = 0  # Paquetes descartados por el kernel (acumulado desde que se creó el socket)
+
+    def receive(self, timeout=0.1):
+        """
+        Espera hasta timeout segundos a que lleguen datos y entrega todos los paquetes disponibles (hasta la
+        cantidad de slots del anillo).
+        Los paquetes entregados son vistas (memoryview) sobre el anillo, válidas solo hasta la siguiente llamada
+        :return: lista de tuplas (paquete, dirección)
+        """
+        batch = []
+        try:
+            readable, _, _ = select.select([self.sock], [], [], timeout)
+        except (OSError, ValueError):  # Socket cerrado
+            return batch
+        if not readable:
+            return batch
+        for _ in range(len(self.__slots)):
+            slot = self.__slots[self.__next]
+            try:
+                if self.drops_supported:
+                    nbytes, ancdata, flags, address = self.sock.recvmsg_into([slot], _ancbufsize)
+                    for level, typ, data in ancdata:
+                        if level == socket.SOL_SOCKET and typ == SO_RXQ_OVFL:
+                            self.kernel_drops = _ovfl_unpack(data[:4])[0]
+                else:
+                    nbytes, address = self.sock.recvfrom_into(slot)
+            except (BlockingIOError, InterruptedError):
+                break
+            if nbytes != self.packet_size:
+                self.discarded += 1
+                continue
+            self.__next = (self.__next + 1) % len(self.__slots)
+            self.packets += 1
+            batch.append((slot[:nbytes], address))
+        return batch
+
+    def flush(self):
+        """
+        Descarta lo que haya en el buffer del socket (e.g. paquetes viejos al reconectar)
+        :return: bytes descartados
+        """
+        discarded = 0
+        while True:
+            try:
+                discarded += len(self.sock.recv(self.__slot_size))
+            except OSError:  # Buffer vacío (BlockingIOError) o socket cerrado
+                return discarded
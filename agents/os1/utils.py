@@ -1,9 +1,15 @@
 import math
 import struct
 
+import numpy as np
+
 from agents.os1.lidar_packet import (
     AZIMUTH_BLOCK_COUNT,
     CHANNEL_BLOCK_COUNT,
+    RADIANS_360,
+    TICKS_PER_REVOLUTION,
+    XYZ_AZIMUTH_DTYPE,
+    as_array,
     azimuth_angle_from_encoder,
     azimuth_block,
     azimuth_measurement_id,
@@ -33,9 +39,11 @@ class UninitializedTrigTable(Exception):
 
 
 _trig_table = []
+_trig_array = np.empty((0, 3))  # Misma información que _trig_table, como arreglo para la versión vectorizada
 
 
 def build_trig_table(beam_altitude_angles, beam_azimuth_angles):
+    global _trig_array
     if not _trig_table:
         for i in range(CHANNEL_BLOCK_COUNT):
             _trig_table.append(
@@ -45,6 +53,7 @@ def build_trig_table(beam_altitude_angles, beam_azimuth_angles):
                     beam_azimuth_angles[i] * math.radians(1),
                 ]
             )
+        _trig_array = np.array(_trig_table, dtype=np.float64)
 
 
 def xyz_point(channel_n, azimuth_block):
@@ -112,5 +121,71 @@ def xyz_points_pack(packet, channels):
     return packed, [valid_blocks, invalid_blocks]
 
 
+def build_projection_table(beam_altitude_angles, beam_azimuth_angles, columns_per_frame):
+    """
+    Construye la tabla de vectores de dirección, indexada por [measurement_id, canal] y con las componentes (x, y, z).
+    Con ella cada punto se obtiene como rango * vector, sin trigonometría por paquete.
+    Se construye una sola vez a partir de los beam intrinsics y del modo del lidar, y no depende de estado global,
+    por lo que sirve tanto para el agente como para herramientas offline
+    :param beam_altitude_angles: ángulos de altitud de cada canal, en grados
+    :param beam_azimuth_angles: offsets de azimuth de cada canal, en grados
+    :param columns_per_frame: mediciones (columnas) por revolución según el modo del lidar (512, 1024 o 2048)
+    :return: arreglo de forma (columns_per_frame, CHANNEL_BLOCK_COUNT, 3)
+    """
+    altitude = np.asarray(beam_altitude_angles, dtype=np.float64) * math.radians(1)
+    adjusted_angle = np.asarray(beam_azimuth_angles, dtype=np.float64) * math.radians(1) \
+        + (RADIANS_360 * np.arange(columns_per_frame) / columns_per_frame)[:, np.newaxis]
+    table = np.empty((columns_per_frame, CHANNEL_BLOCK_COUNT, 3))
+    table[..., 0] = -np.cos(altitude) * np.cos(adjusted_angle)
+    table[..., 1] = np.cos(altitude) * np.sin(adjusted_angle)
+    table[..., 2] = np.sin(altitude)
+    return table
+
+
+def xyz_points_pack_np(packet, channels, projection_table=None):
+    """
+    Versión vectorizada de xyz_points_pack. Procesa todos los bloques de azimuth del paquete de una sola vez usando NumPy.
+    Sin projection_table genera exactamente los mismos bytes que xyz_points_pack (ángulo a partir del encoder).
+    Con projection_table (ver build_projection_table) usa el ángulo nominal de cada measurement_id y no calcula
+    trigonometría. El resultado difiere a lo más en pocos milímetros por la diferencia entre encoder y ángulo nominal
+    :param packet: paquete de datos UDP proveniente del lidar (bytes)
+    :param channels: canales activos
+    :param projection_table: tabla de vectores de dirección construida con build_projection_table
+    :return: un array de bytes con los bloques válidos en coordenadas cartesianas, y [bloques válidos, bloques inválidos]
+    """
+    blocks = as_array(packet)
+    blocks = blocks[blocks["status"] != 0]
+    valid_blocks = len(blocks)
+    channels = list(channels)
+
+    data = blocks["channels"][:, channels]
+    dist = (data["range"] & RANGE_BIT_MASK).astype(np.float64)
+
+    xyz = np.empty(valid_blocks, dtype=XYZ_AZIMUTH_DTYPE)
+    xyz["timestamp"] = blocks["timestamp"]
+    xyz["measurement_id"] = blocks["measurement_id"]
+    xyz["frame_id"] = blocks["frame_id"]
+    points = xyz["channels"]
+    points["channel"] = channels
+    if projection_table is not None:
+        vectors = projection_table[blocks["measurement_id"][:, np.newaxis], channels]
+        points["x"] = dist * vectors[..., 0]
+        points["y"] = dist * vectors[..., 1]
+        points["z"] = dist * vectors[..., 2]
+    else:
+        if not len(_trig_array):
+            raise UninitializedTrigTable()
+        table = _trig_array[channels]
+        adjusted_angle = table[:, 2] + (RADIANS_360 * blocks["encoder_count"].astype(np.float64)
+                                        / TICKS_PER_REVOLUTION)[:, np.newaxis]
+        # Mismo orden de operaciones que xyz_points_pack, para que el truncamiento a entero sea idéntico
+        points["x"] = (-dist * table[:, 1]) * np.cos(adjusted_angle)
+        points["y"] = (dist * table[:, 1]) * np.sin(adjusted_angle)
+        points["z"] = dist * table[:, 0]
+    points["reflectivity"] = data["reflectivity"]
+
+    return xyz.tobytes(), [valid_blocks, AZIMUTH_BLOCK_COUNT - valid_blocks]
+
+
 def peek_encoder_count(packet):
     return _unpack(packet[12:16])[0]
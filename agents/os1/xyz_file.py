@@ -0,0 +1,116 @@
+"""
+Lectura sin copia de los archivos XYZ del LiDAR (formato XYZ_BLOCK, ver lidar_packet.py).
+
+El archivo se expone como un arreglo estructurado de NumPy sobre np.memmap, con un elemento por bloque de azimuth y
+los campos timestamp, measurement_id, frame_id y channels (channel, x, y, z, reflectivity por canal). Solo se leen
+del disco las páginas que efectivamente se usan, por lo que sirve para archivos más grandes que la RAM.
+
+Ejemplo:
+    blocks = open_xyz("0001/lidar.bin")
+    z = blocks["channels"]["z"]                        # (bloques, canales), sin copia
+    frame = blocks[blocks["frame_id"] == 1234]         # filtro (copia solo lo seleccionado)
+    session = XYZSegments(segment_files("/mnt/data/capture/NNN/2024.01.01/10.00.00"))
+"""
+import glob
+import os
+
+import numpy as np
+
+from agents.os1 import compressed, raw_file
+from agents.os1.lidar_packet import XYZ_AZIMUTH_DTYPE
+
+DEFAULT_FILE_NAME = "lidar.bin"
+
+
+def open_xyz(file_path):
+    """
+    :return: arreglo estructurado (XYZ_AZIMUTH_DTYPE) de solo lectura sobre el archivo. Si el último bloque quedó
+             incompleto (e.g. por un corte de energía), se ignora. Lanza ValueError si es un archivo de paquetes crudos o
+             XYZ comprimido, que tienen su propio lector (raw_file.py y compressed.py)
+    """
+    with open(file_path, "rb") as f:
+        start = f.read(max(len(raw_file.MAGIC), len(compressed.MAGIC)))
+    if start.startswith(raw_file.MAGIC):
+        raise ValueError(f"{file_path} es un archivo de paquetes crudos. Se convierte a XYZ con os1/raw_file.py")
+    if start.startswith(compressed.MAGIC):
+        raise ValueError(f"{file_path} es un archivo XYZ comprimido. Se descomprime con os1/compressed.py")
+    num_blocks = os.path.getsize(file_path) // XYZ_AZIMUTH_DTYPE.itemsize
+    if num_blocks == 0:
+        return np.empty(0, dtype=XYZ_AZIMUTH_DTYPE)
+    return np.memmap(file_path, dtype=XYZ_AZIMUTH_DTYPE, mode="r", shape=(num_blocks,))
+
+
+def segment_files(session_dir, file_name=DEFAULT_FILE_NAME):
+    """
+    :return: rutas de los archivos XYZ de cada segmento de una sesión de captura, en orden de segmento
+    """
+    return sorted(glob.glob(os.path.join(session_dir, "*", file_name)))
+
+
+class XYZSegments:
+    """
+    Vista concatenada de varios archivos XYZ (e.g. los segmentos de una sesión) sin copiar los datos.
+    Los índices enteros y los slices contenidos en un solo segmento devuelven vistas; un slice que cruza segmentos
+    copia solo los bloques seleccionados
+    """
+    def __init__(self, file_paths):
+        self.file_paths = list(file_paths)
+        self.segments = [open_xyz(p) for p in self.file_paths]
+        self.offsets = np.cumsum([0] + [len(s) for s in self.segments])
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __iter__(self):
+        """
+        Itera sobre los segmentos (cada uno un arreglo sobre np.memmap)
+        """
+        return iter(self.segments)
+
+    def __locate(self, index):
+        segment = int(np.searchsorted(self.offsets, index, side="right")) - 1
+        return segment, index - int(self.offsets[segment])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:  # Copia los bloques seleccionados, de cada segmento por separado
+                return self.take(np.arange(start, stop, step))
+            if stop <= start:
+                return np.empty(0, dtype=XYZ_AZIMUTH_DTYPE)
+            first, first_offset = self.__locate(start)
+            last, last_offset = self.__locate(stop - 1)
+            if first == last:
+                return self.segments[first][first_offset:last_offset + 1]
+            parts = [self.segments[first][first_offset:]] + self.segments[first + 1:last] \
+                + [self.segments[last][:last_offset + 1]]
+            return np.concatenate(parts)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Índice fuera de rango")
+        segment, offset = self.__locate(index)
+        return self.segments[segment][offset]
+
+    def take(self, indices):
+        """
+        :param indices: índices (no negativos) de los bloques, en cualquier orden
+        :return: arreglo con los bloques indicados, en ese orden (copia)
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        segments = np.searchsorted(self.offsets, indices, side="right") - 1
+        result = np.empty(len(indices), dtype=XYZ_AZIMUTH_DTYPE)
+        for segment in np.unique(segments):
+            selected = segments == segment
+            result[selected] = self.segments[segment][indices[selected] - self.offsets[segment]]
+        return result
+
+    def select(self, condition):
+        """
+        Filtra todos los segmentos, uno a la vez, y concatena el resultado
+        :param condition: función que recibe un segmento y devuelve una máscara booleana, e.g.
+                          lambda s: s["frame_id"] == 1234
+        :return: arreglo con los bloques seleccionados (copia)
+        """
+        parts = [s[condition(s)] for s in self.segments]
+        return np.concatenate(parts) if parts else np.empty(0, dtype=XYZ_AZIMUTH_DTYPE)
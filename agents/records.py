@@ -0,0 +1,276 @@
+"""
+Registros de ancho fijo para los agentes que generan archivos CSV (GPS, IMU, IMU del LiDAR).
+
+En vez de formatear cada muestra como texto en el thread de adquisición, el agente encola los valores y el escritor
+(ver AbstractHWAgent) los convierte por lote, de forma vectorizada: al texto del CSV (formato csv) o a registros
+binarios empaquetados como con struct (formato binary). Los registros binarios se convierten después al mismo CSV con
+el conversor de este módulo.
+
+Estructura del archivo:
+    Encabezado: MAGIC, largo (I) y documento YAML (utf-8) con la línea de encabezado del CSV y, por cada campo:
+                nombre, código struct (little endian, sin relleno), formato de texto y separador previo.
+                Formato de texto: especificación de format() (e.g. ".3f"), o vacío para str()
+    Registros:  los campos empaquetados con struct, uno tras otro
+
+Los campos de texto (código "Ns") guardan str(valor) en utf-8, completado con bytes nulos.
+
+Conversión a CSV:
+    python -m agents.records gps.bin [gps.csv]
+"""
+import os
+import re
+import struct
+import sys
+
+import numpy as np
+import yaml
+
+MAGIC = b"FRAIREC\x01"
+FORMAT_CSV = "csv"
+FORMAT_BINARY = "binary"
+OUTPUT_FORMATS = (FORMAT_CSV, FORMAT_BINARY)
+BINARY_EXTENSION = ".bin"
+DEFAULT_SEPARATOR = ";"
+CHUNK_RECORDS = 100000  # Registros que se convierten a la vez
+
+_header_length = struct.Struct("<I")
+_fixed_spec = re.compile(r"^(\d*)\.(\d+)f$")
+
+
+class RecordFormat:
+    def __init__(self, fields, csv_header=""):
+        """
+        :param fields: lista de (nombre, código struct, formato de texto[, separador previo])
+        :param csv_header: línea de encabezado del CSV equivalente
+        """
+        self.fields = [tuple(field) + (DEFAULT_SEPARATOR,) * (4 - len(field)) for field in fields]
+        self.csv_header = csv_header
+        self.struct = struct.Struct("<" + "".join(field[1] for field in self.fields))
+        self.pack = self.struct.pack  # pack(*valores) -> bytes del registro
+        self.dtype = np.dtype([(name, _numpy_code(code)) for name, code, _, _ in self.fields])
+        self.__truncated = set()  # Campos de texto en que ya se avisó que un valor no cabe
+
+    def header(self):
+        """
+        :return: encabezado del archivo (bytes)
+        """
+        doc = yaml.safe_dump({"csv_header": self.csv_header, "fields": [list(field) for field in self.fields]},
+                             allow_unicode=True).encode("utf-8")
+        return MAGIC + _header_length.pack(len(doc)) + doc
+
+    @classmethod
+    def from_header(cls, data):
+        """
+        :return: (RecordFormat, largo del encabezado)
+        """
+        if data[:len(MAGIC)] != MAGIC:
+            raise ValueError("No es un archivo de registros binarios")
+        length, = _header_length.unpack_from(data, len(MAGIC))
+        start = len(MAGIC) + _header_length.size
+        doc = yaml.safe_load(data[start:start + length].decode("utf-8"))
+        return cls(doc["fields"], doc["csv_header"]), start + length
+
+    def pack_values(self, values, logger=None):
+        """
+        Empaqueta valores de tipos mixtos (e.g. el datapoint del GPS): str() en los campos de texto y float() o int()
+        en los numéricos. Un valor numérico inválido queda como nan (o 0 si el campo es entero). Un texto más largo que
+        su campo se corta; se avisa en logger la primera vez para cada campo
+        """
+        packed = []
+        for (name, code, _, _), value in zip(self.fields, values):
+            if code.endswith("s"):
+                text = str(value).encode("utf-8")
+                if len(text) > int(code[:-1]) and name not in self.__truncated:
+                    self.__truncated.add(name)
+                    if logger is not None:
+                        logger.warning(f"Valor '{value}' no cabe en el campo '{name}' ({code[:-1]} bytes) del "
+                                       f"registro binario. Se corta")
+                packed.append(text)
+            elif code in "fd":
+                try:
+                    packed.append(float(value))
+                except (TypeError, ValueError):
+                    packed.append(float("nan"))
+            else:
+                try:
+                    packed.append(int(value))
+                except (TypeError, ValueError):
+                    packed.append(0)
+        return self.pack(*packed)
+
+    def to_array(self, batch):
+        """
+        :param batch: lista de registros, todos como tuplas de valores o todos empaquetados con pack / pack_values
+        :return: arreglo numpy con dtype self.dtype
+        """
+        if batch and isinstance(batch[0], bytes):
+            return np.frombuffer(b"".join(batch), dtype=self.dtype)
+        return np.array(batch, dtype=self.dtype)
+
+    def to_text(self, records):
+        """
+        Formatea registros como líneas del CSV, por columna, en un solo buffer
+        :param records: arreglo numpy con dtype self.dtype
+        :return: bytes (utf-8), con fin de línea os.linesep después de cada registro
+        """
+        columns = []
+        for i, (name, code, spec, separator) in enumerate(self.fields):
+            if i:
+                columns.append(_constant(separator, len(records)))
+            columns.append(format_column(records[name], spec))
+        columns.append(_constant(os.linesep, len(records)))
+        text = np.hstack(columns).ravel()
+        return text[text != 0].tobytes()  # Los ceros son relleno de cada columna
+
+
+def _numpy_code(code):
+    if code.endswith("s"):
+        return "S" + code[:-1]
+    return "<" + code
+
+
+def _constant(text, n):
+    return np.tile(np.frombuffer(text.encode("utf-8"), dtype=np.uint8), (n, 1))
+
+
+def _as_matrix(strings):
+    """
+    :param strings: arreglo numpy de bytes (dtype S)
+    :return: matriz uint8 de una fila por elemento, completada con ceros
+    """
+    if not strings.dtype.itemsize:
+        return np.zeros((len(strings), 0), dtype=np.uint8)
+    return np.ascontiguousarray(strings).view(np.uint8).reshape(len(strings), strings.dtype.itemsize)
+
+
+def format_column(values, spec):
+    """
+    Equivalente vectorizado de [format(v, spec) for v in values] (o str(v) si spec está vacío)
+    :return: matriz uint8 con el texto utf-8 de cada valor en una fila, completado con ceros
+    """
+    if values.dtype.kind == "S":  # Texto, ya completado con ceros
+        return _as_matrix(values)
+    if values.dtype.kind in "iu" and spec in ("", "d") and (not len(values) or values.max() < 2 ** 63):
+        values = values.astype(np.int64)
+        return _format_digits(np.abs(values), 0, 0, values < 0, 0)
+    if values.dtype.kind == "f":
+        if not spec:
+            return _as_matrix(values.astype(np.float64).astype("S"))  # Igual a str() de Python para float
+        match = _fixed_spec.match(spec)
+        if match:
+            return format_fixed(values, int(match.group(2)), int(match.group(1) or 0))
+    return _as_matrix(np.array([format(v, spec).encode("utf-8") for v in values.tolist()], dtype="S"))
+
+
+def format_fixed(values, decimals, width=0):
+    """
+    Equivalente vectorizado de format(v, f"{width}.{decimals}f"). Se redondea con aritmética de enteros; los valores
+    que quedan muy cerca de la mitad entre dos resultados (donde el producto en punto flotante podría redondear al
+    lado equivocado), los no finitos y los muy grandes se formatean con format()
+    :return: matriz uint8 como format_column
+    """
+    x = values.astype(np.float64)
+    scale = 10 ** decimals
+    scaled = x * scale
+    with np.errstate(invalid="ignore"):
+        exact = np.isfinite(scaled) & (np.abs(scaled) < 2 ** 52)
+        tolerance = np.abs(scaled) * 4e-16 + 1e-300
+        exact &= np.abs(np.abs(scaled - np.trunc(scaled)) - 0.5) > tolerance
+    digits = np.abs(np.rint(np.where(exact, scaled, 0))).astype(np.int64)
+    text = _format_digits(digits // scale, digits % scale, decimals, np.signbit(x), width)
+    if not exact.all():
+        inexact = np.flatnonzero(~exact)
+        fallback = _as_matrix(np.array([format(float(x[i]), f"{width}.{decimals}f").encode() for i in inexact]))
+        if fallback.shape[1] > text.shape[1]:
+            text = np.pad(text, ((0, 0), (fallback.shape[1] - text.shape[1], 0)))
+        text[inexact] = 0
+        text[inexact, text.shape[1] - fallback.shape[1]:] = fallback
+    return text
+
+
+def _format_digits(integer, fraction, decimals, negative, width):
+    """
+    Escribe los dígitos alineados a la derecha: [espacios][-]entero[.fracción]
+    :param integer: parte entera (int64, no negativa)
+    :param fraction: parte fraccionaria como entero de decimals dígitos
+    """
+    n = len(integer)
+    int_digits = len(str(int(integer.max()))) if n else 1
+    frac_width = decimals + 1 if decimals else 0
+    total = max(width, 1 + int_digits + frac_width)
+    text = np.zeros((n, total), dtype=np.uint8)
+    units = total - frac_width - 1
+    ndigits = np.ones(n, dtype=np.int64)
+    if int_digits <= 9:  # La división es más rápida con enteros de 32 bits
+        integer = integer.astype(np.uint32)
+    for j in range(int_digits):
+        integer, digit = np.divmod(integer, 10)
+        if j:
+            shown = previous > 0
+            ndigits += shown
+            text[:, units - j] = np.where(shown, 48 + digit, 0)
+        else:
+            text[:, units] = 48 + digit
+        previous = integer
+    if decimals:
+        text[:, units + 1] = ord(".")
+        if decimals <= 9:
+            fraction = fraction.astype(np.uint32)
+        for j in range(decimals):
+            fraction, digit = np.divmod(fraction, 10)
+            text[:, total - 1 - j] = 48 + digit
+    rows = np.flatnonzero(negative)
+    text[rows, units - ndigits[rows]] = ord("-")
+    if width:
+        padding = width - (ndigits + negative + frac_width)
+        for k in range(width):
+            column = total - width + k
+            text[:, column] = np.where(k < padding, ord(" "), text[:, column])
+    return text
+
+
+def binary_file_name(file_name):
+    """
+    :return: el nombre del archivo de salida con la extensión del formato binario (e.g. gps.csv -> gps.bin)
+    """
+    return os.path.splitext(file_name)[0] + BINARY_EXTENSION if file_name else file_name
+
+
+def read_records(file_path):
+    """
+    :return: (RecordFormat, arreglo numpy de registros). Se descartan un registro incompleto al final (archivo a medio
+    escribir) y los registros nulos al final (espacio reservado y no escrito, ver durability.py)
+    """
+    with open(file_path, "rb") as f:
+        data = f.read()
+    record_format, offset = RecordFormat.from_header(data)
+    size = record_format.dtype.itemsize
+    count = (len(data) - offset) // size
+    raw = np.frombuffer(data, dtype=np.uint8, count=count * size, offset=offset).reshape(count, size)
+    used = np.flatnonzero(raw.any(axis=1))
+    count = used[-1] + 1 if len(used) else 0
+    return record_format, np.frombuffer(data, dtype=record_format.dtype, count=count, offset=offset)
+
+
+def to_csv(file_path, csv_path):
+    """
+    Convierte un archivo de registros binarios al CSV que habría escrito el agente
+    :return: cantidad de registros
+    """
+    record_format, records = read_records(file_path)
+    with open(csv_path, "wb") as f:
+        if record_format.csv_header:
+            f.write((record_format.csv_header + os.linesep).encode("utf-8"))
+        for start in range(0, len(records), CHUNK_RECORDS):
+            f.write(record_format.to_text(records[start:start + CHUNK_RECORDS]))
+    return len(records)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    in_path = sys.argv[1]
+    out_path = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(in_path)[0] + ".csv"
+    n = to_csv(in_path, out_path)
+    print(f"{n} registros convertidos a {out_path}")
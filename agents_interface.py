@@ -1,11 +1,21 @@
-import socket
+import asyncio
+import itertools
 import time
-from threading import Thread, Event
+from concurrent.futures import Future, InvalidStateError
+from threading import Thread, Event, Lock
 import logging
-from queue import SimpleQueue
-from messaging.messaging import Message
+from collections import deque
+from queue import Empty
+from messaging.buffers import BoundedBuffer
+from messaging.messaging import Message, StreamDecoder, PROTOCOL_YAML, PROTOCOL_RPC, PROTOCOL_VERSION, \
+    DEFAULT_DECODER_BUFFER
+from messaging.trace import IN, OUT
+from messaging.transport import DataRing, TRANSPORT_TCP, TRANSPORT_UNIX, connect_socket, unix_socket_path
 from agents.constants import HWStates, AgentStatus
 
+HEARTBEAT_PERIOD = 10  # segundos. Los agentes informan sus cambios de estado; la consulta periódica solo verifica que sigan vivos
+STATE_HISTORY_LENGTH = 100  # Cambios de estado recordados por agente
+
 
 class AgentInterface:
     def __init__(self, name, quit_flag: Event, ip_addr='', ip_port=0):
@@ -14,19 +24,49 @@ class AgentInterface:
         self.__ip_adress = ip_addr
         self.__ip_port = ip_port
         self.__connection = None
-        self.__sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.__sock.setblocking(True)
+        self.__sock = None
         self.__connected = False
-        self.q_data_in = SimpleQueue()
-        self.q_sys_in = SimpleQueue()
+        self.transport = TRANSPORT_TCP  # Ver messaging/transport.py
+        self._data_ring = None  # Anillo en memoria compartida por el que el agente envía los DATA, si lo anunció
+        self.protocol = PROTOCOL_YAML  # Versión de protocolo negociada con el agente (ver messaging.py)
+        self.q_data_in = BoundedBuffer()
+        self.q_sys_in = BoundedBuffer()
+        self.buffer_stats = dict()  # Últimos contadores del buffer de datos a disco informados por el agente
+        self.__requests = dict()  # msg_id -> Future de las solicitudes en curso (ver request)
+        self.__requests_lock = Lock()
+        self.__request_ids = itertools.count(1)
+        self.trace = None  # TraceRecorder opcional, que registra los mensajes enviados y recibidos
         self.agent_status = ''
         self.hw_status = ''
+        self.state_history = deque(maxlen=STATE_HISTORY_LENGTH)  # (momento, agent_status, hw_status) en cada cambio
+        self.last_seen = 0  # Momento en que se recibió el último mensaje del agente
+        self.health = dict()  # Últimas métricas de salud informadas por el agente (si las envía)
+        self.health_time = 0  # Momento en que se recibieron
         self.enabled = False
+        # Funciones opcionales llamadas desde el thread receptor al llegar mensajes. Deben retornar rápido
+        self.on_data = None  # (interfaz, dato). Si está definida, los datos no se encolan en q_data_in
+        self.on_sys_state = None  # (interfaz, estado). Si está definida, los estados no se encolan en q_sys_in
+        self.on_state_change = None  # (interfaz). Cuando cambia agent_status o hw_status
         self.logger = logging.getLogger("manager")
 
-    def set_ip_address(self, addr, port):
+    def set_buffers(self, cfg):
+        """
+        Acota las colas de entrada. Llamar antes de connect
+        :param cfg: ver BoundedBuffer.from_config
+        """
+        self.q_data_in = BoundedBuffer.from_config(cfg)
+        self.q_sys_in = BoundedBuffer.from_config(cfg)
+
+    def queue_stats(self):
+        """
+        :return: contadores de las colas de entrada (ver buffers.py)
+        """
+        return {"data": self.q_data_in.stats(), "sys": self.q_sys_in.stats()}
+
+    def set_ip_address(self, addr, port, transport=TRANSPORT_TCP):
         self.__ip_adress = addr
         self.__ip_port = port
+        self.transport = transport
 
     def connect(self):
         if not self.__ip_port or not self.__ip_adress:
@@ -40,17 +80,24 @@ class AgentInterface:
         while not self.__flaq_quit.is_set():
             if self.__connected:
                 self.send_msg(Message.cmd_query_agent_state())
-                if not self.__flaq_quit.wait(1):
-                    self.send_msg(Message.cmd_query_hw_state())
-                    self.__flaq_quit.wait(1)
+                self.send_msg(Message.cmd_query_hw_state())
+                self.__flaq_quit.wait(HEARTBEAT_PERIOD)
+            else:
+                self.__flaq_quit.wait(1)
 
     def __connect_insist(self):
         error = False
         self.__connected = False
         while not self.__connected and not self.__flaq_quit.is_set():
             try:
-                self.__sock.connect((self.__ip_adress, self.__ip_port))
+                if self.__sock is not None:
+                    self.__sock.close()
+                self._close_data_ring()
+                self._abort_requests()
+                self.__sock = connect_socket(self.transport, self.__ip_adress, self.__ip_port)
+                self.protocol = PROTOCOL_YAML
                 self.__connected = True
+                self.send_msg(Message.hello(PROTOCOL_VERSION))
             except ConnectionRefusedError:
                 if not error:
                     error = True
@@ -63,64 +110,148 @@ class AgentInterface:
                 self.__flaq_quit.wait(1)
 
     def __receive(self):
-        cmd = b''
+        decoder = StreamDecoder()
         while not self.__flaq_quit.is_set():
             if self.__connected:
                 try:
-                    bt = self.__sock.recv(1)
-                    if not bt:
-                        self.__flaq_quit.wait(0.1)
-                        raise ConnectionResetError
-                    elif bt == Message.EOT:
-                        msg = Message.deserialize(cmd)
-                        if msg.typ == Message.AGENT_STATE:
-                            self.agent_status = msg.arg
-                        elif msg.typ == Message.HW_STATE:
-                            self.hw_status = msg.arg
-                        elif msg.typ == Message.SYS_STATE:
-                            self.q_sys_in.put(msg.arg)
-                        elif msg.typ == Message.DATA:
-                            self.q_data_in.put(msg.arg)
-                        cmd = b''
-                    else:
-                        cmd += bt
+                    for msg in decoder.read(self.__sock):
+                        self._process_message(msg)
                 except TimeoutError:
                     pass
                 except ConnectionResetError:
+                    self.__flaq_quit.wait(0.1)
+                    decoder.reset()
                     self.__connect_insist()
 
+    def _process_message(self, msg: Message):
+        self.last_seen = time.time()
+        if self.trace is not None:
+            self.trace.record(IN, msg)
+        if msg.msg_id is not None:
+            self.__resolve_request(msg)
+        if msg.typ in (Message.AGENT_STATE, Message.HW_STATE):
+            previous = (self.agent_status, self.hw_status)
+            if msg.typ == Message.AGENT_STATE:
+                self.agent_status = msg.arg
+            else:
+                self.hw_status = msg.arg
+            if previous != (self.agent_status, self.hw_status):
+                self.state_history.append((self.last_seen, self.agent_status, self.hw_status))
+                if self.on_state_change is not None:
+                    self.on_state_change(self)
+        elif msg.typ == Message.SYS_STATE:
+            if self.on_sys_state is not None:
+                self.on_sys_state(self, msg.arg)
+            else:
+                self.q_sys_in.put(msg.arg)
+        elif msg.typ == Message.DATA:
+            if self.on_data is not None:
+                self.on_data(self, msg.arg)
+            else:
+                self.q_data_in.put(msg.arg)
+        elif msg.typ == Message.HEALTH:
+            self.health = msg.arg
+            self.health_time = time.time()
+        elif msg.typ == Message.BUFFER_STATS:
+            self.buffer_stats = msg.arg
+        elif msg.typ == Message.DATA_READY and self._data_ring is not None:
+            for data_msg in self._data_ring.get_all():
+                self._process_message(data_msg)
+        elif msg.typ == Message.DATA_RING:
+            self._close_data_ring()
+            self._data_ring = DataRing(msg.arg)
+            self.logger.debug(f"Agente {self.name} envía datos por memoria compartida ({msg.arg})")
+        elif msg.typ == Message.HELLO:
+            self.protocol = min(int(msg.arg), PROTOCOL_VERSION)
+            self.logger.debug(f"Protocolo con agente {self.name}: versión {self.protocol}")
+
+    def request(self, msg: Message):
+        """
+        Envía msg como solicitud, con un identificador de correlación. Puede haber varias en curso a la vez
+        :return: concurrent.futures.Future que se completa con el mensaje de respuesta del agente, o con
+                 ConnectionResetError si la conexión se pierde. Si el agente no soporta solicitudes (protocolo anterior
+                 a PROTOCOL_RPC), msg se envía como mensaje simple y el Future se completa con None.
+                 Si se deja de esperar la respuesta (timeout), se debe cancelar el Future
+        """
+        future = Future()
+        if self.protocol < PROTOCOL_RPC:
+            if self.send_msg(msg):
+                future.set_result(None)
+            else:
+                future.set_exception(ConnectionResetError(f"Agente {self.name} desconectado"))
+            return future
+        msg_id = next(self.__request_ids)
+        with self.__requests_lock:
+            self.__requests[msg_id] = future
+        future.add_done_callback(lambda f: self.__forget_request(msg_id))
+        if not self.send_msg(Message(msg.typ, msg.arg, msg_id)):
+            self.__complete(future, exception=ConnectionResetError(f"Agente {self.name} desconectado"))
+        return future
+
+    def __forget_request(self, msg_id):
+        with self.__requests_lock:
+            self.__requests.pop(msg_id, None)
+
+    def __resolve_request(self, msg: Message):
+        with self.__requests_lock:
+            future = self.__requests.pop(msg.msg_id, None)
+        if future is not None:
+            self.__complete(future, result=msg)
+
+    @staticmethod
+    def __complete(future, result=None, exception=None):
+        try:
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+        except InvalidStateError:  # Se canceló mientras tanto
+            pass
+
+    def _abort_requests(self):
+        """
+        Termina las solicitudes en curso, que ya no tendrán respuesta porque se perdió la conexión
+        """
+        with self.__requests_lock:
+            futures = list(self.__requests.values())
+            self.__requests.clear()
+        for future in futures:
+            self.__complete(future, exception=ConnectionResetError(f"Se perdió la conexión con agente {self.name}"))
+
+    def _close_data_ring(self):
+        if self._data_ring is not None:
+            self._data_ring.close()
+            self._data_ring = None
+
     def disconnect(self):
-        self.__sock.close()
+        if self.__sock is not None:
+            self.__sock.close()
         self.__connected = False
 
     def is_connected(self):
         return self.__connected
 
     def get_data(self, block=False):
-        if block:
-            return self.q_data_in.get()
-        else:
-            if not self.q_data_in.empty():
-                return self.q_data_in.get()
-            else:
-                return None
+        try:
+            return self.q_data_in.get(block)
+        except Empty:
+            return None
 
     def get_sys_state(self, block=False):
-        if block:
-            return self.q_sys_in.get()
-        else:
-            if not self.q_sys_in.empty():
-                return self.q_sys_in.get()
-            else:
-                return None
+        try:
+            return self.q_sys_in.get(block)
+        except Empty:
+            return None
 
     def send_data(self, data):
         self.send_msg(Message.data_msg(data))
 
     def send_msg(self, msg: Message):
         if self.__connected:
+            if self.trace is not None:
+                self.trace.record(OUT, msg)
             try:
-                self.__sock.sendall(msg.serialize())
+                self.__sock.sendall(msg.serialize(self.protocol))
                 return True
             except BrokenPipeError:
                 self.logger.error(f"No se pudo enviar el mensaje al puerto {self.__ip_port}: BrokenPipe.")
@@ -131,3 +262,157 @@ class AgentInterface:
 
     def quit(self):
         self.__flaq_quit.set()
+
+
+class AgentLinkLoop:
+    """
+    Event loop de asyncio, en un único thread, donde corren las conexiones a todos los agentes (AsyncAgentInterface)
+    y las tareas periódicas del manager
+    """
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.logger = logging.getLogger("manager")
+        self.__thread = Thread(target=self.loop.run_forever, name="AgentLinkLoop", daemon=True)
+        self.__thread.start()
+
+    def submit(self, coro):
+        """
+        Agenda una corrutina en el loop. Se puede llamar desde cualquier thread
+        :return: concurrent.futures.Future
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def call_periodic(self, func, quit_flag: Event, initial_delay=0):
+        """
+        Ejecuta func en el loop hasta que se setee quit_flag. func no debe bloquear, y retorna los segundos de espera
+        hasta la siguiente ejecución
+        """
+        def tick():
+            if quit_flag.is_set():
+                return
+            try:
+                delay = func()
+            except Exception:
+                self.logger.exception(f"Error en tarea periódica {func.__name__}. Se detiene")
+                return
+            self.loop.call_later(delay, tick)
+        self.loop.call_soon_threadsafe(self.loop.call_later, initial_delay, tick)
+
+    def stop(self):
+        try:
+            self.submit(self.__cancel_tasks()).result(1)
+        except Exception:
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.__thread.join(1)
+
+    @staticmethod
+    async def __cancel_tasks():
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class AsyncAgentInterface(AgentInterface):
+    """
+    Misma interfaz que AgentInterface, pero la conexión, la recepción y la consulta de estado del agente corren como
+    tareas de un AgentLinkLoop compartido, en vez de tres threads por agente
+    """
+    def __init__(self, name, quit_flag: Event, link_loop: AgentLinkLoop, ip_addr='', ip_port=0):
+        super().__init__(name, quit_flag, ip_addr, ip_port)
+        self.__address = (ip_addr, ip_port)
+        self.__flag_quit = quit_flag
+        self.__link_loop = link_loop
+        self.__writer = None
+        self.__connected = False
+
+    def set_ip_address(self, addr, port, transport=TRANSPORT_TCP):
+        super().set_ip_address(addr, port, transport)
+        self.__address = (addr, port)
+
+    def connect(self):
+        if not self.__address[0] or not self.__address[1]:
+            self.logger.error(f"Primero se debe setear la direccion y puerto IP del agente {self.name}")
+            return
+        self.__link_loop.submit(self.__run())
+
+    async def __run(self):
+        error = False
+        address = self.__address
+        while not self.__flag_quit.is_set():
+            try:
+                if self.transport == TRANSPORT_UNIX:
+                    reader, self.__writer = await asyncio.open_unix_connection(unix_socket_path(address[1]))
+                else:
+                    reader, self.__writer = await asyncio.open_connection(*address)
+            except (ConnectionRefusedError, FileNotFoundError):
+                if not error:
+                    error = True
+                    self.logger.warning(f"Conexión rechazada a agente {self.name}. {address[0]}:{address[1]}. "
+                                        f"Reintentando.")
+                await asyncio.sleep(1)
+                continue
+            except OSError:
+                error = True
+                self.logger.exception(f"Fallo de conexión a {address[0]}:{address[1]}. Reintentando")
+                await asyncio.sleep(1)
+                continue
+            self.protocol = PROTOCOL_YAML
+            self.__connected = True
+            check_state = asyncio.ensure_future(self.__check_state())
+            try:
+                self.__write_msg(Message.hello(PROTOCOL_VERSION), PROTOCOL_YAML)
+                await self.__receive(reader)
+            except ConnectionError:
+                pass
+            except Exception:  # e.g. mensaje corrupto: se reconecta, para no dejar al agente sin enlace
+                self.logger.exception(f"Error en el enlace con agente {self.name}. Reconectando")
+            finally:
+                self.__connected = False
+                check_state.cancel()
+                self.__writer.close()
+                self._close_data_ring()
+                self._abort_requests()
+            await asyncio.sleep(0.1)
+
+    async def __receive(self, reader):
+        decoder = StreamDecoder()
+        while not self.__flag_quit.is_set():
+            data = await reader.read(DEFAULT_DECODER_BUFFER)
+            if not data:
+                return
+            for msg in decoder.feed(data):
+                self._process_message(msg)
+
+    async def __check_state(self):
+        while self.__connected and not self.__flag_quit.is_set():
+            self.__write_msg(Message.cmd_query_agent_state(), self.protocol)
+            self.__write_msg(Message.cmd_query_hw_state(), self.protocol)
+            await asyncio.sleep(HEARTBEAT_PERIOD)
+
+    def __write_msg(self, msg: Message, protocol):
+        if self.trace is not None:
+            self.trace.record(OUT, msg)
+        self.__write(msg.serialize(protocol))
+
+    def __write(self, data):
+        if self.__connected and not self.__writer.is_closing():
+            self.__writer.write(data)
+        else:
+            self.logger.error(f"Agente desconectado")
+
+    def is_connected(self):
+        return self.__connected
+
+    def disconnect(self):
+        if self.__writer is not None:
+            self.__link_loop.loop.call_soon_threadsafe(self.__writer.close)
+        self.__connected = False
+
+    def send_msg(self, msg: Message):
+        if self.__connected:
+            self.__link_loop.loop.call_soon_threadsafe(self.__write_msg, msg, self.protocol)
+            return True
+        else:
+            return False
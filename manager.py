@@ -3,8 +3,9 @@ import logging.config
 import os
 import sys
 import time
+from concurrent.futures import wait
 from enum import Enum, auto
-from queue import SimpleQueue
+from queue import SimpleQueue, Empty
 from subprocess import Popen, DEVNULL, STDOUT
 from threading import Thread, Event
 
@@ -12,8 +13,11 @@ import yaml
 
 from agents.constants import HWStates, Devices
 from bdd import DBInterface
-from agents_interface import AgentInterface
+from agents_interface import AgentInterface, AgentLinkLoop, AsyncAgentInterface, HEARTBEAT_PERIOD
+from messaging.gps_board import GPSBoard
 from messaging.messaging import Message, AgentStatus
+from messaging.trace import TraceRecorder, SIDE_MANAGER
+from messaging.transport import TRANSPORT_TCP
 from utils import get_time_str, get_date_str, Coords, get_new_folio
 
 DEFAULT_CONFIG_FILE = 'config.yaml'
@@ -22,6 +26,12 @@ KEY_QUIT = 'q'  # Comando de teclado para terminar el programa
 KEY_START_STOP = 's'  # para iniciar o detener una sesión de captura
 FORCE_START = 'f'  # inicia captura inmediatamente, sin esperar que vehículo inice movimiento
 SINGLE_BUTTON = 'bSingleButton'
+HEALTH_MAX_AGE = 10  # segundos. Métricas de salud más antiguas que esto no se consideran vigentes
+HEARTBEAT_TIMEOUT = 3 * HEARTBEAT_PERIOD  # segundos sin mensajes de un agente conectado para considerarlo colgado
+HW_CHECK_DELAY = 25  # segundos. Un poco más que lo que el lidar debiera tardarse en partir
+ACK_TIMEOUT = 1  # segundos que se esperan las respuestas de los agentes a NEW_CAPTURE y END_CAPTURE
+CORE_THREADS = "threads"  # Threads por agente y por tarea de monitoreo
+CORE_ASYNCIO = "asyncio"  # Un único event loop para las conexiones a agentes y las tareas de monitoreo
 
 
 class Flags:
@@ -31,8 +41,6 @@ class Flags:
 
     def __init__(self):
         self.vehicle_moving = Event()   
-        self.segment_timeout = Event()  # Ha pasado más de T segundos desde que comenzó la captura del segmento
-        self.segment_ended = Event()  # El vehículo ya avanzó más de X metros desde que comenzó la captura del segmento
         self.quit = Event()  # Para indicar el fin de la aplicación
         self.critical_agents_ready = Event()
 
@@ -47,20 +55,37 @@ class States(Enum):
     WAITING_SPEED = auto()
 
 
+class Events(Enum):
+    """
+    Tipos de evento que recibe la máquina de estados, a través de la cola FRAICAPManager.events
+    """
+    USER_COMMAND = auto()  # Tecla o botón. Argumento: comando (e.g. KEY_START_STOP)
+    GPS_FIX = auto()  # Nueva coordenada del agente GPS. Argumento: datapoint (no se usa si se lee el board)
+    AGENT_STATE = auto()  # Cambió el estado de un agente. Argumento: interfaz del agente
+    SEGMENT_TIMEOUT = auto()  # Se cumplió el tiempo máximo del segmento. Lo genera el mismo loop de eventos
+
+
 class AgentProxies:
     """
     ES IMPERATIVO QUE LOS NOMBRES DE LOS AGENTES COINCIDAN CON LOS DE LA CONFIGURACIÓN
     """
 
-    def __init__(self, quit_flag):
-        self.OS1_LIDAR = AgentInterface("os1_lidar", quit_flag)
-        self.OS1_IMU = AgentInterface("os1_imu", quit_flag)
-        self.IMU = AgentInterface("imu", quit_flag)
-        self.GPS = AgentInterface("gps", quit_flag)
-        self.CAMERA = AgentInterface("camera", quit_flag)
-        self.ATMEGA = AgentInterface("atmega", quit_flag)
-        self.INET = AgentInterface("inet", quit_flag)
-        self.DATA_COPY = AgentInterface("data_copy", quit_flag)
+    def __init__(self, quit_flag, link_loop=None):
+        """
+        :param link_loop: AgentLinkLoop. Si se indica, las interfaces a los agentes corren en él (AsyncAgentInterface)
+        """
+        def interface(name):
+            if link_loop is None:
+                return AgentInterface(name, quit_flag)
+            return AsyncAgentInterface(name, quit_flag, link_loop)
+        self.OS1_LIDAR = interface("os1_lidar")
+        self.OS1_IMU = interface("os1_imu")
+        self.IMU = interface("imu")
+        self.GPS = interface("gps")
+        self.CAMERA = interface("camera")
+        self.ATMEGA = interface("atmega")
+        self.INET = interface("inet")
+        self.DATA_COPY = interface("data_copy")
 
     def items(self):
         return self.__dict__.values()
@@ -73,13 +98,24 @@ class FRAICAPManager:
         self.logger = logging.getLogger("manager")
         self.capture_dir_base = ""
         self.capture_dir = ""
-        self.q_user_commands = SimpleQueue()  # Cola de comandos provenientes de de teclado o botonera
-        self.agents = AgentProxies(self.flags.quit)
+        self.events = SimpleQueue()  # Cola de eventos de la máquina de estados: (Events, argumento, momento)
+        self.split_count = 0  # Cortes de segmento, y su latencia (s) desde el evento que los gatilló
+        self.split_latency_total = 0.0
+        self.split_latency_max = 0.0
+        self.ack_latency = dict()  # Por agente: (respuestas, suma, máximo) de la latencia (s) de respuesta a NEW_CAPTURE
+        self.buffer_drops = dict()  # Descartes informados por agente (buffer a disco y colas de entrada), para avisar
+        self.agents = None
+        self.link_loop = None  # AgentLinkLoop, solo si manager_core es asyncio
         self.dbi = None
         self.coordinates = Coords()
         self.segment_coords_ini = Coords()
         self.segment_current_length = 0
         self.segment_current_init_time = 0
+        self.use_gps_board = False  # Leer el estado del GPS desde memoria compartida (agent_gps con gps_board: True)
+        self.gps_board = None  # GPSBoard, una vez que el agente GPS lo crea
+        self.gps_fix_pending = False  # Hay un evento GPS_FIX en cola. Con board, basta uno: se lee el último estado
+        self.gps_distance = 0.0  # Distancia acumulada según el board, en la última lectura
+        self.segment_distance_ini = 0.0  # Distancia acumulada al inicio del segmento en curso
         self.folio = None
         self.mgr_cfg = dict()
         self.set_up(manager_config_file, agents_config_file)
@@ -96,17 +132,31 @@ class FRAICAPManager:
             sys.exit(-1)
         logging.config.dictConfig(self.mgr_cfg["logging"])
         self.logger.info("***** INICIA PROGRAMA *****")
+        core = self.mgr_cfg.get('manager_core', CORE_THREADS)
+        if core == CORE_ASYNCIO:
+            self.link_loop = AgentLinkLoop()
+        elif core != CORE_THREADS:
+            self.logger.error(f"Valor inválido para 'manager_core': {core}. Se usará '{CORE_THREADS}'")
+        self.agents = AgentProxies(self.flags.quit, self.link_loop)
+        buffers_cfg = self.mgr_cfg.get('interface_buffers') or {}
+        try:
+            for agt in self.agents.items():
+                agt.set_buffers(buffers_cfg)
+        except ValueError:
+            self.logger.exception(f"Valor inválido para 'interface_buffers': {buffers_cfg}. Se usarán colas sin límite")
         try:
             with open(agents_config_file, 'r') as config_file:
                 agents_cfg = yaml.safe_load(config_file)
         except FileNotFoundError:
             self.logger.error(f"Archivo de configuración {agents_config_file} no encontrado. Terminando.")
             sys.exit(1)
+        self.use_gps_board = bool(agents_cfg.get("agent_gps", {}).get("gps_board", False))
         for agt in self.agents.items():
             try:
                 assert isinstance(self.mgr_cfg['use_agents'][agt.name], bool)
                 try:
-                    agt.set_ip_address(LOCALHOST, agents_cfg[f"agent_{agt.name}"]["local_port"])
+                    agt.set_ip_address(LOCALHOST, agents_cfg[f"agent_{agt.name}"]["local_port"],
+                                       agents_cfg.get("transport", TRANSPORT_TCP))
                     if self.mgr_cfg["use_agents"][agt.name]:
                         agt.enabled = True
                     else:
@@ -153,6 +203,21 @@ class FRAICAPManager:
             pid = Popen([python_exec, f"{agents_working_dir}{os.sep}agent_{agt.name}.py"], stdin=DEVNULL, stdout=DEVNULL, stderr=STDOUT).pid
             self.logger.info(f"Agente {agt.name} ejecutandose con PID {pid}")
         self.flags.quit.wait(1)  # Les da tiempo para partir antes de intentar conexión
+        for agt in self.get_enabled_agents():
+            agt.on_state_change = lambda a: self.post_event(Events.AGENT_STATE, a)
+        self.agents.GPS.on_data = self.on_gps_data
+        self.agents.ATMEGA.on_data = self.on_button
+        if self.agents.ATMEGA.enabled:
+            # Informa a la botonera el estado de la copia a pendrive
+            self.agents.DATA_COPY.on_sys_state = lambda a, state: self.agents.ATMEGA.send_msg(
+                Message(Message.SYS_STATE, state))
+        trace_dir = self.mgr_cfg.get('trace_dir')
+        if trace_dir:
+            os.makedirs(trace_dir, exist_ok=True)
+            for agt in self.get_enabled_agents():
+                trace_file = f"manager_{agt.name}_{get_date_str()}_{get_time_str()}.trc"
+                agt.trace = TraceRecorder(os.path.join(trace_dir, trace_file), agt.name, SIDE_MANAGER)
+            self.logger.info(f"Registrando mensajes con agentes en {trace_dir}")
         for agt in self.get_enabled_agents():
             agt.connect()
 
@@ -165,141 +230,152 @@ class FRAICAPManager:
             self.logger.info(f"Agente {agt.name} conectado")
         self.logger.info("Conectado a todos los agentes habilitados")
 
-        self.logger.info("Iniciando thread de reporte de estado de hardware")
-        Thread(target=self.check_hw, name="check_hw", daemon=True).start()
-
-        self.logger.info("Iniciando thread de reporte de estado de agentes")
-        Thread(target=self.check_critical_agents_ready, name="check_agents_ready", daemon=True).start()
-
-        self.logger.info("Esperando que agentes críticos esten listos para capturar")
-        self.flags.critical_agents_ready.wait()
-        self.logger.info("Agentes críticos están listos")
+        self.logger.info("Iniciando tarea de reporte de estado de hardware")
+        self.start_periodic(self.check_hw, initial_delay=HW_CHECK_DELAY)
 
         self.logger.info("Iniciando thread de lectura de teclado")
         Thread(target=self.get_keyboard_input, name="get_keyboard_input", daemon=True).start()
 
-        if self.agents.ATMEGA.enabled:
-            self.logger.info("Iniciando thread de lectura de botones")
-            Thread(target=self.get_buttons, name="get_buttons", daemon=True).start()
-            if self.agents.DATA_COPY.enabled:
-                self.logger.info("Iniciando thread de estado de copia a pendrive")
-                Thread(target=self.check_data_copy, name="check_data_copy", daemon=True).start()
+    def start_periodic(self, step, initial_delay=0):
+        """
+        Ejecuta periódicamente una tarea de monitoreo: en el event loop de las conexiones a agentes si manager_core es
+        asyncio, o en un thread propio si es threads
+        :param step: función que hace una pasada de la tarea, sin bloquear, y retorna los segundos hasta la siguiente
+        :param initial_delay: segundos de espera antes de la primera pasada
+        """
+        if self.link_loop is not None:
+            self.link_loop.call_periodic(step, self.flags.quit, initial_delay)
+        else:
+            Thread(target=self.__run_periodic, args=(step, initial_delay), name=step.__name__, daemon=True).start()
 
-        self.logger.info("--Iniciando thread de monitoreo de avance y tiempo")
-        Thread(target=self.check_spacetime, name="check_spacetime", daemon=True).start()
+    def __run_periodic(self, step, initial_delay):
+        self.flags.quit.wait(initial_delay)
+        while not self.flags.quit.is_set():
+            self.flags.quit.wait(step())
 
     def check_hw(self):
-        # Primero espera 25 segundos que es un poco más que lo que el lidar debiera tardarse en partir
-        # Así no da una falsa alarma al usuario
-        self.flags.quit.wait(25)
         agents = [self.agents.OS1_LIDAR, self.agents.IMU, self.agents.CAMERA, self.agents.GPS, self.agents.INET]
         devices = [Devices.OS1, Devices.IMU, Devices.CAMERA, Devices.GPS, Devices.ROUTER]
-        while not self.flags.quit.is_set():
-            offline = False
-            error = False
-            for a, d in zip(agents, devices):
-                if a.enabled:
-                    self.agents.ATMEGA.send_data({"device": d, "status": a.hw_status})
-                    if a.hw_status == HWStates.NOT_CONNECTED:
-                        offline = True
-                    elif a.hw_status == HWStates.ERROR:
-                        error = True
-            if offline:
-                self.agents.ATMEGA.send_msg(Message.sys_offline())
-            elif error:
-                self.agents.ATMEGA.send_msg(Message.sys_error())
-            else:
-                self.agents.ATMEGA.send_msg(Message.sys_online())
-
-            for agt in self.get_enabled_agents():
-                if agt.is_connected and agt.hw_status != HWStates.NOMINAL:
-                    self.logger.warning(f"Agente {agt.name} reporta hardware en estado {agt.hw_status}")
-                elif not agt.is_connected():
-                    self.logger.warning(f"Agente {agt.name} desconectado de manager")
-
-            self.flags.quit.wait(5)
-
-    def check_data_copy(self):
-        while not self.flags.quit.is_set():
-            state = self.agents.DATA_COPY.get_sys_state()
-            if state:
-                self.agents.ATMEGA.send_msg(Message(Message.SYS_STATE, state))
-            self.flags.quit.wait(0.1)
+        offline = False
+        error = False
+        for a, d in zip(agents, devices):
+            if a.enabled:
+                self.agents.ATMEGA.send_data({"device": d, "status": a.hw_status})
+                if a.hw_status == HWStates.NOT_CONNECTED:
+                    offline = True
+                elif a.hw_status == HWStates.ERROR:
+                    error = True
+        if offline:
+            self.agents.ATMEGA.send_msg(Message.sys_offline())
+        elif error:
+            self.agents.ATMEGA.send_msg(Message.sys_error())
+        else:
+            self.agents.ATMEGA.send_msg(Message.sys_online())
 
-    def check_spacetime(self):
-        while not self.flags.quit.is_set():
-            self.flags.quit.wait(0.01)
-            if self.state == States.CAPTURING and time.time() > self.segment_current_init_time + \
-                    self.mgr_cfg['capture']['splitting_time']:
-                self.logger.debug(
-                    f"Tiempo en útlimo tramo: {time.time() - self.segment_current_init_time:.1f} s. "
-                    f"Seteando bandera para generar nuevo tramo")
-                self.flags.segment_ended.set()
-                continue
+        for agt in self.get_enabled_agents():
+            if agt.is_connected and agt.hw_status != HWStates.NOMINAL:
+                self.logger.warning(f"Agente {agt.name} reporta hardware en estado {agt.hw_status}")
+            elif not agt.is_connected():
+                self.logger.warning(f"Agente {agt.name} desconectado de manager")
+            if agt.is_connected() and time.time() - agt.last_seen > HEARTBEAT_TIMEOUT:
+                self.logger.warning(f"Agente {agt.name} no responde hace {time.time() - agt.last_seen:.0f} s")
+            if agt.health and time.time() - agt.health_time < HEALTH_MAX_AGE:
+                self.logger.debug(f"Salud de agente {agt.name}: {agt.health}")
+            self.check_buffers(agt)
+        return 5
+
+    def check_buffers(self, agt):
+        """
+        Avisa si el buffer a disco del agente o sus colas de entrada en el manager descartaron datos desde la última
+        revisión
+        """
+        queues = agt.queue_stats()
+        drops = sum(stats["drops"] for stats in queues.values()) + agt.buffer_stats.get("drops", 0)
+        if drops > self.buffer_drops.get(agt.name, 0):
+            self.logger.warning(f"Agente {agt.name} descartó datos. Buffer a disco: {agt.buffer_stats}. "
+                                f"Colas de entrada: {queues}")
+        elif agt.buffer_stats:
+            self.logger.debug(f"Buffers de agente {agt.name}. Buffer a disco: {agt.buffer_stats}. "
+                              f"Colas de entrada: {queues}")
+        self.buffer_drops[agt.name] = drops
+
+    def post_event(self, event, arg=None):
+        """
+        Encola un evento para la máquina de estados. Se puede llamar desde cualquier thread
+        """
+        self.events.put((event, arg, time.time()))
 
-            gps_datapoint = self.agents.GPS.get_data()
-            if gps_datapoint is not None:
-                self.coordinates.lat = gps_datapoint["latitude"]
-                self.coordinates.lon = gps_datapoint["longitude"]
-                dist = float(gps_datapoint['distance_delta'])
-                speed = float(gps_datapoint['spd_over_grnd'])
-                self.segment_current_length += dist
-                if speed < self.mgr_cfg['capture']['pause_speed']:
-                    self.logger.debug(f"GPS speed:{speed}")
-                    self.flags.vehicle_moving.clear()
-                if speed > self.mgr_cfg['capture']['resume_speed']:
-                    self.logger.debug(f"GPS speed:{speed}")
-                    self.flags.vehicle_moving.set()
-                if self.segment_current_length > self.mgr_cfg['capture']['splitting_distance']:
-                    self.logger.debug(f"GPS Dist. acum.: {self.segment_current_length}")
-                    self.flags.segment_ended.set()
-
-    def get_buttons(self):
-        while not self.flags.quit.is_set():
-            b = self.agents.ATMEGA.get_data()
-            if b is not None:
-                self.logger.debug(f"Boton {b} presionado")
-                if b == SINGLE_BUTTON:
-                    self.q_user_commands.put(KEY_START_STOP)
-            time.sleep(0.1)
+    def on_button(self, agent, button):
+        self.logger.debug(f"Boton {button} presionado")
+        if button == SINGLE_BUTTON:
+            self.post_event(Events.USER_COMMAND, KEY_START_STOP)
 
     def check_critical_agents_ready(self):
         critical_agents = [self.agents.OS1_LIDAR, self.agents.ATMEGA]
-        while not self.flags.quit.is_set():
-            all_ready = True
-            for agt in critical_agents:
-                if agt.enabled:
-                    if agt.agent_status != AgentStatus.STAND_BY and agt.agent_status != AgentStatus.CAPTURING:
-                        all_ready = False
-                        self.flags.critical_agents_ready.clear()
-                        self.logger.debug(f"Agente de {agt.name} reporta estado {agt.agent_status}")
-                        self.flags.quit.wait(1)
-            if all_ready:
-                self.flags.critical_agents_ready.set()
-            self.flags.quit.wait(0.1)
+        all_ready = True
+        for agt in critical_agents:
+            if agt.enabled:
+                if agt.agent_status != AgentStatus.STAND_BY and agt.agent_status != AgentStatus.CAPTURING:
+                    all_ready = False
+                    self.logger.debug(f"Agente de {agt.name} reporta estado {agt.agent_status}")
+        if all_ready:
+            self.flags.critical_agents_ready.set()
+        else:
+            self.flags.critical_agents_ready.clear()
+        return all_ready
 
     def get_keyboard_input(self):
         while not self.flags.quit.is_set():
             k = input()
             if k:
-                self.q_user_commands.put(k[0])
+                self.post_event(Events.USER_COMMAND, k[0])
             if k == KEY_QUIT:
                 break
 
     def end_capture(self):
+        self.request_all(Message.cmd_end_capture())
+
+    def request_all(self, msg):
+        """
+        Envía msg como solicitud a todos los agentes habilitados, en paralelo, y espera sus respuestas hasta ACK_TIMEOUT
+        :return: dict con la latencia de respuesta (s) de cada agente que respondió, por nombre
+        """
+        latencies = dict()
+        t0 = time.time()
+
+        def on_reply(future, name):
+            if not future.cancelled() and future.exception() is None and future.result() is not None:
+                latencies[name] = time.time() - t0
+
+        futures = dict()
         for agt in self.get_enabled_agents():
-            agt.send_msg(Message.cmd_end_capture())
+            future = agt.request(msg)
+            future.add_done_callback(lambda f, name=agt.name: on_reply(f, name))
+            futures[future] = agt.name
+        done, pending = wait(futures, timeout=ACK_TIMEOUT)
+        for future in pending:
+            future.cancel()
+            self.logger.warning(f"Agente {futures[future]} no respondió a {msg.typ} en {ACK_TIMEOUT} s")
+        for future in done:
+            if future.exception() is not None:
+                self.logger.debug(f"Agente {futures[future]} no recibió {msg.typ}: {future.exception()}")
+        return latencies
 
     def new_segment(self):
         self.segment_coords_ini = self.coordinates
         self.segment_current_length = 0
+        self.segment_distance_ini = self.gps_distance
         self.segment_current_init_time = time.time()
         self.folio = get_new_folio(self.sys_id)
         self.segment += 1
         self.capture_dir = self.get_new_capture_folder()
         self.logger.info(f"Nuevo segmento: {self.session}/{self.segment:04d}")
-        for agt in self.get_enabled_agents():
-            agt.send_msg(Message.new_capture(self.capture_dir))
+        latencies = self.request_all(Message.new_capture(self.capture_dir))
+        for name, latency in latencies.items():
+            count, total, maximum = self.ack_latency.get(name, (0, 0.0, 0.0))
+            self.ack_latency[name] = (count + 1, total + latency, max(maximum, latency))
+        self.logger.debug("Latencia de cambio de segmento por agente: " +
+                          ", ".join(f"{name} {1000 * latency:.1f} ms" for name, latency in latencies.items()))
 
     def update_segment_record(self):
         """
@@ -346,6 +422,150 @@ class FRAICAPManager:
         else:
             self.agents.ATMEGA.send_msg(Message.capture_off())
 
+    def time_to_segment_timeout(self):
+        """
+        :return: segundos hasta que se cumpla el tiempo máximo del segmento en curso, o None si no se está capturando
+        """
+        if self.state != States.CAPTURING:
+            return None
+        deadline = self.segment_current_init_time + self.mgr_cfg['capture']['splitting_time']
+        return max(0.0, deadline - time.time())
+
+    def on_user_command(self, cmd, event_time):
+        self.logger.debug(f"Procesando comando de usuario: '{cmd}'")
+        if cmd == KEY_QUIT:
+            self.flags.quit.set()
+        elif self.state == States.STARTING:
+            self.logger.warning(f"Comando '{cmd}' ignorado: agentes críticos aún no están listos")
+        elif cmd == KEY_START_STOP:
+            if self.state == States.CAPTURING or self.state == States.WAITING_SPEED:
+                self.logger.info("Sesión de captura finalizada por usuario")
+                self.end_capture()
+                self.change_state(States.STAND_BY)
+                self.log_split_latency()
+            elif self.state == States.STAND_BY:
+                self.logger.info("Sesión de captura iniciada por usuario. Esperando movimiento del vehículo")
+                self.new_session()
+                self.change_state(States.WAITING_SPEED)
+                self.check_motion()
+        elif cmd == FORCE_START:
+            if self.state == States.STAND_BY:
+                self.logger.info(
+                    "Sesión de captura forzada (sin esperar velocidad) iniciada por el usuario.")
+                self.flags.vehicle_moving.set()
+                self.new_session()
+                self.new_segment()
+                self.change_state(States.CAPTURING)
+
+    def on_gps_data(self, agent, gps_datapoint):
+        """
+        Callback de la interfaz del agente GPS (corre en el thread de la interfaz)
+        """
+        if self.gps_board is not None:
+            if self.gps_fix_pending:  # El evento en cola leerá el estado más reciente
+                return
+            self.gps_fix_pending = True
+        self.post_event(Events.GPS_FIX, gps_datapoint)
+
+    def read_gps_board(self):
+        """
+        :return: GPSState más reciente, o None si no se usa el board o aún no está disponible
+        """
+        if not self.use_gps_board:
+            return None
+        if self.gps_board is None:
+            self.gps_board = GPSBoard.attach()
+            if self.gps_board is None:
+                return None
+            self.logger.info("Leyendo estado del GPS desde memoria compartida")
+        state = self.gps_board.read()
+        if state is None or not state.fixes:
+            return None
+        return state
+
+    def on_gps_fix(self, gps_datapoint, event_time):
+        self.gps_fix_pending = False
+        state = self.read_gps_board()
+        if state is not None:
+            # La distancia del segmento es la diferencia de distancias acumuladas: es exacta aunque el manager
+            # no haya procesado todas las coordenadas
+            self.coordinates.lat = round(state.latitude, 5)
+            self.coordinates.lon = round(state.longitude, 5)
+            speed = state.speed
+            self.gps_distance = state.distance
+            self.segment_current_length = self.gps_distance - self.segment_distance_ini
+        else:
+            self.coordinates.lat = gps_datapoint["latitude"]
+            self.coordinates.lon = gps_datapoint["longitude"]
+            dist = float(gps_datapoint['distance_delta'])
+            speed = float(gps_datapoint['spd_over_grnd'])
+            self.segment_current_length += dist
+        if speed < self.mgr_cfg['capture']['pause_speed']:
+            self.logger.debug(f"GPS speed:{speed}")
+            self.flags.vehicle_moving.clear()
+        if speed > self.mgr_cfg['capture']['resume_speed']:
+            self.logger.debug(f"GPS speed:{speed}")
+            self.flags.vehicle_moving.set()
+        if self.state == States.CAPTURING and \
+                self.segment_current_length > self.mgr_cfg['capture']['splitting_distance']:
+            self.logger.debug(f"GPS Dist. acum.: {self.segment_current_length}")
+            self.split_segment(event_time)
+        self.check_motion()
+
+    def on_segment_timeout(self, arg, event_time):
+        if self.state != States.CAPTURING:
+            return
+        self.logger.debug(
+            f"Tiempo en útlimo tramo: {time.time() - self.segment_current_init_time:.1f} s. Generando nuevo tramo")
+        self.split_segment(event_time)
+
+    def on_agent_state(self, agent, event_time):
+        if agent is not None:
+            self.logger.debug(f"Agente {agent.name}: estado {agent.agent_status}, hardware {agent.hw_status}")
+        if self.check_critical_agents_ready() and self.state == States.STARTING:
+            self.logger.info("Agentes críticos están listos")
+            self.logger.info("Esperando eventos")
+            self.change_state(States.STAND_BY)
+
+    def check_motion(self):
+        """
+        Pausa o reanuda la captura según si el vehículo está en movimiento
+        """
+        if self.flags.vehicle_moving.is_set():
+            if self.state == States.WAITING_SPEED:
+                self.logger.info("Vehículo en movimiento. Inicia/reinicia captura")
+                self.new_segment()
+                self.change_state(States.CAPTURING)
+        else:
+            if self.state == States.CAPTURING:
+                self.logger.info("Vehículo detenido. Captura en pausa hasta que comience a moverse")
+                self.end_capture()
+                self.change_state(States.WAITING_SPEED)
+
+    def split_segment(self, event_time):
+        """
+        Cierra el segmento en curso y comienza uno nuevo
+        :param event_time: momento del evento que gatilló el corte, para medir la latencia de reacción
+        """
+        self.update_segment_record()
+        self.new_segment()
+        latency = time.time() - event_time
+        self.split_count += 1
+        self.split_latency_total += latency
+        self.split_latency_max = max(self.split_latency_max, latency)
+        self.logger.debug(f"Latencia de corte de segmento: {1000 * latency:.1f} ms")
+
+    def log_split_latency(self):
+        if self.split_count:
+            self.logger.info(f"Latencia de corte de segmento: {self.split_count} cortes, media "
+                             f"{1000 * self.split_latency_total / self.split_count:.1f} ms, "
+                             f"máx. {1000 * self.split_latency_max:.1f} ms")
+        self.split_count, self.split_latency_total, self.split_latency_max = 0, 0.0, 0.0
+        for name, (count, total, maximum) in self.ack_latency.items():
+            self.logger.info(f"Latencia de cambio de segmento en agente {name}: {count} cambios, media "
+                             f"{1000 * total / count:.1f} ms, máx. {1000 * maximum:.1f} ms")
+        self.ack_latency = dict()
+
     def get_enabled_agents(self):
         return (agt for agt in self.agents.items() if agt.enabled)
 
@@ -359,56 +579,37 @@ class FRAICAPManager:
         self.agents.DATA_COPY.send_data(self.mgr_cfg['sqlite']['db_file'])
 
         #  Aquí se implementa la lógica de alto nivel de la máquina de estados, basada en estados y eventos
-        self.logger.info("Esperando eventos")
-        self.change_state(States.STAND_BY)
+        self.logger.info("Esperando que agentes críticos esten listos para capturar")
+        handlers = {
+            Events.USER_COMMAND: self.on_user_command,
+            Events.GPS_FIX: self.on_gps_fix,
+            Events.AGENT_STATE: self.on_agent_state,
+            Events.SEGMENT_TIMEOUT: self.on_segment_timeout,
+        }
+        self.post_event(Events.AGENT_STATE)  # Evalúa si los agentes críticos ya están listos
         while not self.flags.quit.is_set():
             try:
-                if not self.q_user_commands.empty():
-                    cmd = self.q_user_commands.get()
-                    self.logger.debug(f"Procesando comando de usuario: '{cmd}'")
-                    if cmd == KEY_QUIT:
-                        self.flags.quit.set()
-                    elif cmd == KEY_START_STOP:
-                        if self.state == States.CAPTURING or self.state == States.WAITING_SPEED:
-                            self.logger.info("Sesión de captura finalizada por usuario")
-                            self.end_capture()
-                            self.change_state(States.STAND_BY)
-                        elif self.state == States.STAND_BY:
-                            self.logger.info("Sesión de captura iniciada por usuario. Esperando movimiento del vehículo")
-                            self.new_session()
-                            self.change_state(States.WAITING_SPEED)
-                    elif cmd == FORCE_START:
-                        if self.state == States.STAND_BY:
-                            self.logger.info(
-                                "Sesión de captura forzada (sin esperar velocidad) iniciada por el usuario.")
-                            self.flags.vehicle_moving.set()
-                            self.new_session()
-                            self.new_segment()
-                            self.change_state(States.CAPTURING)
-                elif self.flags.segment_ended.isSet():
-                    if self.state == States.CAPTURING:
-                        self.update_segment_record()
-                        self.new_segment()
-                    self.flags.segment_ended.clear()
-                else:
-                    if self.flags.vehicle_moving.is_set():
-                        if self.state == States.WAITING_SPEED:
-                            self.logger.info("Vehículo en movimiento. Inicia/reinicia captura")
-                            self.new_segment()
-                            self.change_state(States.CAPTURING)
-                    else:
-                        if self.state == States.CAPTURING:
-                            self.logger.info("Vehículo detenido. Captura en pausa hasta que comience a moverse")
-                            self.end_capture()
-                            self.change_state(States.WAITING_SPEED)
-                time.sleep(0.01)
+                try:
+                    event, arg, event_time = self.events.get(timeout=self.time_to_segment_timeout())
+                except Empty:
+                    event, arg = Events.SEGMENT_TIMEOUT, None
+                    event_time = self.segment_current_init_time + self.mgr_cfg['capture']['splitting_time']
+                handlers[event](arg, event_time)
             except KeyboardInterrupt:
                 self.flags.quit.set()
 
+        self.log_split_latency()
         self.logger.info("Terminando interfaces a agentes")
         for agt in self.get_enabled_agents():
             agt.quit()
         self.logger.info("Enviando mensaje de término a los agentes")
         self.end_agents()
         time.sleep(1)
+        if self.link_loop is not None:
+            self.link_loop.stop()
+        for agt in self.get_enabled_agents():
+            if agt.trace is not None:
+                agt.trace.close()
+        if self.gps_board is not None:
+            self.gps_board.close()
         self.logger.info("Aplicación terminada. Que tengas un buen día =)\nFIN\n\n\n")
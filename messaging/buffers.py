@@ -0,0 +1,221 @@
+"""
+Buffer FIFO acotado entre un productor y un consumidor, con política configurable para cuando se llena:
+
+    block:       el productor espera a que haya espacio, hasta block_timeout segundos; si no, el elemento se descarta
+    drop_oldest: se descarta el elemento más antiguo
+    drop_newest: se descarta el elemento nuevo
+    spill:       los elementos que no caben se escriben a un archivo temporal (spill_dir) y se recuperan en orden
+
+Lleva contadores de nivel máximo alcanzado (high_water), elementos descartados (drops), bytes derramados a disco
+(spill_bytes) y esperas del productor (blocked). Si se indica un logger, avisa la primera vez que se descarta un elemento. Tiene la interfaz de deque (append, popleft, len) que usan los
+agentes y la de cola (put, get, empty) que usa AgentInterface.
+
+Entre los datos se pueden intercalar marcas (Marker), por ejemplo para indicar dónde comienza un nuevo segmento de
+captura. Las marcas nunca se descartan ni hacen esperar al productor.
+"""
+import os
+import pickle
+import struct
+import tempfile
+import time
+from collections import deque
+from queue import Empty
+from threading import Condition, Lock
+
+POLICY_BLOCK = "block"
+POLICY_DROP_OLDEST = "drop_oldest"
+POLICY_DROP_NEWEST = "drop_newest"
+POLICY_SPILL = "spill"
+POLICIES = (POLICY_BLOCK, POLICY_DROP_OLDEST, POLICY_DROP_NEWEST, POLICY_SPILL)
+DEFAULT_BLOCK_TIMEOUT = 1.0  # segundos
+SPILL_CHUNK = 1000  # Elementos que se recuperan del archivo de derrame por lectura
+
+_spill_length = struct.Struct("<I")
+
+
+class Marker:
+    """
+    Elemento de control intercalado con los datos. value debe poder serializarse con pickle (política spill)
+    """
+    def __init__(self, value):
+        self.value = value
+
+
+class BoundedBuffer:
+    def __init__(self, maxlen=0, policy=POLICY_DROP_OLDEST, block_timeout=DEFAULT_BLOCK_TIMEOUT, spill_dir=None,
+                 logger=None):
+        """
+        :param maxlen: elementos en memoria. 0: sin límite (la política no se aplica)
+        :param policy: uno de POLICIES
+        :param block_timeout: espera máxima del productor con política block
+        :param spill_dir: directorio del archivo de derrame con política spill. None: directorio temporal del sistema
+        :param logger: logger donde se avisa el primer descarte
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"Política de buffer desconocida: {policy}")
+        self.maxlen = maxlen
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.spill_dir = spill_dir
+        self.logger = logger
+        self.__items = deque()
+        self.__lock = Lock()
+        self.__not_empty = Condition(self.__lock)
+        self.__not_full = Condition(self.__lock)
+        self.__spill = None  # Archivo de derrame, se crea al primer uso
+        self.__spill_read = 0  # Posición de lectura en el archivo de derrame
+        self.__spill_count = 0  # Elementos en el archivo de derrame pendientes de leer
+        self.__closed = False
+        self.high_water = 0
+        self.drops = 0
+        self.spill_bytes = 0
+        self.blocked = 0
+
+    @classmethod
+    def from_config(cls, cfg, logger=None):
+        """
+        :param cfg: dict con claves opcionales maxlen, policy, block_timeout y spill_dir. Sin policy se usa spill, que
+                    no pierde datos: descartarlos debe elegirse explícitamente
+        """
+        return cls(maxlen=int(cfg.get("maxlen", 0)), policy=cfg.get("policy", POLICY_SPILL),
+                   block_timeout=float(cfg.get("block_timeout", DEFAULT_BLOCK_TIMEOUT)),
+                   spill_dir=cfg.get("spill_dir"), logger=logger)
+
+    def __len__(self):
+        return len(self.__items) + self.__spill_count
+
+    def empty(self):
+        return not len(self)
+
+    def append(self, item):
+        """
+        :return: True si el elemento quedó en el buffer, False si se descartó
+        """
+        with self.__lock:
+            if isinstance(item, Marker) and not (self.policy == POLICY_SPILL and self.__spill_count):
+                pass  # Las marcas solo se derraman a disco si es necesario para mantener el orden
+            elif self.maxlen and (len(self.__items) >= self.maxlen or self.__spill_count):
+                if self.policy == POLICY_DROP_NEWEST:
+                    self.__count_drop()
+                    return False
+                if self.policy == POLICY_DROP_OLDEST:
+                    self.__drop_oldest()
+                elif self.policy == POLICY_SPILL:
+                    self.__spill_item(item)
+                    self.__not_empty.notify()
+                    return True
+                elif self.policy == POLICY_BLOCK:
+                    self.blocked += 1
+                    deadline = time.monotonic() + self.block_timeout
+                    while len(self.__items) >= self.maxlen and not self.__closed:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.__count_drop()
+                            return False
+                        self.__not_full.wait(remaining)
+            self.__items.append(item)
+            self.high_water = max(self.high_water, len(self))
+            self.__not_empty.notify()
+            return True
+
+    put = append
+
+    def popleft(self):
+        """
+        :return: el elemento más antiguo. Si el buffer está vacío lanza IndexError, como deque
+        """
+        with self.__lock:
+            if not self.__items and self.__spill_count:
+                self.__unspill()
+            item = self.__items.popleft()
+            self.__not_full.notify()
+            return item
+
+    def get(self, block=True, timeout=None):
+        """
+        :return: el elemento más antiguo. Si no hay (o no llega antes de timeout) lanza queue.Empty, como las colas
+        """
+        with self.__lock:
+            if block:
+                if not self.__not_empty.wait_for(lambda: len(self), timeout):
+                    raise Empty
+            elif not len(self):
+                raise Empty
+            if not self.__items:
+                self.__unspill()
+            item = self.__items.popleft()
+            self.__not_full.notify()
+            return item
+
+    def drain(self, timeout=None):
+        """
+        Espera hasta timeout a que haya elementos y retira todos los que están en memoria (o el siguiente bloque del
+        archivo de derrame)
+        :return: lista de elementos, en orden. Vacía si no llegó ninguno
+        """
+        with self.__lock:
+            if not self.__not_empty.wait_for(lambda: len(self), timeout):
+                return []
+            if not self.__items:
+                self.__unspill()
+            items = list(self.__items)
+            self.__items.clear()
+            self.__not_full.notify_all()
+            return items
+
+    def stats(self):
+        return {"length": len(self), "high_water": self.high_water, "drops": self.drops,
+                "spill_bytes": self.spill_bytes, "blocked": self.blocked}
+
+    def close(self):
+        """
+        Libera al productor si está esperando y elimina el archivo de derrame
+        """
+        with self.__lock:
+            self.__closed = True
+            self.__not_full.notify_all()
+            if self.__spill is not None:
+                self.__spill.close()
+                self.__spill = None
+                self.__spill_count = 0
+
+    def __drop_oldest(self):
+        for i, old in enumerate(self.__items):
+            if not isinstance(old, Marker):
+                del self.__items[i]
+                self.__count_drop()
+                return
+
+    def __count_drop(self):
+        if not self.drops and self.logger is not None:
+            self.logger.warning(f"Buffer lleno ({self.maxlen} elementos): se comienzan a descartar datos "
+                                f"(política {self.policy})")
+        self.drops += 1
+
+    def __spill_item(self, item):
+        if self.__spill is None:
+            if self.spill_dir:
+                os.makedirs(self.spill_dir, exist_ok=True)
+            self.__spill = tempfile.TemporaryFile(dir=self.spill_dir)
+        record = pickle.dumps(item, pickle.HIGHEST_PROTOCOL)
+        self.__spill.seek(0, os.SEEK_END)
+        self.__spill.write(_spill_length.pack(len(record)))
+        self.__spill.write(record)
+        self.__spill_count += 1
+        self.spill_bytes += _spill_length.size + len(record)
+        self.high_water = max(self.high_water, len(self))
+
+    def __unspill(self):
+        """
+        Pasa a memoria los elementos más antiguos del archivo de derrame
+        """
+        self.__spill.seek(self.__spill_read)
+        for _ in range(min(SPILL_CHUNK, self.maxlen, self.__spill_count)):
+            length, = _spill_length.unpack(self.__spill.read(_spill_length.size))
+            self.__items.append(pickle.loads(self.__spill.read(length)))
+            self.__spill_count -= 1
+        self.__spill_read = self.__spill.tell()
+        if not self.__spill_count:  # Archivo leído completo: se reutiliza desde el inicio
+            self.__spill.seek(0)
+            self.__spill.truncate()
+            self.__spill_read = 0
@@ -0,0 +1,80 @@
+"""
+Último estado del GPS en memoria compartida.
+
+El agente GPS actualiza en su lugar un único registro (posición, velocidad, rumbo, distancia acumulada y timestamp), y
+el manager u otros agentes lo leen cuando lo necesitan, sin mensajes ni colas. Como la distancia es acumulada, la
+distancia recorrida entre dos lecturas es exacta aunque el lector no haya visto todas las coordenadas intermedias.
+
+Se protege con un seqlock: el escritor incrementa la secuencia antes (queda impar) y después (queda par) de escribir,
+y el lector reintenta si la secuencia era impar o cambió durante la lectura. Hay un único escritor.
+"""
+import math
+import struct
+from collections import namedtuple
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+GPS_BOARD_NAME = "fraicap_gps"
+MAX_READ_RETRIES = 1000
+
+GPSState = namedtuple("GPSState", "timestamp latitude longitude speed course distance fixes")
+_seq = struct.Struct("<Q")
+_state = struct.Struct("<ddddddQ")
+
+
+class GPSBoard:
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+
+    @classmethod
+    def create(cls, name=GPS_BOARD_NAME):
+        """
+        Crea el registro (escritor). Si quedó uno de una ejecución anterior, lo reutiliza
+        """
+        try:
+            shm = SharedMemory(name=name, create=True, size=_seq.size + _state.size)
+        except FileExistsError:
+            shm = SharedMemory(name=name)
+        board = cls(shm, owner=True)
+        board.update(0.0, math.nan, math.nan, math.nan, math.nan, 0.0, 0)
+        return board
+
+    @classmethod
+    def attach(cls, name=GPS_BOARD_NAME):
+        """
+        Se conecta al registro de otro proceso (lector)
+        :return: GPSBoard, o None si el escritor aún no lo crea
+        """
+        try:
+            shm = SharedMemory(name=name)
+        except FileNotFoundError:
+            return None
+        resource_tracker.unregister(shm._name, "shared_memory")  # Solo el escritor debe eliminarlo
+        return cls(shm, owner=False)
+
+    def update(self, timestamp, latitude, longitude, speed, course, distance, fixes):
+        buf = self.shm.buf
+        seq = _seq.unpack_from(buf, 0)[0] + 1
+        _seq.pack_into(buf, 0, seq)
+        _state.pack_into(buf, _seq.size, timestamp, latitude, longitude, speed, course, distance, fixes)
+        _seq.pack_into(buf, 0, seq + 1)
+
+    def read(self):
+        """
+        :return: GPSState, o None si no se logró una lectura consistente
+        """
+        buf = self.shm.buf
+        for _ in range(MAX_READ_RETRIES):
+            seq = _seq.unpack_from(buf, 0)[0]
+            if seq % 2:
+                continue
+            state = _state.unpack_from(buf, _seq.size)
+            if _seq.unpack_from(buf, 0)[0] == seq:
+                return GPSState(*state)
+        return None
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -1,6 +1,112 @@
+"""
+Mensajes entre manager y agentes.
+
+Hay dos formatos de serialización:
+    YAML (versión de protocolo 1): texto ASCII terminado en EOT. Es el formato original y el que se usa mientras no
+        se haya negociado otro.
+    Binario (versión 2): MAGIC (byte no ASCII), código de tipo (B), largo del payload (I) y el payload, que es el
+        argumento codificado con una etiqueta de tipo por valor (ver _encode_value). No lleva EOT.
+Al conectarse, el manager envía HELLO con la versión más alta que soporta, y el agente responde con la versión que
+usarán ambos. Un extremo que no conoce HELLO lo ignora y la conexión sigue en YAML. Los receptores aceptan ambos
+formatos.
+
+Desde la versión 3, un mensaje puede llevar un identificador de correlación (msg_id): el manager lo asigna a una
+solicitud y el agente lo copia en la respuesta. En binario se indica con RPC_FLAG en el código de tipo, y el
+identificador (q) va al inicio del payload; en YAML es la clave 'id', que las versiones anteriores ignoran.
+"""
+import struct
+
 import yaml
 from agents.constants import AgentStatus, HWStates
 
+PROTOCOL_YAML = 1
+PROTOCOL_BINARY = 2
+PROTOCOL_RPC = 3  # Binario con identificadores de correlación
+PROTOCOL_VERSION = PROTOCOL_RPC  # Versión más alta soportada
+RPC_FLAG = 0x80  # En el código de tipo binario: el payload comienza con el identificador de correlación
+
+_header = struct.Struct("<BI")  # Código de tipo, largo del payload
+_int = struct.Struct("<q")
+_float = struct.Struct("<d")
+_length = struct.Struct("<I")
+DEFAULT_DECODER_BUFFER = 64 * 1024
+
+
+def _encode_value(value, out):
+    """
+    Codifica value y agrega las partes a la lista out. Soporta None, bool, int, float, str, bytes, list/tuple y dict
+    """
+    if value is None:
+        out.append(b"N")
+    elif value is True:
+        out.append(b"T")
+    elif value is False:
+        out.append(b"F")
+    elif isinstance(value, int):
+        out.append(b"i" + _int.pack(value))
+    elif isinstance(value, float):
+        out.append(b"f" + _float.pack(value))
+    elif isinstance(value, str):
+        data = value.encode("utf-8")
+        out.append(b"s" + _length.pack(len(data)))
+        out.append(data)
+    elif isinstance(value, (bytes, bytearray)):
+        out.append(b"b" + _length.pack(len(value)))
+        out.append(bytes(value))
+    elif isinstance(value, (list, tuple)):
+        out.append(b"l" + _length.pack(len(value)))
+        for item in value:
+            _encode_value(item, out)
+    elif isinstance(value, dict):
+        out.append(b"d" + _length.pack(len(value)))
+        for key, item in value.items():
+            _encode_value(key, out)
+            _encode_value(item, out)
+    elif hasattr(value, "__index__"):  # e.g. enteros de numpy
+        _encode_value(int(value), out)
+    elif hasattr(value, "__float__"):
+        _encode_value(float(value), out)
+    else:
+        raise TypeError(f"Tipo no soportado en mensaje binario: {type(value).__name__}")
+
+
+def _decode_value(buf, offset):
+    """
+    :param buf: bytes o memoryview
+    :return: (valor, offset siguiente)
+    """
+    tag = buf[offset:offset + 1].tobytes() if isinstance(buf, memoryview) else buf[offset:offset + 1]
+    offset += 1
+    if tag == b"N":
+        return None, offset
+    if tag == b"T":
+        return True, offset
+    if tag == b"F":
+        return False, offset
+    if tag == b"i":
+        return _int.unpack_from(buf, offset)[0], offset + _int.size
+    if tag == b"f":
+        return _float.unpack_from(buf, offset)[0], offset + _float.size
+    if tag in (b"s", b"b", b"l", b"d"):
+        n = _length.unpack_from(buf, offset)[0]
+        offset += _length.size
+        if tag == b"s":
+            return bytes(buf[offset:offset + n]).decode("utf-8"), offset + n
+        if tag == b"b":
+            return bytes(buf[offset:offset + n]), offset + n
+        if tag == b"l":
+            items = []
+            for _ in range(n):
+                item, offset = _decode_value(buf, offset)
+                items.append(item)
+            return items, offset
+        d = dict()
+        for _ in range(n):
+            key, offset = _decode_value(buf, offset)
+            d[key], offset = _decode_value(buf, offset)
+        return d, offset
+    raise ValueError(f"Etiqueta de tipo desconocida en mensaje binario: {tag!r}")
+
 
 class Message:
     """
@@ -18,6 +124,12 @@ class Message:
     QUIT = "QUIT"
     QUERY_AGENT_STATE = "QUERY_AGENT_STATE"
     QUERY_HW_STATE = "QUERY_HW_STATE"
+    HEALTH = "HEALTH"  # Métricas periódicas de salud del agente/sensor (dict)
+    HELLO = "HELLO"  # Negociación de versión de protocolo (int)
+    DATA_RING = "DATA_RING"  # El agente enviará los DATA por un anillo en memoria compartida (nombre del anillo)
+    DATA_READY = "DATA_READY"  # Hay mensajes nuevos en el anillo de datos
+    REPLY = "REPLY"  # Respuesta a una solicitud que no tiene un mensaje de respuesta propio (resultado o None)
+    BUFFER_STATS = "BUFFER_STATS"  # Contadores del buffer de datos a disco del agente (dict, ver buffers.py)
 
     # System states
     SYS_ONLINE = "ONLINE"
@@ -31,20 +143,44 @@ class Message:
     SYS_EXT_DRIVE_FULL = "SYS_EXT_DRIVE_FULL"
 
     EOT = b'\x1E'     # Separador de mensajes
+    MAGIC = b'\xB5'   # Primer byte de un mensaje binario. No puede iniciar un mensaje YAML (ASCII)
+    HEADER_SIZE = 1 + _header.size
 
-    def __init__(self, _type, arg=''):
+    def __init__(self, _type, arg='', msg_id=None):
+        """
+        :param msg_id: identificador de correlación de una solicitud o de su respuesta. None en mensajes sin respuesta
+        """
         self.typ = _type
         self.arg = arg
+        self.msg_id = msg_id
 
     def __str__(self):
         return f"typ: {self.typ}, arg: {self.arg}"
 
     @classmethod
     def deserialize(cls, msg):
-        if isinstance(msg, (bytes, bytearray)):
-            msg = msg.rstrip(cls.EOT).decode('ascii')
+        if isinstance(msg, (bytes, bytearray, memoryview)) and msg[:1] == cls.MAGIC:
+            return cls.__deserialize_binary(msg)
+        if isinstance(msg, (bytes, bytearray, memoryview)):
+            msg = bytes(msg).rstrip(cls.EOT).decode('ascii')
         d = dict(yaml.safe_load(msg))
-        return cls(d['type'], d['arg'])
+        return cls(d['type'], d['arg'], d.get('id'))
+
+    @classmethod
+    def __deserialize_binary(cls, msg):
+        code, length = _header.unpack_from(msg, 1)
+        buf = memoryview(msg)[cls.HEADER_SIZE:cls.HEADER_SIZE + length]
+        msg_id, offset = None, 0
+        if code & RPC_FLAG:
+            code &= ~RPC_FLAG
+            msg_id, = _int.unpack_from(buf, 0)
+            offset = _int.size
+        if code:
+            arg, _ = _decode_value(buf, offset)
+            return cls(_TYPES[code], arg, msg_id)
+        typ, offset = _decode_value(buf, offset)  # Tipo sin código asignado: va como string antes del argumento
+        arg, _ = _decode_value(buf, offset)
+        return cls(typ, arg, msg_id)
 
     def __eq__(self, other):
         if isinstance(other, str):
@@ -56,10 +192,36 @@ class Message:
         else:
             return False
 
-    def serialize(self):
-        m = yaml.dump({'type': self.typ, 'arg': self.arg}).encode('ascii')
+    def serialize(self, version=PROTOCOL_YAML):
+        """
+        :param version: versión de protocolo negociada con el otro extremo (PROTOCOL_YAML o PROTOCOL_BINARY)
+        """
+        if version >= PROTOCOL_BINARY:
+            return self.__serialize_binary(version)
+        d = {'type': self.typ, 'arg': self.arg}
+        if self.msg_id is not None:
+            d['id'] = self.msg_id
+        m = yaml.dump(d).encode('ascii')
         return m + self.EOT
 
+    def __serialize_binary(self, version):
+        parts = []
+        code = _TYPE_CODES.get(self.typ, 0)
+        if self.msg_id is not None and version >= PROTOCOL_RPC:
+            code |= RPC_FLAG
+            parts.append(_int.pack(self.msg_id))
+        if not code & ~RPC_FLAG:
+            _encode_value(self.typ, parts)
+        _encode_value(self.arg, parts)
+        payload = b"".join(parts)
+        return self.MAGIC + _header.pack(code, len(payload)) + payload
+
+    def reply(self, _type=REPLY, arg=None):
+        """
+        :return: mensaje de respuesta a esta solicitud, con su mismo identificador de correlación
+        """
+        return Message(_type, arg, self.msg_id)
+
     @classmethod
     def cmd_quit(cls):
         return cls(cls.QUIT)
@@ -129,3 +291,123 @@ class Message:
     @classmethod
     def data_msg(cls, data):
         return cls(cls.DATA, data)
+
+    @classmethod
+    def health(cls, metrics):
+        return cls(cls.HEALTH, metrics)
+
+    @classmethod
+    def hello(cls, version=PROTOCOL_VERSION):
+        return cls(cls.HELLO, version)
+
+    @classmethod
+    def data_ring(cls, name):
+        return cls(cls.DATA_RING, name)
+
+    @classmethod
+    def data_ready(cls):
+        return cls(cls.DATA_READY)
+
+    @classmethod
+    def buffer_stats(cls, stats):
+        return cls(cls.BUFFER_STATS, stats)
+
+
+# Códigos de tipo del formato binario. No reutilizar ni cambiar códigos existentes; el 0 indica un tipo sin código
+_TYPES = {
+    1: Message.COMMAND,
+    2: Message.SYS_STATE,
+    3: Message.HW_STATE,
+    4: Message.AGENT_STATE,
+    5: Message.NEW_CAPTURE,
+    6: Message.END_CAPTURE,
+    7: Message.DATA,
+    8: Message.QUIT,
+    9: Message.QUERY_AGENT_STATE,
+    10: Message.QUERY_HW_STATE,
+    11: Message.HEALTH,
+    12: Message.HELLO,
+    13: Message.DATA_RING,
+    14: Message.DATA_READY,
+    15: Message.BUFFER_STATS,
+    16: Message.REPLY,
+}
+_TYPE_CODES = {typ: code for code, typ in _TYPES.items()}
+_MAGIC_BYTE = Message.MAGIC[0]
+
+
+class StreamDecoder:
+    """
+    Separa los mensajes (YAML o binarios) de un stream TCP. Lee bloques grandes a un buffer reutilizable y entrega los
+    mensajes completos; los bytes de un mensaje incompleto quedan en el buffer hasta la siguiente lectura.
+    El buffer crece si llega un mensaje más grande que él
+    """
+    def __init__(self, size=DEFAULT_DECODER_BUFFER):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0  # Inicio del primer mensaje pendiente
+        self.end = 0  # Fin de los datos recibidos
+
+    def reset(self):
+        """
+        Descarta los datos pendientes (e.g. al reconectar)
+        """
+        self.start = self.end = 0
+
+    def read(self, sock):
+        """
+        Hace una lectura del socket (bloqueante, según la configuración del socket)
+        :return: lista de mensajes completos recibidos (puede ser vacía)
+        """
+        self.__make_room()
+        n = sock.recv_into(self.view[self.end:])
+        if not n:
+            raise ConnectionResetError
+        self.end += n
+        return self.__split()
+
+    def feed(self, data):
+        """
+        Agrega datos ya recibidos por otro medio
+        :return: lista de mensajes completos
+        """
+        while data:
+            self.__make_room()
+            n = min(len(data), len(self.buffer) - self.end)
+            self.view[self.end:self.end + n] = data[:n]
+            self.end += n
+            data = data[n:]
+        return self.__split()
+
+    def __make_room(self):
+        if self.end < len(self.buffer):
+            return
+        pending = self.end - self.start
+        if self.start:  # Mueve al inicio lo pendiente
+            self.view[:pending] = self.view[self.start:self.end]
+        else:  # El buffer completo es un solo mensaje incompleto
+            self.view.release()
+            self.buffer.extend(bytes(len(self.buffer)))
+            self.view = memoryview(self.buffer)
+        self.start, self.end = 0, pending
+
+    def __split(self):
+        messages = []
+        buf, start, end = self.buffer, self.start, self.end
+        while start < end:
+            if buf[start] == _MAGIC_BYTE:
+                if end - start < Message.HEADER_SIZE:
+                    break
+                size = Message.HEADER_SIZE + _header.unpack_from(buf, start + 1)[1]
+                if end - start < size:
+                    break
+                messages.append(Message.deserialize(self.view[start:start + size]))
+                start += size
+            else:
+                eot = buf.find(Message.EOT, start, end)
+                if eot < 0:
+                    break
+                messages.append(Message.deserialize(self.view[start:eot]))
+                start = eot + 1
+        self.start, self.end = (0, 0) if start == end else (start, end)
+        return messages
@@ -0,0 +1,77 @@
+"""
+Registro de los mensajes entre manager y agentes, para reproducir después el tráfico de una captura real
+(ver test/replay_trace.py).
+
+Formato del archivo de traza:
+    Encabezado: MAGIC, momento de inicio (d, time.time()), lado (B, SIDE_MANAGER o SIDE_AGENT), largo (I) y nombre
+                del agente (utf-8)
+    Registros: momento relativo al inicio (d, según time.monotonic()), dirección (B, IN u OUT), largo (I) y el
+               mensaje serializado en formato binario (con su msg_id, si tiene)
+"""
+import struct
+import time
+from threading import Lock
+
+from messaging.messaging import Message, PROTOCOL_VERSION
+
+MAGIC = b"FRAITRC\x01"
+IN = 0  # Mensaje recibido por el extremo que registra
+OUT = 1  # Mensaje enviado por el extremo que registra
+SIDE_MANAGER = 0  # Traza registrada por el manager (AgentInterface)
+SIDE_AGENT = 1  # Traza registrada por el agente
+TRACE_FILE_BUFFER = 256 * 1024
+
+_trace_header = struct.Struct("<dBI")
+_record_header = struct.Struct("<dBI")
+
+
+class TraceRecorder:
+    def __init__(self, file_path, name, side):
+        """
+        :param name: nombre del agente, como en use_agents (e.g. gps)
+        :param side: SIDE_MANAGER o SIDE_AGENT
+        """
+        self.name = name
+        self.__file = open(file_path, "wb", buffering=TRACE_FILE_BUFFER)
+        self.__lock = Lock()  # Registran varios threads
+        self.__t0 = time.monotonic()
+        encoded = name.encode("utf-8")
+        self.__file.write(MAGIC + _trace_header.pack(time.time(), side, len(encoded)) + encoded)
+        self.records = 0
+
+    def record(self, direction, msg: Message):
+        data = msg.serialize(PROTOCOL_VERSION)
+        with self.__lock:
+            if self.__file.closed:
+                return
+            self.__file.write(_record_header.pack(time.monotonic() - self.__t0, direction, len(data)))
+            self.__file.write(data)
+            self.records += 1
+
+    def close(self):
+        with self.__lock:
+            self.__file.close()
+
+
+def read_trace(file_path):
+    """
+    :return: (nombre del agente, lado, momento de inicio, lista de (momento relativo, dirección, Message))
+    """
+    with open(file_path, "rb") as f:
+        data = f.read()
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{file_path} no es un archivo de traza")
+    offset = len(MAGIC)
+    start_time, side, name_length = _trace_header.unpack_from(data, offset)
+    offset += _trace_header.size
+    name = data[offset:offset + name_length].decode("utf-8")
+    offset += name_length
+    records = []
+    while offset + _record_header.size <= len(data):
+        t, direction, length = _record_header.unpack_from(data, offset)
+        offset += _record_header.size
+        if offset + length > len(data):  # Registro incompleto: la aplicación terminó sin cerrar la traza
+            break
+        records.append((t, direction, Message.deserialize(data[offset:offset + length])))
+        offset += length
+    return name, side, start_time, records
@@ -0,0 +1,157 @@
+"""
+Transportes para la conexión entre manager y agentes.
+
+    tcp:  socket TCP (por defecto). Es el único que permite agentes en otra máquina
+    unix: socket de dominio Unix, para agentes en la misma máquina. La ruta se deriva del puerto configurado, de modo
+          que no requiere configuración adicional
+
+Además, los mensajes DATA de un agente pueden ir por un anillo en memoria compartida (DataRing), con un único
+productor (el agente) y un único consumidor (el manager). El socket se sigue usando para los demás mensajes, y para
+avisar al manager que hay datos nuevos (DATA_READY) solo cuando el anillo estaba vacío: mientras el manager no se pone
+al día, el agente escribe en el anillo sin hacer llamadas al sistema.
+
+Estructura del anillo: encabezado con head (bytes escritos, solo lo modifica el productor) y tail (bytes leídos, solo
+lo modifica el consumidor), ambos contadores crecientes, seguido del área de datos. Cada registro es el largo (I) y un
+mensaje serializado en formato binario. Si un registro no cabe al final del área, se marca con largo WRAP y se
+continúa al inicio.
+"""
+import os
+import socket
+import struct
+import tempfile
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+from messaging.messaging import Message, PROTOCOL_BINARY
+
+TRANSPORT_TCP = "tcp"
+TRANSPORT_UNIX = "unix"
+TRANSPORTS = (TRANSPORT_TCP, TRANSPORT_UNIX)
+UNIX_SOCKET_DIR = tempfile.gettempdir()
+DEFAULT_RING_SIZE = 1024 * 1024
+WRAP = 0xFFFFFFFF  # Largo de registro que indica que el siguiente registro está al inicio del área de datos
+
+_ring_header = struct.Struct("<QQ")  # head, tail
+_record_length = struct.Struct("<I")
+
+
+def unix_socket_path(port):
+    return os.path.join(UNIX_SOCKET_DIR, f"fraicap_{port}.sock")
+
+
+def listen_socket(transport, host, port):
+    """
+    :return: socket enlazado (sin listen) en el que el agente espera la conexión del manager
+    """
+    if transport == TRANSPORT_UNIX:
+        path = unix_socket_path(port)
+        if os.path.exists(path):  # Quedó de una ejecución anterior
+            os.unlink(path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(path)
+        return sock
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind((host, port))
+    return sock
+
+
+def connect_socket(transport, host, port):
+    """
+    :return: socket conectado al agente. Si el agente aún no escucha, lanza ConnectionRefusedError
+    """
+    if transport == TRANSPORT_UNIX:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(unix_socket_path(port))
+        except (FileNotFoundError, ConnectionRefusedError):
+            sock.close()
+            raise ConnectionRefusedError
+        return sock
+    return socket.create_connection((host, port))
+
+
+class DataRing:
+    def __init__(self, name=None, size=DEFAULT_RING_SIZE):
+        """
+        :param name: nombre de un anillo existente al que conectarse (consumidor). Si es None, se crea uno (productor)
+        :param size: tamaño del área de datos, solo al crear
+        """
+        self.owner = name is None
+        if self.owner:
+            self.shm = SharedMemory(create=True, size=_ring_header.size + size)
+            _ring_header.pack_into(self.shm.buf, 0, 0, 0)
+        else:
+            self.shm = SharedMemory(name=name)
+            # Solo el productor debe eliminar la memoria compartida al terminar
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+        self.name = self.shm.name
+        self.data = self.shm.buf[_ring_header.size:]
+        self.size = len(self.data)
+        self.dropped = 0  # Mensajes descartados por anillo lleno (productor)
+
+    def __counters(self):
+        return _ring_header.unpack_from(self.shm.buf, 0)
+
+    def reset(self):
+        """
+        Descarta lo pendiente. Solo el productor, cuando no hay consumidor conectado
+        """
+        head, _ = self.__counters()
+        _ring_header.pack_into(self.shm.buf, 0, head, head)
+
+    def put(self, msg: Message):
+        """
+        Escribe un mensaje (productor)
+        :return: True si el consumidor estaba al día (el anillo estaba vacío) y hay que avisarle, False si no hace
+                 falta avisar o si el mensaje se descartó por falta de espacio
+        """
+        record = msg.serialize(PROTOCOL_BINARY)
+        length = _record_length.size + len(record)
+        head, tail = self.__counters()
+        offset = head % self.size
+        padding = 0
+        if offset + length > self.size:  # No cabe al final: salta al inicio
+            padding = self.size - offset
+        if head + padding + length - tail > self.size:
+            self.dropped += 1
+            return False
+        if padding:
+            if padding >= _record_length.size:
+                _record_length.pack_into(self.data, offset, WRAP)
+            offset = 0
+        _record_length.pack_into(self.data, offset, len(record))
+        self.data[offset + _record_length.size:offset + length] = record
+        new_head = head + padding + length
+        struct.pack_into("<Q", self.shm.buf, 0, new_head)  # Publica el registro
+        return self.__counters()[1] == head
+
+    def get_all(self):
+        """
+        Lee todos los mensajes disponibles (consumidor)
+        :return: lista de mensajes
+        """
+        messages = []
+        while True:
+            head, tail = self.__counters()
+            if head == tail:
+                return messages
+            while tail < head:
+                offset = tail % self.size
+                if self.size - offset < _record_length.size:
+                    tail += self.size - offset
+                    continue
+                length, = _record_length.unpack_from(self.data, offset)
+                if length == WRAP:
+                    tail += self.size - offset
+                    continue
+                start = offset + _record_length.size
+                messages.append(Message.deserialize(bytes(self.data[start:start + length])))
+                tail += _record_length.size + length
+            # Libera lo leído y vuelve a revisar, por si el productor escribió sin avisar mientras se leía
+            struct.pack_into("<Q", self.shm.buf, 8, tail)
+
+    def close(self):
+        self.data.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,81 @@
+"""
+Benchmark de los modos de sincronización a disco de los archivos de salida (ver agents/durability.py).
+Escribe un segmento de datos tipo CSV por lotes, como el escritor de los agentes, con cada combinación de modo y
+reserva de espacio, y reporta:
+    throughput: MB/s, incluido el cierre del archivo (donde ocurre la sincronización del modo close)
+    escritura máx: la llamada a write más lenta, que es lo que espera el escritor (y lo que se acumula en el buffer)
+    pérdida máx: datos escritos y aún no sincronizados en el peor momento, que se perderían con un corte de energía.
+                 Con none la acota solo el kernel (dirty_expire_centisecs); con close es el segmento completo
+Se debe correr en el mismo medio que usan los agentes (e.g. la tarjeta SD del equipo); en tmpfs fdatasync no cuesta.
+Uso: python test/bench_durability.py [directorio] [MB por segmento]
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)) + os.sep + "..")
+
+from agents.durability import Durability, SegmentFile, DURABILITY_NONE, DURABILITY_PERIODIC, DURABILITY_CLOSE
+
+DEFAULT_MB = 64
+BATCH = 1000  # Registros por escritura
+WRITE_BUFFER = 1024 * 1024
+PREALLOCATE = 16 * 1024 * 1024
+LINE = "2020-03-12 16:43:10.123456;-33.4372123;-70.6506987;527.3;12.06;157.2;9;0.9;1;A"
+CONFIGS = [
+    (DURABILITY_NONE, {}),
+    (DURABILITY_CLOSE, {}),
+    (DURABILITY_PERIODIC, dict(sync_bytes=1024 * 1024, sync_interval=0)),
+    (DURABILITY_PERIODIC, dict(sync_bytes=4 * 1024 * 1024, sync_interval=0)),
+    (DURABILITY_PERIODIC, dict(sync_bytes=16 * 1024 * 1024, sync_interval=0)),
+]
+
+
+def kernel_writeback():
+    try:
+        with open("/proc/sys/vm/dirty_expire_centisecs") as f:
+            return int(f.read()) / 100
+    except OSError:
+        return None
+
+
+def run(folder, megabytes, mode, params, preallocate):
+    durability = Durability(mode, preallocate=preallocate, **params)
+    file_path = os.path.join(folder, "bench_durability.csv")
+    data = os.linesep.join([LINE] * BATCH) + os.linesep
+    batches = max(1, megabytes * 1024 * 1024 // len(data))
+    t0 = time.perf_counter()
+    output_file = SegmentFile(open(file_path, "w", buffering=WRITE_BUFFER), durability)
+    max_write = 0.0
+    for _ in range(batches):
+        t = time.perf_counter()
+        output_file.write(data)
+        max_write = max(max_write, time.perf_counter() - t)
+    output_file.close()
+    elapsed = time.perf_counter() - t0
+    assert os.path.getsize(file_path) == batches * len(data)
+    os.remove(file_path)
+    loss = output_file.written if mode == DURABILITY_CLOSE else output_file.max_unsynced
+    return output_file.written / elapsed / 1e6, max_write, output_file.syncs, loss
+
+
+if __name__ == "__main__":
+    target = sys.argv[1] if len(sys.argv) > 1 else tempfile.gettempdir()
+    mb = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_MB
+    print(f"Directorio: {target}. Segmento de {mb} MB, lotes de {BATCH} registros")
+    print(f"{'modo':<22} {'reserva':>8} {'MB/s':>8} {'escritura máx (ms)':>19} {'fdatasync':>10} "
+          f"{'pérdida máx':>20}")
+    for cfg_mode, cfg_params in CONFIGS:
+        for reserve in (0, PREALLOCATE):
+            throughput, write_max, syncs, lost = run(target, mb, cfg_mode, cfg_params, reserve)
+            label = cfg_mode
+            if cfg_mode == DURABILITY_PERIODIC:
+                label += f" {cfg_params['sync_bytes'] // (1024 * 1024)} MB"
+            if cfg_mode == DURABILITY_NONE:
+                writeback = kernel_writeback()
+                loss_label = f"writeback {writeback:.0f} s" if writeback is not None else "sin límite"
+            else:
+                loss_label = f"{lost / 1e6:.1f} MB"
+            print(f"{label:<22} {reserve // (1024 * 1024):>5} MB {throughput:>8.1f} {1000 * write_max:>19.2f} "
+                  f"{syncs:>10} {loss_label:>20}")
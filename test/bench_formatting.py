@@ -0,0 +1,120 @@
+"""
+Benchmark del formateo de muestras a CSV: en el thread de adquisición (texto por muestra, como antes) o en el escritor
+por lotes (el thread de adquisición encola los valores, ver agents/records.py). Usa el registro del IMU del LiDAR y el
+escritor de AbstractHWAgent.
+Un thread de adquisición simulado genera muestras a la tasa indicada y reporta, para cada modo:
+    latencia: tiempo desde que la muestra está disponible hasta que queda encolada (mediana, p99 y máx)
+    CPU:      tiempo de CPU del thread de adquisición en el tratamiento de las muestras (sin la espera entre muestras) y
+              del escritor, como fracción del tiempo de la prueba
+Verifica además que los dos modos generan archivos idénticos.
+Uso: python test/bench_formatting.py [muestras] [tasa (Hz)]
+"""
+import os
+import shutil
+import statistics
+import struct
+import sys
+import tempfile
+import time
+from random import Random
+from threading import Thread
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)) + os.sep + "..")
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)) + os.sep + ".." + os.sep + "agents")
+
+from agents.abstract_agent import AbstractHWAgent
+from agent_os1_imu import RECORD, HEADER
+
+DEFAULT_SAMPLES = 20000
+DEFAULT_RATE = 1000
+
+
+class BenchAgent(AbstractHWAgent):
+    def __init__(self, folder, batched):
+        AbstractHWAgent.__init__(self, config_section="bench")
+        self.output_file_name = "imu_lidar.csv"
+        self.output_file_is_binary = False
+        self.output_file_header = HEADER
+        if batched:
+            self.record_format = RECORD
+            self.config = dict(output_format="csv")
+            self._AbstractHWAgent__configure_records()
+        self.writer_cpu = 0.0
+        self.writer = Thread(target=self.__writer)
+        self.writer.start()
+        self._AbstractHWAgent__update_capture_file(folder)
+
+    def __writer(self):
+        self._AbstractHWAgent__file_writer()
+        self.writer_cpu = time.thread_time()
+
+    def _agent_process_manager_message(self, msg): pass
+    def _pre_capture_file_update(self, closed_file, snapshot): pass
+    def _agent_config(self): pass
+    def _agent_run_non_hw_threads(self): pass
+    def _agent_finalize(self): pass
+    def _agent_hw_start(self): return True
+    def _agent_hw_stop(self): pass
+    def _agent_check_hw_connected(self): return True
+
+
+def samples(n):
+    """
+    Muestras como las entrega imu_packet.unpack (floats de precisión simple), con el momento de cada una
+    """
+    rnd = Random(1)
+    t0 = 1583456789.0
+    for i in range(n):
+        ta = 10 ** 12 + i * 10 ** 7
+        floats = struct.unpack("6f", struct.pack("6f", *[rnd.gauss(0, 5) for _ in range(6)]))
+        yield t0 + i / 100, (0, ta, ta + 1000) + floats
+
+
+def acquire(agent, n, rate, batched, result):
+    latencies = []
+    cpu = 0.0
+    start = time.perf_counter()
+    for i, (t, (ti, ta, tg, ax, ay, az, gx, gy, gz)) in enumerate(samples(n)):
+        while time.perf_counter() < start + i / rate:  # Espera la siguiente muestra
+            time.sleep(0.0002)
+        t_sample = time.perf_counter()
+        cpu0 = time.thread_time()
+        if batched:
+            agent.dq_formatted_data.append((t, int(ta / 1000), int(tg / 1000), ax, ay, az, gx, gy, gz))
+        else:
+            agent.dq_formatted_data.append(f"{t:.3f};{int(ta / 1000)};{int(tg / 1000)};"
+                                           f"{ax:.3f};{ay:.3f};{az:.3f};{gx:.3f};{gy:.3f};{gz:.3f}")
+        cpu += time.thread_time() - cpu0
+        latencies.append(time.perf_counter() - t_sample)
+    result.update(latencies=latencies, cpu=cpu, elapsed=time.perf_counter() - start)
+
+
+def run(folder, n, rate, batched):
+    agent = BenchAgent(folder, batched)
+    result = dict()
+    acq = Thread(target=acquire, args=(agent, n, rate, batched, result))
+    acq.start()
+    acq.join()
+    time.sleep(1)  # El escritor termina de vaciar el buffer
+    agent.flags.quit.set()
+    agent.writer.join()
+    lat = sorted(result["latencies"])
+    return (statistics.median(lat), lat[int(0.99 * len(lat))], lat[-1], result["cpu"] / result["elapsed"],
+            agent.writer_cpu / result["elapsed"])
+
+
+if __name__ == "__main__":
+    n_samples = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_SAMPLES
+    sample_rate = float(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_RATE
+    print(f"{n_samples} muestras a {sample_rate:.0f} Hz")
+    print(f"{'modo':<32} {'mediana (us)':>13} {'p99 (us)':>9} {'máx (us)':>9} {'CPU adq.':>9} {'CPU escritor':>13}")
+    files = []
+    for mode_batched, label in ((False, "texto en adquisición"), (True, "valores, formateo por lote")):
+        tmp = tempfile.mkdtemp()
+        med, p99, worst, cpu_acq, cpu_writer = run(tmp, n_samples, sample_rate, mode_batched)
+        print(f"{label:<32} {1e6 * med:>13.1f} {1e6 * p99:>9.1f} {1e6 * worst:>9.1f} {100 * cpu_acq:>8.1f}% "
+              f"{100 * cpu_writer:>12.1f}%")
+        with open(os.path.join(tmp, "imu_lidar.csv"), "rb") as f:
+            files.append(f.read())
+        shutil.rmtree(tmp)
+    print(f"Archivos idénticos: {files[0] == files[1]} ({len(files[0])} bytes)")
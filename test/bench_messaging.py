@@ -0,0 +1,94 @@
+"""
+Benchmark de serialización de mensajes: formato YAML (protocolo 1) vs. binario (protocolo 2).
+Para cada tipo de mensaje reporta mensajes/s y tiempo de CPU por mensaje (serializar + deserializar), y el tamaño en
+bytes. Verifica que ambos formatos reconstruyan el mismo mensaje.
+Luego mide la recepción por socket de mensajes GPS: lectura byte a byte (recv(1), como antes) vs. StreamDecoder.
+Uso: python test/bench_messaging.py [num_mensajes]
+"""
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)) + os.sep + "..")
+
+from messaging.messaging import Message, StreamDecoder, PROTOCOL_BINARY, PROTOCOL_YAML
+
+GPS_DATAPOINT = {
+    "sys_timestamp": 1700000000.123456,
+    "distance_delta": 4.87,
+    "latitude": -37.218540833333336,
+    "longitude": -73.22029516666667,
+    "timestamp": "12:34:56",
+    "spd_over_grnd": 9.5,
+    "true_course": 45,
+    "gps_qual": "2",
+    "num_sats": "9",
+    "horizontal_dil": "0.9",
+}
+MESSAGES = {
+    "query_state": Message.cmd_query_agent_state(),
+    "agent_state": Message.agent_state("CAPTURING"),
+    "gps_data": Message.data_msg(GPS_DATAPOINT),
+    "health": Message.health({"pps": 3840.0, "loss": 0.12, "inv": 1.5, "kdrop": 0, "conv_ms": 0.104}),
+}
+
+
+def bench(msg, version, n):
+    wall0, cpu0 = time.perf_counter(), time.process_time()
+    for _ in range(n):
+        Message.deserialize(msg.serialize(version))
+    wall, cpu = time.perf_counter() - wall0, time.process_time() - cpu0
+    return n / wall, 1e6 * cpu / n
+
+
+def recv_bytewise(sock, n):
+    """
+    Recepción original: un recv(1) por byte (solo YAML)
+    """
+    cmd, count = b'', 0
+    while count < n:
+        bt = sock.recv(1)
+        if bt == Message.EOT:
+            Message.deserialize(cmd)
+            cmd, count = b'', count + 1
+        else:
+            cmd += bt
+
+
+def recv_decoder(sock, n):
+    decoder, count = StreamDecoder(), 0
+    while count < n:
+        count += len(decoder.read(sock))
+
+
+def bench_stream(receive, version, n):
+    data = Message.data_msg(GPS_DATAPOINT).serialize(version) * n
+    tx, rx = socket.socketpair()
+    sender = threading.Thread(target=tx.sendall, args=(data,))
+    wall0, cpu0 = time.perf_counter(), time.process_time()
+    sender.start()
+    receive(rx, n)
+    wall, cpu = time.perf_counter() - wall0, time.process_time() - cpu0
+    sender.join()
+    tx.close()
+    rx.close()
+    return n / wall, 1e6 * cpu / n
+
+
+if __name__ == "__main__":
+    num_messages = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    print(f"{'mensaje':<12} {'formato':<8} {'bytes':>6} {'msg/s':>10} {'CPU us/msg':>11}")
+    for name, msg in MESSAGES.items():
+        for version, label in ((PROTOCOL_YAML, "yaml"), (PROTOCOL_BINARY, "binario")):
+            decoded = Message.deserialize(msg.serialize(version))
+            assert (decoded.typ, decoded.arg) == (msg.typ, msg.arg), f"{name}/{label}: el mensaje no se reconstruye"
+            rate, cpu = bench(msg, version, num_messages)
+            print(f"{name:<12} {label:<8} {len(msg.serialize(version)):>6} {rate:>10.0f} {cpu:>11.1f}")
+
+    print(f"\n{'recepción':<20} {'formato':<8} {'msg/s':>10} {'CPU us/msg':>11}")
+    for receive, version, label in ((recv_bytewise, PROTOCOL_YAML, "yaml"), (recv_decoder, PROTOCOL_YAML, "yaml"),
+                                    (recv_decoder, PROTOCOL_BINARY, "binario")):
+        rate, cpu = bench_stream(receive, version, num_messages)
+        print(f"{receive.__name__:<20} {label:<8} {rate:>10.0f} {cpu:>11.1f}")
@@ -0,0 +1,107 @@
+"""
+Benchmark de transportes entre agente y manager: TCP, socket Unix y anillo en memoria compartida (con aviso por socket
+Unix). Un proceso productor envía mensajes DATA (datapoint GPS, formato binario) y el proceso principal los recibe.
+El anillo lo crea el productor y lo anuncia con DATA_RING, como un agente. El productor corre en un intérprete aparte
+(no con multiprocessing) para que, como en la aplicación, cada proceso tenga su propio resource_tracker.
+Reporta el throughput (mensajes/s, sin pausas) y la latencia de un sentido (mediana y p99, a ~1000 mensajes/s), medida
+con el timestamp que lleva cada mensaje (time.perf_counter es común a todos los procesos en Linux).
+Uso: python test/bench_transports.py [num_mensajes]
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)) + os.sep + "..")
+
+from messaging.messaging import Message, StreamDecoder, PROTOCOL_BINARY
+from messaging.transport import DataRing, TRANSPORT_UNIX, TRANSPORTS, connect_socket, listen_socket
+from bench_messaging import GPS_DATAPOINT
+
+HOST = "127.0.0.1"
+PORT = 30999
+SHM = "shm"
+PACE = 0.001  # Segundos entre mensajes en la medición de latencia
+
+
+def producer(transport, n, pace):
+    sock = connect_socket(TRANSPORT_UNIX if transport == SHM else transport, HOST, PORT)
+    ring = None
+    if transport == SHM:
+        ring = DataRing()
+        sock.sendall(Message.data_ring(ring.name).serialize(PROTOCOL_BINARY))
+    datapoint = dict(GPS_DATAPOINT)
+    for _ in range(n):
+        datapoint["sys_timestamp"] = time.perf_counter()
+        msg = Message.data_msg(datapoint)
+        if ring is None:
+            sock.sendall(msg.serialize(PROTOCOL_BINARY))
+        else:
+            dropped = ring.dropped
+            notify = ring.put(msg)
+            while ring.dropped != dropped:  # Anillo lleno: espera y reintenta
+                dropped = ring.dropped
+                time.sleep(0.0001)
+                notify = ring.put(msg)
+            if notify:
+                sock.sendall(Message.data_ready().serialize(PROTOCOL_BINARY))
+        if pace:
+            time.sleep(pace)
+    sock.sendall(Message.cmd_quit().serialize(PROTOCOL_BINARY))
+    sock.recv(1)  # Espera a que el consumidor termine antes de cerrar el anillo
+    if ring is not None:
+        ring.close()
+    sock.close()
+
+
+def consume(transport, n, pace):
+    """
+    :return: (mensajes/s, latencias en segundos)
+    """
+    server = listen_socket(TRANSPORT_UNIX if transport == SHM else transport, HOST, PORT)
+    server.listen(1)
+    p = subprocess.Popen([sys.executable, os.path.realpath(__file__), "--producer", transport, str(n), str(pace)])
+    conn, _ = server.accept()
+    ring = None
+    decoder = StreamDecoder()
+    latencies = []
+    t0 = time.perf_counter()
+    done = False
+    while not done:
+        for msg in decoder.read(conn):
+            if msg.typ == Message.DATA_RING:
+                ring = DataRing(msg.arg)
+                continue
+            if msg.typ == Message.DATA_READY:
+                batch = ring.get_all()
+            elif msg.typ == Message.QUIT:
+                done = True
+                break
+            else:
+                batch = [msg]
+            now = time.perf_counter()
+            latencies.extend(now - m.arg["sys_timestamp"] for m in batch)
+    elapsed = time.perf_counter() - t0
+    conn.sendall(b"x")
+    p.wait()
+    conn.close()
+    server.close()
+    if ring is not None:
+        ring.close()
+    assert len(latencies) == n, f"{transport}: se recibieron {len(latencies)} de {n} mensajes"
+    return n / elapsed, latencies
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--producer"]:
+        producer(sys.argv[2], int(sys.argv[3]), float(sys.argv[4]))
+        sys.exit(0)
+    num_messages = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    print(f"{'transporte':<10} {'msg/s':>10} {'lat. mediana (us)':>18} {'lat. p99 (us)':>14}")
+    for transport in TRANSPORTS + (SHM,):
+        rate, _ = consume(transport, num_messages, 0)
+        _, latencies = consume(transport, min(num_messages, 1000), PACE)
+        latencies.sort()
+        print(f"{transport:<10} {rate:>10.0f} {1e6 * statistics.median(latencies):>18.1f} "
+              f"{1e6 * latencies[int(0.99 * len(latencies))]:>14.1f}")
@@ -0,0 +1,242 @@
+"""
+Reproduce trazas de mensajes (ver messaging/trace.py) más rápido que en tiempo real, para comparar cambios en el
+protocolo o en la máquina de estados del manager contra capturas reales.
+
+    manager: el script toma el lugar de los agentes de las trazas y se conecta con un manager real. Escucha en los
+             puertos de los agentes (agents/config.yaml) y, una vez que el manager se conectó a todos, le envía los
+             mensajes que los agentes le enviaron en la captura (estados, datos, salud), con los tiempos originales
+             divididos por --speed. Responde las consultas y solicitudes del manager.
+             Reporta la latencia de reacción del manager: para cada mensaje que recibe de él, el tiempo desde el
+             último mensaje enviado por cualquiera de los agentes, por tipo (e.g. NEW_CAPTURE después de la
+             coordenada GPS que completa la distancia de un segmento).
+             Se debe iniciar antes que el manager, para que los agentes que este lanza no tomen los puertos.
+    agent:   el script toma el lugar del manager y envía a los agentes en ejecución los mensajes que recibieron en la
+             captura. Los que eran solicitudes se envían como tales, y se reporta la latencia de respuesta de cada
+             agente por tipo de mensaje.
+
+Uso: python test/replay_trace.py manager|agent traza.trc [traza.trc ...] [--speed N]
+     --speed 0: sin esperas entre mensajes. Por defecto 10
+"""
+import os
+import statistics
+import sys
+import time
+from threading import Thread, Event, Lock, Barrier
+
+import yaml
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)) + os.sep + "..")
+
+from agents.constants import AgentStatus, HWStates
+from agents_interface import AgentInterface
+from messaging.messaging import Message, StreamDecoder, PROTOCOL_YAML, PROTOCOL_BINARY, PROTOCOL_VERSION
+from messaging.trace import read_trace, IN, OUT, SIDE_AGENT
+from messaging.transport import TRANSPORT_TCP, listen_socket
+
+AGENTS_CONFIG_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "agents", "config.yaml")
+HOST = "127.0.0.1"
+DEFAULT_SPEED = 10
+CONNECT_TIMEOUT = 60  # segundos que se espera la conexión de los extremos
+DRAIN_TIME = 1  # segundos que se siguen recibiendo mensajes al terminar la reproducción
+# Mensajes propios de la conexión, que cada extremo genera por sí mismo y no se reproducen
+LINK_MESSAGES = (Message.HELLO, Message.DATA_RING, Message.DATA_READY, Message.QUIT)
+
+
+def split_trace(file_path):
+    """
+    :return: (nombre del agente, [(momento, mensaje) del agente al manager], [(momento, mensaje) del manager al agente])
+    """
+    name, side, _, records = read_trace(file_path)
+    from_agent = OUT if side == SIDE_AGENT else IN
+    to_manager = [(t, msg) for t, direction, msg in records if direction == from_agent]
+    to_agent = [(t, msg) for t, direction, msg in records if direction != from_agent]
+    return name, to_manager, to_agent
+
+
+def wait_until(t0, t, speed):
+    if speed:
+        delay = t0 + t / speed - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def report(title, latencies):
+    """
+    :param latencies: dict tipo de mensaje -> lista de latencias (s)
+    """
+    print(f"\n{title}")
+    print(f"{'mensaje':<24} {'n':>6} {'mediana (ms)':>13} {'p90 (ms)':>9} {'p99 (ms)':>9} {'máx (ms)':>9}")
+    for typ, values in sorted(latencies.items()):
+        values = sorted(values)
+        print(f"{typ:<24} {len(values):>6} {1000 * statistics.median(values):>13.2f} "
+              f"{1000 * values[int(0.9 * len(values))]:>9.2f} {1000 * values[int(0.99 * len(values))]:>9.2f} "
+              f"{1000 * values[-1]:>9.2f}")
+
+
+class FakeAgent:
+    """
+    Toma el lugar de un agente ante el manager (modo manager)
+    """
+    def __init__(self, name, messages, port, transport, shared):
+        self.name = name
+        self.messages = [(t, msg) for t, msg in messages if msg.typ not in LINK_MESSAGES and msg.msg_id is None]
+        self.shared = shared
+        self.sock = listen_socket(transport, HOST, port)
+        self.sock.listen(1)
+        self.sock.settimeout(CONNECT_TIMEOUT)
+        self.conn = None
+        self.protocol = PROTOCOL_YAML
+        self.send_lock = Lock()
+        self.state = AgentStatus.STAND_BY
+        self.hw_state = HWStates.NOMINAL
+
+    def send(self, msg):
+        with self.send_lock:
+            self.conn.sendall(msg.serialize(self.protocol))
+        self.shared.last_sent = time.monotonic()
+
+    def receive(self):
+        decoder = StreamDecoder()
+        self.conn.settimeout(0.5)
+        while not self.shared.done.is_set():
+            try:
+                messages = decoder.read(self.conn)
+            except TimeoutError:
+                continue
+            except (ConnectionResetError, OSError):
+                return
+            now = time.monotonic()
+            for msg in messages:
+                if msg.typ == Message.HELLO:
+                    self.protocol = min(int(msg.arg), PROTOCOL_VERSION)
+                    with self.send_lock:
+                        self.conn.sendall(Message.hello(self.protocol).serialize())
+                    continue
+                if msg.typ == Message.QUERY_AGENT_STATE:
+                    self.send(msg.reply(Message.AGENT_STATE, self.state))
+                    continue
+                if msg.typ == Message.QUERY_HW_STATE:
+                    self.send(msg.reply(Message.HW_STATE, self.hw_state))
+                    continue
+                if self.shared.started.is_set():
+                    with self.shared.lock:
+                        self.shared.latencies.setdefault(msg.typ, []).append(now - self.shared.last_sent)
+                if msg.msg_id is not None:
+                    self.send(msg.reply())
+
+    def run(self):
+        self.conn, _ = self.sock.accept()
+        Thread(target=self.receive, daemon=True).start()
+        while self.protocol < PROTOCOL_BINARY and not self.shared.done.wait(0.01):
+            pass
+        self.shared.barrier.wait()
+        t0 = self.shared.t0
+        for t, msg in self.messages:
+            wait_until(t0, t, self.shared.speed)
+            if msg.typ == Message.AGENT_STATE:
+                self.state = msg.arg
+            elif msg.typ == Message.HW_STATE:
+                self.hw_state = msg.arg
+            self.send(msg)
+
+
+class Shared:
+    def __init__(self, speed, n_agents):
+        self.speed = speed
+        self.done = Event()
+        self.started = Event()
+        self.lock = Lock()
+        self.latencies = dict()
+        self.last_sent = time.monotonic()
+        self.t0 = 0
+        self.barrier = Barrier(n_agents, action=self.__start)
+
+    def __start(self):
+        self.t0 = time.monotonic()
+        self.started.set()
+
+
+def replay_to_manager(traces, speed):
+    agents_cfg = yaml.safe_load(open(AGENTS_CONFIG_FILE))
+    transport = agents_cfg.get("transport", TRANSPORT_TCP)
+    shared = Shared(speed, len(traces))
+    agents = []
+    for name, to_manager, _ in traces:
+        agents.append(FakeAgent(name, to_manager, agents_cfg[f"agent_{name}"]["local_port"], transport, shared))
+    print(f"Esperando conexión del manager a {', '.join(a.name for a in agents)}")
+    threads = [Thread(target=agent.run, daemon=True) for agent in agents]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    elapsed = time.monotonic() - shared.t0
+    time.sleep(DRAIN_TIME)
+    shared.done.set()
+    n = sum(len(agent.messages) for agent in agents)
+    print(f"{n} mensajes reproducidos en {elapsed:.1f} s")
+    report("Latencia de reacción del manager (desde el último mensaje de un agente)", shared.latencies)
+    for agent in agents:
+        agent.conn.close()
+        agent.sock.close()
+
+
+def replay_to_agents(traces, speed):
+    agents_cfg = yaml.safe_load(open(AGENTS_CONFIG_FILE))
+    quit_flag = Event()
+    latencies = dict()
+    lock = Lock()
+    data_count = dict()
+    interfaces = []
+    for name, _, to_agent in traces:
+        agt = AgentInterface(name, quit_flag)
+        agt.set_ip_address(HOST, agents_cfg[f"agent_{name}"]["local_port"], agents_cfg.get("transport", TRANSPORT_TCP))
+        data_count[name] = 0
+        agt.on_data = lambda a, data: data_count.__setitem__(a.name, data_count[a.name] + 1)
+        agt.connect()
+        interfaces.append((agt, [(t, msg) for t, msg in to_agent if msg.typ not in LINK_MESSAGES]))
+    deadline = time.monotonic() + CONNECT_TIMEOUT
+    while any(agt.protocol < PROTOCOL_BINARY for agt, _ in interfaces) and time.monotonic() < deadline:
+        time.sleep(0.1)
+
+    def replay(agt, messages, t0):
+        def on_reply(future, typ, sent):
+            if not future.cancelled() and future.exception() is None:
+                with lock:
+                    latencies.setdefault(f"{agt.name}/{typ}", []).append(time.monotonic() - sent)
+
+        for t, msg in messages:
+            wait_until(t0, t, speed)
+            if msg.msg_id is None:
+                agt.send_msg(Message(msg.typ, msg.arg))
+            else:
+                sent = time.monotonic()
+                future = agt.request(Message(msg.typ, msg.arg))
+                future.add_done_callback(lambda f, typ=msg.typ, sent=sent: on_reply(f, typ, sent))
+
+    t0 = time.monotonic()
+    threads = [Thread(target=replay, args=(agt, messages, t0), daemon=True) for agt, messages in interfaces]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    elapsed = time.monotonic() - t0
+    time.sleep(DRAIN_TIME)
+    quit_flag.set()
+    for agt, messages in interfaces:
+        print(f"Agente {agt.name}: {len(messages)} mensajes enviados, {data_count[agt.name]} datos recibidos")
+        agt.disconnect()
+    print(f"Reproducción en {elapsed:.1f} s")
+    report("Latencia de respuesta de los agentes", latencies)
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    replay_speed = DEFAULT_SPEED
+    if "--speed" in args:
+        i = args.index("--speed")
+        replay_speed = float(args[i + 1])
+        del args[i:i + 2]
+    if len(args) < 2 or args[0] not in ("manager", "agent"):
+        print(__doc__)
+        sys.exit(1)
+    trace_list = [split_trace(file_path) for file_path in args[1:]]
+    if args[0] == "manager":
+        replay_to_manager(trace_list, replay_speed)
+    else:
+        replay_to_agents(trace_list, replay_speed)
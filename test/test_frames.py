@@ -0,0 +1,77 @@
+"""
+Pruebas de agents/os1/frames.py: pérdida contada por FrameAssembler ante paquetes desordenados y reinicios del stream.
+Uso: python -m pytest test/test_frames.py
+"""
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)) + os.sep + "..")
+
+from agents.os1.frames import FrameAssembler, MAX_FRAME_GAP
+from agents.os1.lidar_packet import AZIMUTH_BLOCK_COUNT, AZIMUTH_DTYPE
+
+FIRST_MEASUREMENT_ID = 0
+LAST_MEASUREMENT_ID = 3 * AZIMUTH_BLOCK_COUNT  # 4 paquetes por frame
+
+
+def packet(frame_id, position):
+    blocks = np.zeros(AZIMUTH_BLOCK_COUNT, dtype=AZIMUTH_DTYPE)
+    blocks["measurement_id"] = position * AZIMUTH_BLOCK_COUNT + np.arange(AZIMUTH_BLOCK_COUNT)
+    blocks["frame_id"] = frame_id
+    return blocks.tobytes()
+
+
+def feed(assembler, frame_ids):
+    for frame_id in frame_ids:
+        for position in range(assembler.packets_per_frame):
+            assembler.add(packet(frame_id, position))
+
+
+def test_complete_frames():
+    assembler = FrameAssembler(FIRST_MEASUREMENT_ID, LAST_MEASUREMENT_ID)
+    feed(assembler, [10, 11, 12])
+    frames, incomplete, expected, received = assembler.take_stats()
+    assert (frames, incomplete, expected, received) == (2, 0, 8, 8)
+
+
+def test_skipped_frames_are_lost():
+    assembler = FrameAssembler(FIRST_MEASUREMENT_ID, LAST_MEASUREMENT_ID)
+    feed(assembler, [10, 13, 14])
+    frames, incomplete, expected, received = assembler.take_stats()
+    assert (frames, incomplete, expected, received) == (4, 2, 16, 8)
+
+
+def test_wrap_around_is_not_a_reset():
+    assembler = FrameAssembler(FIRST_MEASUREMENT_ID, LAST_MEASUREMENT_ID)
+    feed(assembler, [0xFFFE, 0xFFFF, 0, 1])
+    assert assembler.take_stats() == (3, 0, 12, 12)
+    assert assembler.stream_resets == 0
+
+
+def test_out_of_order_packet_is_dropped():
+    assembler = FrameAssembler(FIRST_MEASUREMENT_ID, LAST_MEASUREMENT_ID)
+    feed(assembler, [10, 11])
+    assert not assembler.add(packet(10, 2))  # Paquete atrasado del frame anterior
+    feed(assembler, [12])
+    frames, incomplete, expected, received = assembler.take_stats()
+    assert (frames, incomplete, expected, received) == (2, 0, 8, 8)
+    assert assembler.late_packets == 1
+    assert assembler.frame.frame_id == 12
+
+
+def test_frame_id_reset_is_not_loss():
+    assembler = FrameAssembler(FIRST_MEASUREMENT_ID, LAST_MEASUREMENT_ID)
+    feed(assembler, [30000, 30001, 0, 1, 2])
+    frames, incomplete, expected, received = assembler.take_stats()
+    assert (frames, incomplete, expected, received) == (4, 0, 16, 16)
+    assert assembler.stream_resets == 1
+
+
+def test_large_forward_gap_is_a_reset():
+    assembler = FrameAssembler(FIRST_MEASUREMENT_ID, LAST_MEASUREMENT_ID)
+    feed(assembler, [100, 100 + MAX_FRAME_GAP + 1, 100 + MAX_FRAME_GAP + 2])
+    frames, incomplete, expected, received = assembler.take_stats()
+    assert (frames, incomplete, received) == (2, 0, 8)
+    assert assembler.stream_resets == 1
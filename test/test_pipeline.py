@@ -0,0 +1,62 @@
+"""
+Pruebas de agents/os1/pipeline.py: resultados en orden y falla de un proceso convertidor.
+Uso: python -m pytest test/test_pipeline.py
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)) + os.sep + "..")
+
+from agents.os1.lidar_packet import AZIMUTH_BLOCK_COUNT, AZIMUTH_DTYPE, CHANNEL_BLOCK_COUNT
+from agents.os1.pipeline import ConversionPipeline, ConversionWorkerError
+from agents.os1.utils import build_projection_table, xyz_points_pack_np
+
+COLUMNS = 1024
+CHANNELS = tuple(range(2, CHANNEL_BLOCK_COUNT, 4))
+TABLE = build_projection_table(np.linspace(-16, 16, CHANNEL_BLOCK_COUNT), np.zeros(CHANNEL_BLOCK_COUNT), COLUMNS)
+
+
+def packet(position):
+    blocks = np.zeros(AZIMUTH_BLOCK_COUNT, dtype=AZIMUTH_DTYPE)
+    blocks["measurement_id"] = position * AZIMUTH_BLOCK_COUNT + np.arange(AZIMUTH_BLOCK_COUNT)
+    blocks["status"] = 0xFFFFFFFF
+    return blocks.tobytes()
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_results_in_order():
+    packets = [packet(position) for position in range(20)]
+    results = []
+    pipeline = ConversionPipeline(2, CHANNELS, TABLE, on_result=lambda packed, blocks, latency: results.append(packed))
+    try:
+        for n in range(0, len(packets), 3):
+            pipeline.submit(packets[n:n + 3])
+        assert wait_for(lambda: len(results) == len(packets))
+    finally:
+        pipeline.close()
+    assert results == [xyz_points_pack_np(p, CHANNELS, TABLE)[0] for p in packets]
+
+
+def test_dead_worker_raises():
+    pipeline = ConversionPipeline(2, CHANNELS, TABLE, on_result=lambda packed, blocks, latency: None)
+    try:
+        worker = pipeline._ConversionPipeline__processes[0]
+        worker.kill()
+        worker.join(1)
+        with pytest.raises(ConversionWorkerError):
+            deadline = time.time() + 5
+            while time.time() < deadline:
+                pipeline.submit([packet(0)])
+                time.sleep(0.01)
+    finally:
+        pipeline.close()
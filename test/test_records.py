@@ -0,0 +1,40 @@
+"""
+Pruebas de agents/records.py: registros de tipos mixtos (como los del GPS) y su conversión al CSV.
+Uso: python -m pytest test/test_records.py
+"""
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)) + os.sep + "..")
+
+from agents.records import RecordFormat
+
+# Mismos tipos que el registro del GPS (agents/agent_gps.py)
+RECORD = RecordFormat([("sys_timestamp", "d", ""), ("latitude", "d", ""), ("timestamp", "24s", ""),
+                       ("true_course", "d", ""), ("gps_qual", "4s", "")], "sys_timestamp;latitude;timestamp;"
+                                                                            "true_course;gps_qual")
+
+
+def to_text(values, logger=None):
+    return RECORD.to_text(RECORD.to_array([RECORD.pack_values(values, logger)])).decode("utf-8")
+
+
+def test_float_fix_matches_str_join():
+    values = (1583456789.123, -37.21854, "12:34:56", 45.0, "2")
+    assert to_text(values) == ";".join(str(v) for v in values) + os.linesep
+
+
+def test_invalid_number_is_nan():
+    assert to_text((1.5, "", "12:34:56", None, "1")).split(";")[1] == "nan"
+
+
+def test_truncated_text_is_logged_once(caplog):
+    logger = logging.getLogger("test_records")
+    record = RecordFormat([("gps_qual", "4s", "")])
+    with caplog.at_level(logging.WARNING, logger="test_records"):
+        record.pack_values(("12345",), logger)
+        record.pack_values(("123456",), logger)
+        record.pack_values(("1234",), logger)
+    assert len(caplog.records) == 1
+    assert "gps_qual" in caplog.records[0].getMessage()
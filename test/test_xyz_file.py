@@ -0,0 +1,52 @@
+"""
+Pruebas de agents/os1/xyz_file.py: índices y slices de XYZSegments sobre varios archivos.
+Uso: python -m pytest test/test_xyz_file.py
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)) + os.sep + "..")
+
+from agents.os1 import raw_file
+from agents.os1.lidar_packet import XYZ_AZIMUTH_DTYPE
+from agents.os1.xyz_file import XYZSegments, open_xyz
+
+SEGMENT_SIZES = (10, 7, 13)
+
+
+@pytest.fixture
+def segments(tmp_path):
+    paths = []
+    start = 0
+    for i, size in enumerate(SEGMENT_SIZES):
+        blocks = np.zeros(size, dtype=XYZ_AZIMUTH_DTYPE)
+        blocks["timestamp"] = np.arange(start, start + size)
+        start += size
+        path = tmp_path / f"{i:04d}.bin"
+        blocks.tofile(path)
+        paths.append(path)
+    return XYZSegments(paths)
+
+
+@pytest.mark.parametrize("index", [slice(None), slice(3, 25), slice(12, 15), slice(28, 5, -1), slice(None, None, -1),
+                                   slice(1, 29, 3), slice(25, 2, -4), slice(5, 5), slice(20, 3)])
+def test_slices(segments, index):
+    expected = np.arange(sum(SEGMENT_SIZES))[index]
+    assert segments[index]["timestamp"].tolist() == expected.tolist()
+
+
+def test_integer_index(segments):
+    assert segments[12]["timestamp"] == 12
+    assert segments[-1]["timestamp"] == sum(SEGMENT_SIZES) - 1
+    with pytest.raises(IndexError):
+        segments[sum(SEGMENT_SIZES)]
+
+
+def test_raw_file_is_rejected(tmp_path):
+    path = tmp_path / "lidar.raw"
+    path.write_bytes(raw_file.MAGIC + bytes(5000))
+    with pytest.raises(ValueError):
+        open_xyz(path)